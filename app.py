@@ -1,9 +1,15 @@
 import socket
 import threading
 import settings
-from server.message_handler import message_handler
 from server.tcp_server import TCPServer
+from server.async_tcp_server import AsyncTCPServer
+from server.prefork import PreforkSupervisor
 
 if __name__ == "__main__":
-    server = TCPServer()
+    if settings.SERVER_WORKERS > 0:
+        server = PreforkSupervisor()
+    elif settings.SERVER_MODE == 'asyncio':
+        server = AsyncTCPServer()
+    else:
+        server = TCPServer()
     server.start_server()
@@ -1 +1,6 @@
 from iso8583.iso8583 import Iso8583
+from iso8583.iso_spec import Spec, loadSpec
+from iso8583.iso_pool import Iso8583Pool
+from iso8583.iso_batch import decodeBatch, parseMany, BatchResult
+from iso8583.iso_framer import Iso8583Framer
+from iso8583.iso_subfields import TLV, FixedSubfields
@@ -1,9 +1,15 @@
 import sys
 from iso8583.iso_errors import *
+from iso8583.iso_spec import Spec
+from iso8583.iso_codecs import EBCDIC_TO_ASCII, ASCII_TO_EBCDIC
+from iso8583.iso_subfields import TLV, FixedSubfields, SUBFIELDS_TLV, SUBFIELDS_TLV_HEX
 import struct
 import binascii
+import re
 import ebcdic
 import time
+import datetime
+import hashlib
 
 
 class Iso8583:
@@ -42,21 +48,31 @@ class Iso8583:
         print ('This is the ISO8583 complete package to sent over the TCPIP network %s' % iso.getNetworkISO())
 
 """
+    # Instance attributes, see __init__
+    __slots__ = ('spec', 'BITMAP', 'BITMAP_VALUES', 'BITMAP_HEX', 'BITMAP_format', 'MESSAGE_TYPE_INDICATION', 'MTI_format',
+                 'DEBUG', 'BITMAP_UPPERCASE', 'hdrlen', 'hdr', 'LAZY', 'ISO_BUFFER', 'ISO_INDEX', 'NETWORK_ISO', 'RAW_ISO',
+                 'STRICT', 'FINGERPRINT')
+
     # Attributes
-    # Bits to be set 00000000 -> _BIT_POSITION_1 ... _BIT_POSITION_8
-    _BIT_POSITION_1 = 128  # 10 00 00 00
-    _BIT_POSITION_2 = 64  # 01 00 00 00
-    _BIT_POSITION_3 = 32  # 00 10 00 00
-    _BIT_POSITION_4 = 16  # 00 01 00 00
-    _BIT_POSITION_5 = 8  # 00 00 10 00
-    _BIT_POSITION_6 = 4  # 00 00 01 00
-    _BIT_POSITION_7 = 2  # 00 00 00 10
-    _BIT_POSITION_8 = 1  # 00 00 00 01
-
-    # Array to translate bit to position
-    _TMP = [0, _BIT_POSITION_8, _BIT_POSITION_1, _BIT_POSITION_2, _BIT_POSITION_3, _BIT_POSITION_4, _BIT_POSITION_5,
-            _BIT_POSITION_6, _BIT_POSITION_7]
+    # The bitmap is a 128 bits int, the bit N of the package is (1 << (128 - N))
+    # Array to translate bit to its mask inside the bitmap
+    _BITMAP_MASK = [0] + [1 << (128 - bit) for bit in range(1, 129)]
+    # Bit 1, that indicates the second bitmap
+    _BITMAP_SECONDARY = 1 << 127
+    # Bits 65 to 128, carried by the second bitmap
+    _BITMAP_SECONDARY_BITS = (1 << 64) - 1
     _BIT_DEFAULT_VALUE = 0
+    # Value of a present bit whose bytes were not materialized yet (lazy parse)
+    _BIT_LAZY_VALUE = None
+    # Size of the length indicator that getNetworkISO puts before the package
+    _NETWORK_LEN_SIZE = 2
+    _NETWORK_LEN_MAX = 0xFFFF
+    # Bits that a response echoes from its request by default (see setResponseFromRequest)
+    _RESPONSE_ECHO_BITS = (3, 4, 7, 11, 12, 13, 37, 41, 42, 49)
+    # Format of the date/time bits, used by getDate
+    _DATE_FORMATS = {7: '%m%d%H%M%S', 12: '%H%M%S', 13: '%m%d', 14: '%y%m', 15: '%m%d', 16: '%m%d', 17: '%m%d'}
+    # A valid MTI, checked by the strict mode
+    _MTI_PATTERN = re.compile('[0-9]{4}')
 
     # ISO8583 constants
     _BITS_VALUE_TYPE = {}
@@ -244,21 +260,34 @@ class Iso8583:
     _BITS_VALUE_TYPE[127] = ['127', 'Reserved for private use', 'LLL', 'A', 999, 'ans', 'A']
     _BITS_VALUE_TYPE[128] = ['128', 'Message authentication code (MAC) field', 'B', '-', 16, 'b', 'A']
 
+    # Immutable Spec (see iso_spec.py) built from the bits above, used by the objects created without a spec
+    # Its compiled codecs and layout cache are shared by all these objects
+    DEFAULT_SPEC = Spec(_BITS_VALUE_TYPE, subfields={55: SUBFIELDS_TLV_HEX})
+
 
     ################################################################################################
     # Default constructor of the ISO8583 Object
-    def __init__(self, iso="", debug=False, bitmap_uppercase=False, hdrlen=0):
+    def __init__(self, iso="", debug=False, bitmap_uppercase=False, hdrlen=0, lazy=False, spec=None, strict=False):
         """Default Constructor of ISO8583 Package.
         It initialize a "brand new" ISO8583 package
         Example: To Enable debug you can use:
             pack = ISO8583(debug=True)
         @param: iso a String that represents the ASCII of the package. The same that you need to pass to setIsoContent() method.
         @param: debug (True or False) default False -> Used to print some debug infos. Only use if want that messages!
+        @param: lazy (True or False) default False -> setIsoContent only indexes the bits, their bytes are copied and decoded when asked.
+            The package given to setIsoContent is kept (not copied), so it must not be changed while this object is used!
+        @param: spec -> Spec with the definition of the bits, default Iso8583.DEFAULT_SPEC
+        @param: strict (True or False) default False -> setBit raises InvalidValueType for values that don't match the value type of the bit,
+            and setIsoContent validates all the bits and returns the list of errors found (see setIsoContent)
         """
+        # Definition of the bits
+        if spec is None:
+            spec = self.DEFAULT_SPEC
+        self.spec = spec
         # Bitmap internal representation
-        self.BITMAP = []
-        # Values
-        self.BITMAP_VALUES = []
+        self.BITMAP = 0
+        # Values, only of the bits present in the bitmap: bit -> bytes
+        self.BITMAP_VALUES = {}
         # Bitmap ASCII representation
         self.BITMAP_HEX = b''
         self.BITMAP_format = 'A'
@@ -272,6 +301,18 @@ class Iso8583:
         # Header (optional)
         self.hdrlen = hdrlen
         self.hdr = b''
+        # Lazy parse: view over the bits of the received package and (offset, end) of each bit not materialized yet
+        self.LAZY = lazy
+        self.ISO_BUFFER = None
+        self.ISO_INDEX = {}
+        # Serialized package, kept until something changes it (None means dirty)
+        # NETWORK_ISO has the big-endian size in the beginning, RAW_ISO is the same package without it
+        self.NETWORK_ISO = None
+        self.RAW_ISO = None
+        # 64 bits fingerprint of the package, kept like the serialized package
+        self.FINGERPRINT = None
+        # Validate the values ?
+        self.STRICT = strict
 
         self.__initializeBitmap()
         self.__initializeBitmapValues()
@@ -288,7 +329,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose name will be returned
         @return: str that represents the name of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][0]
+        return self.spec.getDefinition(bit)[0]
 
     ################################################################################################
 
@@ -299,7 +340,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose name will be returned
         @return: str that represents the name of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][1]
+        return self.spec.getDefinition(bit)[1]
 
     ################################################################################################
 
@@ -310,7 +351,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose type will be returned
         @return: str that represents the type of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][2]
+        return self.spec.getDefinition(bit)[2]
 
     ################################################################################################
 
@@ -321,7 +362,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose length indicator format will be returned
         @return: str that represents the length indicator format of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][3]
+        return self.spec.getDefinition(bit)[3]
     ################################################################################################
 
     ################################################################################################
@@ -331,7 +372,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose limit will be returned
         @return: int that indicate the limit of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][4]
+        return self.spec.getDefinition(bit)[4]
 
     ################################################################################################
 
@@ -342,7 +383,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose value type will be returned
         @return: str that indicate the valuye type of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][5]
+        return self.spec.getDefinition(bit)[5]
 
     ################################################################################################
 
@@ -353,7 +394,7 @@ class Iso8583:
         @param: bit -> Bit that will be searched and whose format will be returned
         @return: str that represents the format of the bit
         """
-        return self._BITS_VALUE_TYPE[bit][6]
+        return self.spec.getDefinition(bit)[6]
     ################################################################################################
 
     ################################################################################################
@@ -365,6 +406,7 @@ class Iso8583:
 
         self.hdr = hdr
         self.hdrlen = len(hdr)
+        self.__setDirty()
 
     ################################################################################################
 
@@ -384,6 +426,7 @@ class Iso8583:
             self.hdr = self.hdr[0:self.hdrlen]
         elif len(self.hdr) < self.hdrlen:
             self.hdr = self.hdr.ljust(self.hdrlen)
+        self.__setDirty()
 
     ################################################################################################
 
@@ -411,12 +454,19 @@ class Iso8583:
     # Set the MTI format (ASCII/BCD)
     def setMTIformat(self, format='A'):
         """Method that set Transaction Type (MTI) format, 'B'CD, 'A'SCII or 'E'BCDIC
+        With a whole message EBCDIC Spec the MTI is always EBCDIC, translated with the rest of the package.
         """
 
         if format != 'A' and format != 'B' and format != 'E':
             raise InvalidFormat('Error: Invalid MTI format!')
 
+        if self.spec.ebcdic is True:
+            if format == 'B':
+                raise InvalidFormat('Error: Invalid MTI format for a whole message EBCDIC Spec!')
+            format = 'A'  # Parsed and built after/before the translation
+
         self.MTI_format = format
+        self.__setDirty()
 
     ################################################################################################
 
@@ -424,12 +474,19 @@ class Iso8583:
     # Set the MTI format (ASCII/EBCDIC/BCD)
     def setBITMAPformat(self, format='A'):
         """Method that set the BITMAP format, 'A'SCII, 'E'BCDIC or 'P'acked
+        With a whole message EBCDIC Spec the BITMAP is always EBCDIC, translated with the rest of the package.
         """
 
         if format != 'A' and format != 'P' and format != 'E':
             raise InvalidFormat('Error: Invalid BITMAP format!')
 
+        if self.spec.ebcdic is True:
+            if format == 'P':
+                raise InvalidFormat('Error: Invalid BITMAP format for a whole message EBCDIC Spec!')
+            format = 'A'  # Parsed and built after/before the translation
+
         self.BITMAP_format = format
+        self.__setDirty()
 
     ################################################################################################
 
@@ -441,17 +498,26 @@ class Iso8583:
         @raise: ValueTooLarge Exception
         """
 
+        self.MESSAGE_TYPE_INDICATION = self.__encodeMTI(type)
+        self.__setDirty()
+
+    # Encode a MTI
+    def __encodeMTI(self, type):
+        """Method that encode a MTI according to the MTI format
+        It's a internal method, so don't call!
+        @param: type -> MTI
+        @return: bytes
+        @raise: ValueTooLarge Exception
+        """
         type = "%s" % type
         if len(type) > 4:
-            type = type[0:3]
             raise ValueTooLarge('Error: value up to size! MTI limit size = 4')
 
         if self.MTI_format == 'A':
-            self.MESSAGE_TYPE_INDICATION = type.zfill(4).encode()
+            return type.zfill(4).encode()
         elif self.MTI_format == 'E':
-            self.MESSAGE_TYPE_INDICATION = type.zfill(4).encode('cp1148')
-        else:
-            self.MESSAGE_TYPE_INDICATION = binascii.unhexlify(type.zfill(4))
+            return type.zfill(4).encode('cp1148')
+        return binascii.unhexlify(type.zfill(4))
 
     ################################################################################################
 
@@ -476,30 +542,50 @@ class Iso8583:
         if self.DEBUG is True:
             print('Init bitmap')
 
-        if len(self.BITMAP) == 16:
-            for cont in range(0, 16):
-                self.BITMAP[cont] = self._BIT_DEFAULT_VALUE
-        else:
-            for cont in range(0, 16):
-                self.BITMAP.append(self._BIT_DEFAULT_VALUE)
+        self.BITMAP = 0
 
     ################################################################################################
 
     ################################################################################################
-    # init with "0" the array of values
+    # init the dict of values
     def __initializeBitmapValues(self):
-        """Method that initialize/reset a internal array used to save bits and values
+        """Method that initialize/reset a internal dict used to save bits and values
         It's a internal method, so don't call!
         """
         if self.DEBUG is True:
             print('Init bitmap_values')
 
-        if len(self.BITMAP_VALUES) == 128:
-            for cont in range(0, 129):
-                self.BITMAP_VALUES[cont] = self._BIT_DEFAULT_VALUE
-        else:
-            for cont in range(0, 129):
-                self.BITMAP_VALUES.append(self._BIT_DEFAULT_VALUE)
+        self.BITMAP_VALUES.clear()
+
+    ################################################################################################
+
+    ################################################################################################
+    # Drop the serialized package
+    def __setDirty(self):
+        """Method that drop the cached result of getRawIso/getNetworkISO, called by everything that changes the package
+        It's a internal method, so don't call!
+        """
+        self.NETWORK_ISO = None
+        self.RAW_ISO = None
+        self.FINGERPRINT = None
+
+    ################################################################################################
+
+    ################################################################################################
+    # Reset the object
+    def reset(self):
+        """Method that reset the object to a "brand new" ISO8583 package, so it can be reused.
+        The MTI, header, bitmap and bits are cleared. The Spec, formats, header length and debug/lazy options are kept.
+        Used by Iso8583Pool to recycle objects.
+        """
+        self.BITMAP = 0
+        self.BITMAP_VALUES.clear()
+        self.BITMAP_HEX = b''
+        self.MESSAGE_TYPE_INDICATION = b''
+        self.hdr = b''
+        self.ISO_BUFFER = None
+        self.ISO_INDEX.clear()
+        self.__setDirty()
 
     ################################################################################################
 
@@ -517,23 +603,15 @@ class Iso8583:
             raise BitNonexistent("Bit number %s dosen't exist!" % bit)
 
         # Clear the existing bit value (if present)
-        self.BITMAP_VALUES[bit] = self._BIT_DEFAULT_VALUE
-
-        # calculate the position inside the bitmap
-        pos = 1
-        if (bit % 8) == 0:
-            pos = (bit // 8) - 1
-        else:
-            pos = (bit // 8)
-
-        # need to check if the value can be there .. AN , N ... etc ... and the size
+        self.BITMAP_VALUES.pop(bit, None)
+        self.__setDirty()
 
-        self.BITMAP[pos] = self.BITMAP[pos] & ~self._TMP[(bit % 8) + 1]
+        self.BITMAP &= ~self._BITMAP_MASK[bit]
 
         # Clear the continuation bit?
-        if bit > 64 and self.BITMAP[8:15] == [0, 0, 0, 0, 0, 0, 0]:
-           # need to unset bit 1 of first "bit" in bitmap
-           self.BITMAP[0] = self.BITMAP[0] & ~self._TMP[2]
+        if bit > 64 and not self.BITMAP & self._BITMAP_SECONDARY_BITS:
+            # need to unset bit 1 of first "bit" in bitmap
+            self.BITMAP &= ~self._BITMAP_SECONDARY
 
         return True
 
@@ -555,46 +633,19 @@ class Iso8583:
         if bit < 1 or bit > 128:
             raise BitNonexistent("Bit number %s dosen't exist!" % bit)
 
-        # calculate the position inside the bitmap
-        pos = 1
+        if self.STRICT is True:
+            self.__checkBitTypeValidity(bit, "%s" % value)
 
-        if self.getBitType(bit) == 'LL':
-            self.__setBitTypeLL(bit, value)
-
-        if self.getBitType(bit) == 'LLL':
-            self.__setBitTypeLLL(bit, value)
-
-        if self.getBitType(bit) == 'LLLLLL':
-            self.__setBitTypeLLLLLL(bit, value)
-
-        if self.getBitType(bit) == 'N':
-            self.__setBitTypeN(bit, value)
-
-        if self.getBitType(bit) == 'A':
-            self.__setBitTypeA(bit, value)
-
-        if self.getBitType(bit) == 'AN':
-            self.__setBitTypeAN(bit, value)
-
-        if self.getBitType(bit) == 'ANS':
-            self.__setBitTypeANS(bit, value)
-
-        if self.getBitType(bit) == 'B':
-            self.__setBitTypeB(bit, value)
+        # The compiled codec checks the size, pads and encodes the value
+        self.BITMAP_VALUES[bit] = self.spec.codecs[bit].encode(value)
+        self.__setDirty()
 
         # Continuation bit?
         if bit > 64:
             # need to set bit 1 of first "bit" in bitmap
-            self.BITMAP[0] = self.BITMAP[0] | self._TMP[2]
-
-        if (bit % 8) == 0:
-            pos = (bit // 8) - 1
-        else:
-            pos = (bit // 8)
+            self.BITMAP |= self._BITMAP_SECONDARY
 
-        # need to check if the value can be there .. AN , N ... etc ... and the size
-
-        self.BITMAP[pos] = self.BITMAP[pos] | self._TMP[(bit % 8) + 1]
+        self.BITMAP |= self._BITMAP_MASK[bit]
 
         return True
 
@@ -619,36 +670,31 @@ class Iso8583:
     def __buildBitmap(self):
         """Method that build the bitmap ASCII
         It's a internal method, so don't call!
+        @return: bytes -> the packed bitmap (8 or 16 bytes)
         """
 
-        self.BITMAP_HEX = b''
+        bitmap, self.BITMAP_HEX = self.__encodeBitmap(self.BITMAP)
 
-        for c in range(0, 16):
-            if (self.BITMAP[0] & self._BIT_POSITION_1) != self._BIT_POSITION_1:
-                # Only has the first bitmap
-                if self.DEBUG is True:
-                    print('%d Bitmap = %d(Decimal) = %s (hexa) ' %
-                          (c, self.BITMAP[c], hex(self.BITMAP[c])))
-
-                tm = hex(self.BITMAP[c])[2:]
-                if self.BITMAP_UPPERCASE is True:
-                    tm = tm.upper()
-                if len(tm) != 2:
-                    tm = '0' + tm
-                self.BITMAP_HEX += tm.encode()
-                if c == 7:
-                    break
-            else:  # second bitmap
-                if self.DEBUG is True:
-                    print('%d Bitmap = %d(Decimal) = %s (hexa) ' %
-                          (c, self.BITMAP[c], hex(self.BITMAP[c])))
-
-                tm = hex(self.BITMAP[c])[2:]
-                if self.BITMAP_UPPERCASE is True:
-                    tm = tm.upper()
-                if len(tm) != 2:
-                    tm = '0' + tm
-                self.BITMAP_HEX += tm.encode()
+        if self.DEBUG is True:
+            print('Bitmap = %d(Decimal) = %s (hexa) ' % (self.BITMAP, bitmap.hex()))
+
+        return bitmap
+
+    # Encode a bitmap
+    def __encodeBitmap(self, bitmap):
+        """Method that encode a bitmap int to its packed and ASCII forms
+        It's a internal method, so don't call!
+        @param: bitmap -> 128 bits int, bit N is (1 << (128 - N))
+        @return: (packed, hex) -> bytes with the packed bitmap (8 or 16 bytes) and bytes with its hexadecimal representation
+        """
+        if bitmap & self._BITMAP_SECONDARY:
+            packed = bitmap.to_bytes(16, 'big')
+        else:  # Only has the first bitmap
+            packed = (bitmap >> 64).to_bytes(8, 'big')
+
+        if self.BITMAP_UPPERCASE is True:
+            return packed, packed.hex().upper().encode()
+        return packed, packed.hex().encode()
 
     ################################################################################################
 
@@ -659,39 +705,41 @@ class Iso8583:
         @param: bitmap -> bitmap str to be readable
         It's a internal method, so don't call!
         """
-        # Need to check if the size is correct etc...
-        cont = 0
+        self.BITMAP, self.BITMAP_HEX = self.__readBitmap(bitmap_raw)
 
-        if self.BITMAP_HEX != b'':
-            self.BITMAP_HEX = b''
+        if self.DEBUG is True:
+            print('Bitmap %s converted to int is = %s' % (self.BITMAP_HEX, self.BITMAP))
+
+    ################################################################################################
+
+    ################################################################################################
+    # Read a bitmap from str
+    def __readBitmap(self, bitmap_raw):
+        """Method that read the bitmap in the beginning of a str, according to the BITMAP format
+        It's a internal method, so don't call!
+        @param: bitmap_raw -> str that starts with the bitmap
+        @return: (bitmap, bitmap_hex) -> 128 bits int and its ASCII representation, as it was found
+        """
+        # Need to check if the size is correct etc...
+        if self.BITMAP_format == 'P':
+            bitmap = int.from_bytes(bitmap_raw[0:8], 'big') << 64
+            if bitmap & self._BITMAP_SECONDARY:  # Also 2nd bitmap
+                bitmap |= int.from_bytes(bitmap_raw[8:16], 'big')
+                return bitmap, bitmap_raw[0:16].hex().encode()
+            # Only 1 bitmap
+            return bitmap, bitmap_raw[0:8].hex().encode()
 
         if self.BITMAP_format == 'A':
-            bitmap = bitmap_raw
-        elif self.BITMAP_format == 'E':
-            bitmap = bitmap_raw.decode('cp1148').encode()
+            bitmap_hex = bytes(bitmap_raw[0:32])
         else:
-            bitmap = binascii.hexlify(bitmap_raw[0:8])
-            if (int(bitmap[0:2], 16) & self._BIT_POSITION_1) == self._BIT_POSITION_1:  # Also 2nd bitmap
-                bitmap = binascii.hexlify(bitmap_raw[0:16]) # Now we have the full double-length bitmap unpacked
-
-        for x in range(0, 32, 2):
-            if (int(bitmap[0:2], 16) & self._BIT_POSITION_1) != self._BIT_POSITION_1:  # Only 1 bitmap
-                if self.DEBUG is True:
-                    print('Token[%d] %s converted to int is = %s' %
-                          (x, bitmap[x:x + 2], int(bitmap[x:x + 2], 16)))
-
-                self.BITMAP_HEX += bitmap[x:x + 2]
-                self.BITMAP[cont] = int(bitmap[x:x + 2], 16)
-                if x == 14:
-                    break
-            else:  # Second bitmap
-                if self.DEBUG is True:
-                    print('Token[%d] %s converted to int is = %s' %
-                          (x, bitmap[x:x + 2], int(bitmap[x:x + 2], 16)))
-
-                self.BITMAP_HEX += bitmap[x:x + 2]
-                self.BITMAP[cont] = int(bitmap[x:x + 2], 16)
-            cont += 1
+            bitmap_hex = bytes(bitmap_raw[0:32]).decode('cp1148').encode()
+
+        bitmap = int(bitmap_hex[0:16], 16) << 64
+        if bitmap & self._BITMAP_SECONDARY:  # Also 2nd bitmap
+            bitmap |= int(bitmap_hex[16:32], 16)
+            return bitmap, bitmap_hex[0:32]
+        # Only 1 bitmap
+        return bitmap, bitmap_hex[0:16]
 
     ################################################################################################
 
@@ -714,36 +762,7 @@ class Iso8583:
         It's a internal method, so don't call!
         @param: bitmap -> bitmap str to be analized and translated to "bits"
         """
-        bits = []
-        for c in range(0, 16):
-            for d in range(1, 9):
-                if self.DEBUG is True:
-                    print('Value (%d)-> %s & %s = %s' % (
-                        d, self.BITMAP[c], self._TMP[d], (self.BITMAP[c] & self._TMP[d])))
-                if (self.BITMAP[c] & self._TMP[d]) == self._TMP[d]:
-                    if d == 1:  # e o 8 bit
-                        if self.DEBUG is True:
-                            print('Bit %s is present !!!' % ((c + 1) * 8))
-                        bits.append((c + 1) * 8)
-                        self.BITMAP_VALUES[(c + 1) * 8] = b'X'
-                    else:
-                        if (c == 0) & (d == 2):  # Continuation bit
-                            if self.DEBUG is True:
-                                print('Bit 1 is present !!!')
-
-                            bits.append(1)
-
-                        else:
-                            if self.DEBUG is True:
-                                print('Bit %s is present !!!' %
-                                      (c * 8 + d - 1))
-
-                            bits.append(c * 8 + d - 1)
-                            self.BITMAP_VALUES[c * 8 + d - 1] = b'X'
-
-        bits.sort()
-
-        return bits
+        return self.__getBitsFromBitmap()
 
     ################################################################################################
 
@@ -754,335 +773,20 @@ class Iso8583:
         It's a internal method, so don't call!
         """
         bits = []
-        for c in range(0, 16):
-            for d in range(1, 9):
-                if self.DEBUG is True:
-                    print('Value (%d)-> %s & %s = %s' % (
-                        d, self.BITMAP[c], self._TMP[d], (self.BITMAP[c] & self._TMP[d])))
-                if (self.BITMAP[c] & self._TMP[d]) == self._TMP[d]:
-                    if d == 1:  # e o 8 bit
-                        if self.DEBUG is True:
-                            print('Bit %s is present !!!' % ((c + 1) * 8))
-
-                        bits.append((c + 1) * 8)
-                    else:
-                        if (c == 0) & (d == 2):  # Continuation bit
-                            if self.DEBUG is True:
-                                print('Bit 1 is present !!!')
+        bitmap = self.BITMAP
+        # Walk only the bits that are set, from the most significant (bit 1) to the least (bit 128)
+        while bitmap:
+            length = bitmap.bit_length()
+            bits.append(129 - length)
+            bitmap ^= 1 << (length - 1)
 
-                            bits.append(1)
-
-                        else:
-                            if self.DEBUG is True:
-                                print('Bit %s is present !!!' %
-                                      (c * 8 + d - 1))
-
-                            bits.append(c * 8 + d - 1)
-
-        bits.sort()
+        if self.DEBUG is True:
+            print('Bits present in the bitmap %s' % bits)
 
         return bits
 
     ################################################################################################
 
-    ################################################################################################
-    # Method that receive a ISO8583 ASCII package in the network form and parse it.
-    def __formatValue(self,bit,value):
-        """Method that formats a value to the appropriate data for the bit or LL or LLL bits
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: Nothing as yet
-        @return: binary data that represents the format of the bit
-        It's a internal method, so don't call!
-        """
-        size = "%s" % len(value)
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            data = value.encode()
-        elif data_form == "E":
-            data = value.encode('cp1148')
-        else: # Packed data
-            # Needs to be even length, with padding on the right
-            if int(size) % 2 == 0:
-                data = binascii.unhexlify(value)
-            else: # Pad to the right with a single '0' character
-                data = binascii.unhexlify(value + '0')
-
-        return data
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type LL
-    def __setBitTypeLL(self, bit, value):
-        """Method that set a bit with value in form LL
-        It put the size in front of the value
-        Example: pack.setBit(99,'123') -> Bit 99 is a LL type, so this bit, in ASCII form need to be 03123. To understand, 03 is the size of the information and 123 is the information/value
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > 99:
-            # value = value[0:99]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-        if len(value) > self.getBitLimit(bit):
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        size = "%s" % len(value)
-        data = self.__formatValue(bit, value)
-        lenform = self.getBitLenForm(bit)
-
-        if lenform == 'A':
-            self.BITMAP_VALUES[bit] = size.zfill(2).encode() + data
-        elif lenform == 'E':
-            self.BITMAP_VALUES[bit] = size.zfill(2).encode('cp1148') + data
-        elif lenform == 'P':
-            self.BITMAP_VALUES[bit] = self.__IntToLLPack(len(value)) + data
-        else:
-            self.BITMAP_VALUES[bit] = self.__IntToLLBCD(len(value)) + data
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type LLL
-    def __setBitTypeLLL(self, bit, value):
-        """Method that set a bit with value in form LLL
-        It put the size in front of the value
-        Example: pack.setBit(104,'12345ABCD67890') -> Bit 104 is a LLL type, so this bit, in ASCII form need to be 01412345ABCD67890.
-            To understand, 014 is the size of the information and 12345ABCD67890 is the information/value
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > 999:
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-        if len(value) > self.getBitLimit(bit):
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        size = "%s" % len(value)
-        data = self.__formatValue(bit, value)
-        lenform = self.getBitLenForm(bit)
-
-        if lenform == 'A':
-            self.BITMAP_VALUES[bit] = size.zfill(3).encode() + data
-        elif lenform == 'E':
-            self.BITMAP_VALUES[bit] = size.zfill(3).encode('cp1148') + data
-        elif lenform == 'P':
-            self.BITMAP_VALUES[bit] = self.__IntToLLLPack(len(value)) + data
-        else:
-            self.BITMAP_VALUES[bit] = self.__IntToLLLBCD(len(value)) + data
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type LLLLLL
-    def __setBitTypeLLLLLL(self, bit, value):
-        """Method that set a bit with value in form LLLLLL
-        It put the size in front of the value
-        Example: pack.setBit(104,'12345ABCD67890') -> If Bit 104 is a LLLLLL type, so this bit, in ASCII form need to be 00001412345ABCD67890.
-            To understand, 000014 is the size of the information and 12345ABCD67890 is the information/value
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > 999999:
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-        if len(value) > self.getBitLimit(bit):
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        size = "%s" % len(value)
-        data = self.__formatValue(bit, value)
-        lenform = self.getBitLenForm(bit)
-
-        if lenform == 'A':
-            self.BITMAP_VALUES[bit] = size.zfill(6).encode() + data
-        elif lenform == 'E':
-            self.BITMAP_VALUES[bit] = size.zfill(6).encode('cp1148') + data
-        elif lenform == 'P':
-            self.BITMAP_VALUES[bit] = self.__IntToLLLLLLPack(len(value)) + data
-        else:
-            self.BITMAP_VALUES[bit] = self.__IntToLLLLLLBCD(len(value)) + data
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type N,
-    def __setBitTypeN(self, bit, value):
-        """Method that set a bit with value in form N
-        It complete the size of the bit with a default value
-        Example: pack.setBit(3,'30000') -> Bit 3 is a N type, so this bit, in ASCII form need to has size = 6 (ISO specification) so the value 30000 size = 5 need to receive more "1" number.
-            In this case, will be "0" in the left. In the package, the bit will be sent like '030000'
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > self.getBitLimit(bit):
-            value = value[0:self.getBitLimit(bit)]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        #self.__checkBitTypeValidity(bit, value)
-
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode()
-        elif data_form == "E":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode('cp1148')
-        else: # Packed data - make sure that it's left zero-filled to the correct length- a multiple of 2
-            unpacked_len = self.__getUnpackedLen(self.getBitLimit(bit))
-            self.BITMAP_VALUES[bit] = binascii.unhexlify(value.zfill(unpacked_len))
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type A
-    def __setBitTypeA(self, bit, value):
-        """Method that set a bit with value in form A
-        It complete the size of the bit with a default value
-        Example: pack.setBit(3,'30000') -> Bit 3 is a A type, so this bit, in ASCII form need to has size = 6 (ISO specification) so the value 30000 size = 5 need to receive more "1" number.
-            In this case, will be "0" in the left. In the package, the bit will be sent like '030000'
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > self.getBitLimit(bit):
-            value = value[0:self.getBitLimit(bit)]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        #self.__checkBitTypeValidity(bit, value)
-
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode()
-        elif data_form == "E":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode('cp1148')
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type AN
-    def __setBitTypeAN(self, bit, value):
-        """Method that set a bit with value in form AN
-        It complete the size of the bit with a default value
-        Example: pack.setBit(3,'30000') -> Bit 3 is a A type, so this bit, in ASCII form need to has size = 6 (ISO specification) so the value 30000 size = 5 need to receive more "1" number.
-            In this case, will be "0" in the left. In the package, the bit will be sent like '030000'
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > self.getBitLimit(bit):
-            value = value[0:self.getBitLimit(bit)]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        #self.__checkBitTypeValidity(bit, value)
-
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode()
-        elif data_form == "E":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode('cp1148')
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type B
-    def __setBitTypeB(self, bit, value):
-        """Method that set a bit with value in form B
-        It complete the size of the bit with a default value
-        Example: pack.setBit(3,'30000') -> Bit 3 is a B type, so this bit, in ASCII form need to has size = 6 (ISO specification) so the value 30000 size = 5 need to receive more "1" number.
-            In this case, will be "0" in the left. In the package, the bit will be sent like '030000'
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > self.getBitLimit(bit):
-            value = value[0:self.getBitLimit(bit)]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode()
-        elif data_form == "E":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode('cp1148')
-        else: # Packed data- ensure it is a multiple of 2. Also pad with zeros to the left if required
-            unpacked_len = self.__getUnpackedLen(self.getBitLimit(bit))
-            self.BITMAP_VALUES[bit] = binascii.unhexlify(value.zfill(unpacked_len))
-
-    ################################################################################################
-
-    ################################################################################################
-    # Set of type ANS
-    def __setBitTypeANS(self, bit, value):
-        """Method that set a bit with value in form ANS
-        It complete the size of the bit with a default value
-        Example: pack.setBit(3,'30000') -> Bit 3 is a ANS type, so this bit, in ASCII form need to has size = 6 (ISO specification) so the value 30000 size = 5 need to receive more "1" number.
-            In this case, will be "0" in the left. In the package, the bit will be sent like '030000'
-        @param: bit -> bit to be setted
-        @param: value -> value to be setted
-        @raise: ValueTooLarge Exception
-        It's a internal method, so don't call!
-        """
-
-        value = "%s" % value
-
-        if len(value) > self.getBitLimit(bit):
-            value = value[0:self.getBitLimit(bit)]
-            raise ValueTooLarge('Error: value up to size! Bit[%s] of type %s limit size = %s' % (
-                bit, self.getBitType(bit), self.getBitLimit(bit)))
-
-        #self.__checkBitTypeValidity(bit, value)
-
-        data_form = self.getBitFormat(bit)
-
-        if data_form == "A":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode()
-        elif data_form == "E":
-            self.BITMAP_VALUES[bit] = value.zfill(self.getBitLimit(bit)).encode('cp1148')
-
-    ################################################################################################
-
     ################################################################################################
     # print os bits insede iso
     def showIsoBits(self, showall=False):
@@ -1100,9 +804,9 @@ class Iso8583:
         """
 
         for cont in range(1, 129):
-            if self.BITMAP_VALUES[cont] != self._BIT_DEFAULT_VALUE:
+            if cont in self.BITMAP_VALUES:
                 print("Bit[%s] of type %s has limit %s = %s" % (
-                    cont, self.getBitType(cont), self.getBitLimit(cont), self.BITMAP_VALUES[cont]))
+                    cont, self.getBitType(cont), self.getBitLimit(cont), self.__getRawBit(cont)))
             elif showall is True:
                 print("Bit[%s] of type %s has limit %s" % (
                     cont, self.getBitType(cont), self.getBitLimit(cont)))
@@ -1144,40 +848,68 @@ class Iso8583:
         print ('This is the ASCII package %s' % str)
         output (print) -> This is the ASCII package 0800d010800000000000000000002000000001200000000000400001200170299
 
+        The package is serialized once and kept until setBit, unsetBit, setMTI (or another setter) changes it,
+        so calling it again (to log and send the package, for example) costs nothing.
+
         @return: str with complete ASCII ISO8583
         @raise: InvalidMTI Exception
         """
 
-        self.__buildBitmap()
+        if self.RAW_ISO is None:
+            self.RAW_ISO = self.__serialize()[self._NETWORK_LEN_SIZE:]
+
+        if nohdr is True and self.hdr:
+            return self.RAW_ISO[len(self.hdr):]
+        return self.RAW_ISO
+
+    # Serialize the package
+    def __serialize(self):
+        """Method that serialize the package in the network form (size + header + MTI + bitmap + bits) and keep it.
+        The parts are joined once into a bytearray, with the room of the size reserved in the beginning and filled after.
+        It's a internal method, so don't call!
+        @return: bytes -> the package with the big-endian size in the beginning
+        @raise: InvalidMTI Exception
+        """
+
+        if self.NETWORK_ISO is not None:
+            return self.NETWORK_ISO
+
+        bitmap = self.__buildBitmap()
 
         if self.MESSAGE_TYPE_INDICATION == b'':
             raise InvalidMTI('Check MTI! Do you set it?')
 
-        # Start with the header, if set (or b'' if not)
-        if nohdr is True:
-            resp = b''
-        else:
-            resp = self.hdr
-
-        resp += self.MESSAGE_TYPE_INDICATION
         if self.BITMAP_format == 'A':
-            resp += self.BITMAP_HEX
+            bitmap = self.BITMAP_HEX
         elif self.BITMAP_format == 'E':
-            resp += self.BITMAP_HEX.decode().encode('cp1148')
-        else:
-            resp += binascii.unhexlify(self.BITMAP_HEX)
+            bitmap = self.BITMAP_HEX.decode().encode('cp1148')
 
-        for cont in range(0, 129):
-            if self.BITMAP_VALUES[cont] != self._BIT_DEFAULT_VALUE:
-                resp = resp + self.BITMAP_VALUES[cont]
+        # MTI and bitmap, then the bits
+        parts = [self.MESSAGE_TYPE_INDICATION, bitmap]
+        for cont in self.__getBitsFromBitmap():
+            if cont != 1:  # Continuation bit has no value
+                parts.append(self.__getRawBit(cont, copy=False))
 
-        return resp
+        if self.spec.ebcdic is True:
+            # Whole message EBCDIC, translated at once
+            parts = [b''.join(parts).translate(ASCII_TO_EBCDIC)]
+
+        # Size (reserved) and header (or b'' if not set) before them
+        netIso = bytearray().join([bytes(self._NETWORK_LEN_SIZE), self.hdr] + parts)
+        size = len(netIso) - self._NETWORK_LEN_SIZE
+        if size <= self._NETWORK_LEN_MAX:  # Too large packages can't go to the network, but getRawIso still works
+            struct.pack_into('!H', netIso, 0, size)
+
+        self.NETWORK_ISO = bytes(netIso)
+        return self.NETWORK_ISO
 
     # Redefine a bit
     def redefineBit(self, bit, smallStr, largeStr, bitType, LenForm, size, valueType, format):
-        """Method that redefine a bit structure in global scope!
+        """Method that redefine a bit structure of this object.
         Can be used to personalize ISO8583 structure to another specification (ISO8583 1987 for example!)
         Hint: If you have a lot of "ValueTooLarge Exception" maybe the specification that you are using is different of mine. So you will need to use this method :)
+        The Spec of the object is replaced by a new one (see Spec.redefineBit), other objects are not changed.
+        To share a redefined specification, build it once with Spec.redefineBit/Spec.derive and give it to the constructor.
         @param: bit -> bit to be redefined
         @param: smallStr -> a small String representantion of the bit, used to build "user friendly prints", example "2" for bit 2
         @param: largeStr -> a large String representantion of the bit, used to build "user friendly prints" and to be used to inform the "main use of the bit",
@@ -1196,39 +928,31 @@ class Iso8583:
             print('Trying to redefine the bit with (self,%s,%s,%s,%s,%s,%s,%s,%s)' % (
                 bit, smallStr, largeStr, bitType, LenForm, size, valueType, format))
 
-        # validating bit position
-        if bit == 1 or bit < 0 or bit > 128:
-            raise BitNonexistent(
-                "Error %d cannot be changed because has a invalid number!" % bit)
-
-        if bitType != "B" and bitType != "N" and bitType != "A" and bitType != "AN" and bitType != "ANS" and bitType != "LL" and bitType != "LLL" and bitType != "LLLLLL":
-            raise InvalidBitType(
-                "Error bit %d cannot be changed because %s is not a valid bitType (B, N, A, AN, ANS, LL, LLL)!" % (
-                    bit, bitType))
-
-        if LenForm != '-' and bitType != "LL" and bitType != "LLL" and bitType != "LLLLLL":
-            raise InvalidLenForm("Error %d cannot be changed because has an invalid LenForm!" % bit)
-
-        if LenForm != '-' and LenForm != 'A' and LenForm != 'E' and LenForm != 'B' and LenForm != 'P':
-            raise InvalidLenForm("Error %d cannot be changed because has an invalid %s LenForm!" % (bit, LenForm))
-
-        # need to validate if the type and size is compatible! example slimit = 100 and type = LL
-
-        if valueType != "a" and valueType != "n" and valueType != "ans" and valueType != "b" and valueType != "an":
-            raise InvalidValueType(
-                "Error bit %d cannot be changed because %s is not a valid valueType (a, an, n ans, b)!" % (
-                    bit, valueType))
-
-        if format != 'A' and format != 'E' and format != 'P':
-            raise InvalidFormat("Error %d cannot be changed because has an invalid %s format!" % (bit, format))
-
-        if format == 'P' and bitType != 'B' and bitType != 'N' and bitType != 'LL' and bitType != 'LLL' and bitType != 'LLLLLL':
-            raise InvalidFormat("Error %d cannot be changed because has an invalid %s format (cannot be packed)!" % (bit, format))
-        self._BITS_VALUE_TYPE[bit] = [smallStr, largeStr, bitType, LenForm, size, valueType, format]
+        self.spec = self.spec.redefineBit(bit, smallStr, largeStr, bitType, LenForm, size, valueType, format)
 
         if self.DEBUG is True:
             print('Bit %d redefined!' % bit)
 
+    # Return the Spec
+    def getSpec(self):
+        """Method that return the Spec (definition of the bits) used by this object
+        @return: Spec
+        """
+        return self.spec
+
+    # Set the Spec
+    def setSpec(self, spec):
+        """Method that set the Spec (definition of the bits) used by this object
+        The bits already set are not converted, so change the Spec before setting or parsing the bits.
+        A whole message EBCDIC Spec sets the MTI and BITMAP formats to EBCDIC (see setMTIformat).
+        @param: spec -> Spec, for example Iso8583.DEFAULT_SPEC.redefineBit(...)
+        """
+        self.spec = spec
+        if spec.ebcdic is True:
+            self.MTI_format = 'A'
+            self.BITMAP_format = 'A'
+        self.__setDirty()
+
     # a partir de um trem de string, pega o MTI
     def __setMTIFromStr(self, iso):
         """Method that get the first 4 characters to be the MTI.
@@ -1236,9 +960,9 @@ class Iso8583:
         """
 
         if self.MTI_format == 'A' or self.MTI_format == 'E':
-            self.MESSAGE_TYPE_INDICATION = iso[0:4]
+            self.MESSAGE_TYPE_INDICATION = bytes(iso[0:4])
         else:
-            self.MESSAGE_TYPE_INDICATION = iso[0:2]
+            self.MESSAGE_TYPE_INDICATION = bytes(iso[0:2])
 
         if self.DEBUG is True:
             print('MTI found was %s' % self.MESSAGE_TYPE_INDICATION)
@@ -1250,12 +974,75 @@ class Iso8583:
         """
 
         # Need to validate if the MTI was setted ...etc ...
+        return self.__decodeMTI(self.MESSAGE_TYPE_INDICATION)
+
+    # decode a MTI
+    def __decodeMTI(self, mti):
+        """Method that decode the bytes of a MTI, according to the MTI format
+        It's a internal method, so don't call!
+        """
         if self.MTI_format == 'A':
-            return self.MESSAGE_TYPE_INDICATION.decode()
+            return bytes(mti).decode()
         elif self.MTI_format == 'E':
-            return self.MESSAGE_TYPE_INDICATION.decode('cp1148')
+            return bytes(mti).decode('cp1148')
         else:
-            return binascii.hexlify(self.MESSAGE_TYPE_INDICATION).decode()
+            return mti.hex()
+
+    # return the MTI of the response
+    def getResponseMTI(self):
+        """Method that return the MTI of the response to this package
+        The function digit (third) of a request, advice or notification is incremented: 0100 -> 0110, 0220 -> 0230, 0800 -> 0810
+        A MTI that is already a response is returned as is.
+        @return: str -> with the MTI of the response
+        @raise: InvalidMTI Exception
+        """
+        mti = self.getMTI()
+        if len(mti) != 4 or not mti.isdigit():
+            raise InvalidMTI('Check MTI! Do you set it?')
+
+        if int(mti[2]) % 2 == 0:
+            mti = mti[0:2] + str(int(mti[2]) + 1) + mti[3]
+        return mti
+
+    # Build a response from a request
+    def setResponseFromRequest(self, request, bits=None, mti=None):
+        """Method that prepare this object as the response of a request.
+        The bits are copied as they are inside the request (no decode, validation or encode), only the bits that
+        the response changes need to be set after with setBit.
+        Example:
+            response = ISO8583()
+            response.setResponseFromRequest(request)
+            response.setBit(39, '00')
+            raw = response.getRawIso()
+        @param: request -> Iso8583 object with the request
+        @param: bits -> bits to be echoed, default 3, 4, 7, 11, 12, 13, 37, 41, 42 and 49. Bits not set in the request are skipped
+        @param: mti -> MTI of the response, default request.getResponseMTI()
+        @raise: BitNonexistent Exception, InvalidMTI Exception
+        """
+        if bits is None:
+            bits = self._RESPONSE_ECHO_BITS
+        if mti is None:
+            mti = request.getResponseMTI()
+
+        self.setTransactionType(mti)
+
+        for bit in bits:
+            if bit < 2 or bit > 128:
+                raise BitNonexistent("Bit number %s dosen't exist!" % bit)
+
+            if not request.BITMAP & self._BITMAP_MASK[bit]:
+                continue
+
+            if request.spec.codecs[bit] is self.spec.codecs[bit]:
+                # Same definition, so the same bytes
+                self.BITMAP_VALUES[bit] = request.__getRawBit(bit)
+                self.BITMAP |= self._BITMAP_MASK[bit]
+                if bit > 64:
+                    self.BITMAP |= self._BITMAP_SECONDARY
+            else:
+                self.setBit(bit, request.getBit(bit))
+
+        self.__setDirty()
 
     # Return the bitmap
     def getBitmap(self):
@@ -1266,12 +1053,41 @@ class Iso8583:
 
         return self.BITMAP_HEX
 
+    # return the statistics of the layout cache
+    def getLayoutCacheInfo(self):
+        """Method that return the statistics of the cache of layouts used by setIsoContent.
+        Every bitmap parsed is a hit (layout reused) or a miss (layout computed and kept).
+        @return: CacheInfo(hits, misses, maxsize, currsize)
+        """
+        return self.spec.layouts.cacheInfo()
+
     # return the Varray of values
     def getValuesArray(self):
-        """Method that return an internal array of the package
-        @return: array -> with all bits, presents or not in the bitmap
+        """Method that return an array with the values of the package
+        The values are kept in a dict with only the bits present, this array is built from it.
+        @return: array -> with all bits, presents or not in the bitmap (0 for the bits not present)
         """
-        return self.BITMAP_VALUES
+        values = [self._BIT_DEFAULT_VALUE] * 129
+        for cont in self.BITMAP_VALUES:
+            values[cont] = self.__getRawBit(cont)
+        return values
+
+    # return the bytes of a bit, materializing it if it was lazily parsed
+    def __getRawBit(self, bit, copy=True):
+        """Method that return the bytes of a bit (length indicator included) as it is inside the package.
+        If the bit was only indexed by a lazy setIsoContent, its bytes are copied from the package now and kept.
+        @param: bit -> bit number
+        @param: copy (True or False) -> if False, a lazy bit is returned as a memoryview over the package and not kept
+        It's a internal method, so don't call!
+        """
+        value = self.BITMAP_VALUES[bit]
+        if value is self._BIT_LAZY_VALUE:
+            start, end = self.ISO_INDEX[bit]
+            if copy is False:
+                return self.ISO_BUFFER[start:end]
+            value = self.BITMAP_VALUES[bit] = self.ISO_BUFFER[start:end].tobytes()
+            del self.ISO_INDEX[bit]
+        return value
 
     def __raiseValueTypeError(self, bit):
         """ Raise a type error exception
@@ -1291,234 +1107,68 @@ class Iso8583:
                      type error
         """
 
-        bitType = self.getBitValueType(bit)
-
-        if bitType == 'a':
-            if not all(x.isspace() or x.isalpha() for x in value):
-                self.__raiseValueTypeError(bit)
-        elif bitType == 'n':
-            if not value.isdecimal():
-                self.__raiseValueTypeError(bit)
-        elif bitType == 'an':
-            if not all(x.isspace() or x.isalnum() for x in value):
-                self.__raiseValueTypeError(bit)
+        # Compiled per value type, see iso_codecs.compileValidator
+        if not self.spec.codecs[bit].validate(value):
+            self.__raiseValueTypeError(bit)
 
         # No exceptions raised, return
         return True
 
     # Receive a str and interpret it to bits and values
-    def __getBitFromStr(self, strWithoutMtiBitmap):
+    def __getBitFromStr(self, strWithoutMtiBitmap, errors=None, start=0):
         """Method that receive a string (ASCII) without MTI and Bitmaps (first and second), understand it and remove the bits values
         @param: str -> with all bits presents whithout MTI and bitmap
+        @param: errors -> list where the (bit, offset, reason) of the invalid bits are added, or None to not validate
+        @param: start -> offset of the str inside the package, to report the errors
         It's a internal method, so don't call!
         """
 
         if self.DEBUG is True:
             print('This is the input string <%s>' % strWithoutMtiBitmap)
 
-        offset = 0
-        # jump bit 1 because it was alread defined in the "__initializeBitsFromBitmapStr"
-        for cont in range(2, 129):
-            if self.BITMAP_VALUES[cont] != self._BIT_DEFAULT_VALUE:
-                if self.DEBUG is True:
-                    print('String = %s offset = %s bit = %s' %
-                          (strWithoutMtiBitmap[offset:], offset, cont))
-
-                bitType = self.getBitType(cont)
-                lenform = self.getBitLenForm(cont)
-
-                if bitType == 'LL':
-                    if lenform == 'A':
-                        lenoffset = 2
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    elif lenform == 'E':
-                        lenoffset = 2
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset].decode('cp1148'))
-                    elif lenform == 'P':
-                        lenoffset = 1
-                        valueSize = self.__LLPackToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    else: # 'B'(CD)
-                        lenoffset = 1
-                        valueSize = self.__LLBCDToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-
-                    if self.DEBUG is True:
-                        print('Size of the message in LL = %s' % valueSize)
-
-                    if valueSize > self.getBitLimit(cont):
-                        print('This bit is larger than the specification.')
-                        # raise ValueTooLarge("This bit is larger than the specification!")
-
-                    if self.getBitFormat(cont) == 'P':
-                        modvalueSize = self.__getPackedLen(valueSize)
-                    else: # ASCII and EBCDIC have the same length
-                        modvalueSize = valueSize
-
-                    self.BITMAP_VALUES[cont] = strWithoutMtiBitmap[offset:offset+lenoffset] + strWithoutMtiBitmap[
-                        offset+lenoffset:offset+lenoffset+ modvalueSize]
-
-                    if self.DEBUG is True:
-                        print('\tSetting bit %s value %s' %
-                              (cont, self.BITMAP_VALUES[cont]))
-
-                    offset += modvalueSize + lenoffset 
-
-                elif bitType == 'LLL':
-                    if lenform == 'A':
-                        lenoffset = 3
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    elif lenform == 'E':
-                        lenoffset = 3
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset].decode('cp1148'))
-                    elif lenform == 'P':
-                        lenoffset = 2
-                        valueSize = self.__LLLPackToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    else: # 'B'(CD)
-                        lenoffset = 2
-                        valueSize = self.__LLLBCDToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-
-                    if self.DEBUG is True:
-                        print('Size of the message in LLL = %s' % valueSize)
-
-                    if valueSize > self.getBitLimit(cont):
-                        raise ValueTooLarge(
-                            "This bit is larger than the specification!")
-
-                    if self.getBitFormat(cont) == 'P':
-                        modvalueSize = self.__getPackedLen(valueSize)
-                    else:
-                        modvalueSize = valueSize
-
-                    self.BITMAP_VALUES[cont] = strWithoutMtiBitmap[offset:offset+lenoffset] + strWithoutMtiBitmap[
-                        offset+lenoffset:offset+lenoffset+modvalueSize]
-
-                    if self.DEBUG is True:
-                        print('\tSetting bit %s value %s' %
-                              (cont, self.BITMAP_VALUES[cont]))
-
-                    offset += modvalueSize + lenoffset
-
-                elif bitType == 'LLLLLL':
-                    if lenform == 'A':
-                        lenoffset = 6
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    elif lenform == 'E':
-                        lenoffset = 6
-                        valueSize = int(strWithoutMtiBitmap[offset:offset + lenoffset].decode('cp1148'))
-                    elif lenform == 'P':
-                        lenoffset = 3
-                        valueSize = self.__LLLLLLPackToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-                    else: # 'B'(CD)
-                        lenoffset = 3
-                        valueSize = self.__LLLLLLBCDToInt(strWithoutMtiBitmap[offset:offset + lenoffset])
-
-                    if self.DEBUG is True:
-                        print('Size of the message in LLLLLL = %s' % valueSize)
-
-                    if valueSize > self.getBitLimit(cont):
-                        raise ValueTooLarge(
-                            "This bit is larger than the specification!")
-
-                    if self.getBitFormat(cont) == 'P':
-                        modvalueSize = self.__getPackedLen(valueSize)
-                    else:
-                        modvalueSize = valueSize
-
-                    self.BITMAP_VALUES[cont] = strWithoutMtiBitmap[offset:offset+lenoffset] + strWithoutMtiBitmap[
-                        offset+lenoffset:offset+lenoffset+modvalueSize]
-
-                    if self.DEBUG is True:
-                        print('\tSetting bit %s value %s' %
-                              (cont, self.BITMAP_VALUES[cont]))
-
-                    offset += modvalueSize + lenoffset
-
-                # if self.getBitType(cont) == 'LLLL':
-                # valueSize = int(strWithoutMtiBitmap[offset:offset +4])
-                # if valueSize > self.getBitLimit(cont):
-                # raise ValueTooLarge("This bit is larger than the specification!")
-                # self.BITMAP_VALUES[cont] = '(' + strWithoutMtiBitmap[offset:offset+4] + ')' + strWithoutMtiBitmap[offset+4:offset+4+valueSize]
-                # offset += valueSize + 4
-
-                elif bitType == 'N' or bitType == 'A' or bitType == 'ANS' or \
-                   bitType == 'B' or bitType == 'AN':
-
-                    origvalueSize = self.getBitLimit(cont)
-
-                    if self.getBitFormat(cont) == 'P':
-                        modvalueSize = self.__getPackedLen(origvalueSize)
-                    else:
-                        modvalueSize = origvalueSize
-
-                    value = strWithoutMtiBitmap[offset:modvalueSize + offset]
-
-                    #self.__checkBitTypeValidity(cont, value)
-                    self.BITMAP_VALUES[cont] = value
-
-                    if self.DEBUG is True:
-                        print('\tSetting bit %s value %s' %
-                              (cont, self.BITMAP_VALUES[cont]))
-
-                    offset += modvalueSize
-
-    #Parse a Int to LLBCD length
-    def __IntToLLBCD(self,LLlen_int):
-       return binascii.unhexlify('{0:02d}'.format(int(LLlen_int)))
-
-    #Parse a LLBCD length to Int
-    def __LLBCDToInt(self,LLlen_bcd):
-       return LLlen_bcd[0]//16 * 10 + LLlen_bcd[0]%16
-
-    #Parse a Int to LLLBCD length
-    def __IntToLLLBCD(self,LLLlen_int):
-       return binascii.unhexlify('{0:04d}'.format(int(LLLlen_int)))
-
-    #Parse a LLLBCD length to Int
-    def __LLLBCDToInt(self,LLLlen_bcd):
-       return LLLlen_bcd[0]%16*100 + LLLlen_bcd[1]//16*10 + LLLlen_bcd[1]%16
-
-    #Parse a Int to LLLLLLBCD length
-    def __IntToLLLLLLBCD(self,LLLLLLlen_int):
-       return binascii.unhexlify('{0:06d}'.format(int(LLLLLLlen_int)))
-
-    #Parse a LLLLLLBCD length to Int
-    def __LLLLLLBCDToInt(self,LLLLLLlen_bcd):
-       return LLLLLLlen_bcd[0]//16*100000 + LLLLLLlen_bcd[0]%16*10000 + LLLLLLlen_bcd[1]//16*1000 + LLLLLLlen_bcd[1]%16*100 + LLLLLLlen_bcd[2]//16*10 + LLLLLLlen_bcd[2]%16
-
-    #Parse a Int to LLPack length
-    def __IntToLLPack(self,LLlen_int):
-        return binascii.unhexlify('{0:02x}'.format(int(LLlen_int)))
-
-    #Parse a Int to LLLPack length
-    def __IntToLLLPack(self,LLLlen_int):
-        return binascii.unhexlify('{0:04x}'.format(int(LLLlen_int)))
-
-    #Parse a Int to LLLLLLPack length
-    def __IntToLLLLLLPack(self,LLLLLLlen_int):
-        return binascii.unhexlify('{0:06x}'.format(int(LLLLLLlen_int)))
-
-    #Parse a LLPack length to Int
-    def __LLPackToInt(self,LLlen_pack):
-        return LLlen_pack[0]
-
-    #Parse a LLLPack length to Int
-    def __LLLPackToInt(self,LLLlen_pack):
-        return LLLlen_pack[0]%16*256 + LLLlen_pack[1]
+        # Bits present and offsets of the fixed length ones, shared by all the packages with this bitmap
+        layout = self.spec.layouts.getLayout(self.BITMAP, self.spec.codecs)
 
-    #Parse a LLLLLLPack length to Int
-    def __LLLLLLPackToInt(self,LLLLLLlen_pack):
-        return LLLLLLlen_pack[0]*256*256 + LLLLLLlen_pack[1]*256 + LLLLLLlen_pack[2]
+        base = 0
+        for cont, offset, fixedLen, scan in layout:
+            offset += base
+            if self.DEBUG is True:
+                print('String = %s offset = %s bit = %s' %
+                      (strWithoutMtiBitmap[offset:], offset, cont))
 
-    #Get packed equivalent size
-    def __getPackedLen(self,origlen):
-       if origlen % 2 == 0:
-           packed_len = int(origlen/2)
-       else:
-           packed_len = int((origlen+1)/2)
-       return packed_len
+            if scan is None:
+                end = offset + fixedLen
+            elif errors is None:  # Variable bit, the next offsets are relative to its end
+                end = base = scan(strWithoutMtiBitmap, offset)
+            else:
+                # The size is checked with the value, a length indicator that can't be read leaves the next bits unknown
+                try:
+                    end = base = scan(strWithoutMtiBitmap, offset, False)
+                except (ValueError, IndexError):
+                    errors.append((cont, start + offset, 'length indicator cannot be decoded'))
+                    return
+                except InvalidFormat as error:
+                    errors.append((cont, start + offset, str(error)))
+                    return
+
+            if errors is not None:
+                if end > len(strWithoutMtiBitmap):
+                    reason = 'bit beyond the end of the package'
+                else:
+                    reason = self.spec.codecs[cont].check(bytes(strWithoutMtiBitmap[offset:end]))
+                if reason is not None:
+                    errors.append((cont, start + offset, reason))
+
+            if self.LAZY is True:
+                # Only remember where the bit is, the bytes are copied by __getRawBit
+                self.ISO_INDEX[cont] = (offset, end)
+                self.BITMAP_VALUES[cont] = self._BIT_LAZY_VALUE
+            else:
+                self.BITMAP_VALUES[cont] = strWithoutMtiBitmap[offset:end]
 
-    #Get packed equivalent size
-    def __getUnpackedLen(self,origlen):
-       return self.__getPackedLen(origlen)*2
+            if self.DEBUG is True:
+                print('\tSetting bit %s value %s' %
+                      (cont, self.BITMAP_VALUES[cont]))
 
     # Parse a ASCII iso to object
     def setIsoContent(self, iso):
@@ -1538,7 +1188,12 @@ class Iso8583:
             for v in v3:
                 print ('Bit %s of type %s with value = %s' % (v['bit'],v['type'],v['value']))
 
+        In strict mode (see the constructor) every bit is validated while parsed, against its size and value type,
+        and all the errors are returned instead of raising on the first one. A length indicator that can't be read
+        is the last error, because the bits after it can't be found.
+
         @param: str -> complete ISO8583 string
+        @return: None, or in strict mode a list with one (bit, offset, reason) per error found (bit 0 is the MTI), empty if the package is valid
         @raise: InvalidIso8583 Exception
         """
 
@@ -1554,21 +1209,32 @@ class Iso8583:
 
         if len(iso) < (mti_len + bitmap_min_size + self.hdrlen):
             raise InvalidIso8583('This is not a valid iso!!')
+        if self.LAZY is not True and isinstance(iso, memoryview):
+            # The bits are copied anyway, so the view (a frame of Iso8583Framer for example) is not kept
+            iso = iso.tobytes()
         if self.DEBUG is True:
-            print('ASCII to process <%s>' % iso)
+            print('ASCII to process <%s>' % bytes(iso))
 
         if self.hdrlen > 0:
-            self.hdr = iso[0:self.hdrlen]
+            self.hdr = bytes(iso[0:self.hdrlen])
+
+        if self.spec.ebcdic is True:
+            # Whole message EBCDIC, translated at once and parsed as ASCII (the header is kept as received)
+            iso = bytes(iso).translate(EBCDIC_TO_ASCII)
         if self.DEBUG is True:
             print('Header found was %s' % self.hdr)
 
+        # Values of a previous package are dropped
+        self.BITMAP_VALUES.clear()
+        self.ISO_INDEX.clear()
+        self.__setDirty()
+
         self.__setMTIFromStr(iso[self.hdrlen:])
         if self.MTI_format == 'A' or self.MTI_format == 'E':
             isoT = iso[self.hdrlen + 4:]
         else:
             isoT = iso[self.hdrlen + 2:]
         self.__getBitmapFromStr(isoT)
-        self.__initializeBitsFromBitmapStr(self.BITMAP_HEX)
         if self.DEBUG is True:
             print('This is the array of bits (before) %s ' %
                   self.BITMAP_VALUES)
@@ -1578,13 +1244,182 @@ class Iso8583:
         else:
             bitmap_size = int(len(self.BITMAP_HEX)/2)
 
-        self.__getBitFromStr(iso[self.hdrlen + mti_len + bitmap_size:])
+        errors = None
+        if self.STRICT is True:
+            errors = []
+            try:
+                mti = self.getMTI()
+            except UnicodeDecodeError:
+                mti = ''
+            if len(mti) != 4 or not self._MTI_PATTERN.fullmatch(mti):
+                errors.append((0, self.hdrlen, "MTI '%s' is not valid" % mti))
+
+        start = self.hdrlen + mti_len + bitmap_size
+        if self.LAZY is True:
+            # Keep a single view over the bits of the package, they are only indexed
+            self.ISO_BUFFER = memoryview(iso)[start:]
+            self.__getBitFromStr(self.ISO_BUFFER, errors, start)
+        else:
+            self.__getBitFromStr(iso[start:], errors, start)
         if self.DEBUG is True:
             print('This is the array of bits (after) %s ' % self.BITMAP_VALUES)
 
+        return errors
+
+    # Decode only some bits of a ASCII iso
+    def parse(self, iso, fields=None):
+        """Method that decode only some bits of a complete ISO8583 string, for example to route a package before parsing it.
+        The offsets are computed only up to the highest bit asked, the fixed length bits on the way are just skipped and
+        only the bits asked are copied and decoded. This object is not changed, only its Spec, formats and header length are used.
+        Example:
+            iso = ISO8583()
+            values = iso.parse(package, fields={3, 11, 41})
+            route = (values[0], values.get(3))
+        @param: iso -> complete ISO8583 string, the same that setIsoContent receives
+        @param: fields -> bit numbers to decode, default all the bits
+        @return: dict -> bit number: value of the bits asked that are set in the package, plus the MTI at key 0
+            and the bitmap (128 bits int, bit N is 1 << (128 - N)) at key 1
+        @raise: InvalidIso8583 Exception, BitNonexistent Exception
+        """
+        if fields is None:
+            wanted = ((1 << 128) - 1) ^ self._BITMAP_SECONDARY
+        else:
+            wanted = 0
+            for bit in fields:
+                if bit < 2 or bit > 128:
+                    raise BitNonexistent("Bit number %s dosen't exist!" % bit)
+                wanted |= self._BITMAP_MASK[bit]
+
+        if self.MTI_format == 'A' or self.MTI_format == 'E':
+            mti_len = 4
+        else:
+            mti_len = 2
+
+        if self.BITMAP_format == 'A' or self.BITMAP_format == 'E':
+            bitmap_min_size = 16
+        else:
+            bitmap_min_size = 8
+
+        if len(iso) < (mti_len + bitmap_min_size + self.hdrlen):
+            raise InvalidIso8583('This is not a valid iso!!')
+
+        if self.spec.ebcdic is True:
+            # Whole message EBCDIC, translated at once and parsed as ASCII
+            iso = bytes(iso).translate(EBCDIC_TO_ASCII)
+
+        offset = self.hdrlen + mti_len
+        values = {0: self.__decodeMTI(iso[self.hdrlen:offset])}
+
+        bitmap, bitmap_hex = self.__readBitmap(iso[offset:])
+        if self.BITMAP_format == 'A' or self.BITMAP_format == 'E':
+            offset += len(bitmap_hex)
+        else:
+            offset += len(bitmap_hex) // 2
+
+        values[1] = bitmap
+
+        compiled = self.spec.compiled
+        if fields is None and compiled is not None:
+            # Generated code of the Spec (see Spec.generateCode), all the bits at once
+            compiled.parseBits(bytes(iso), offset, bitmap, values)
+            return values
+
+        wanted &= bitmap
+        if not wanted:
+            return values
+        # The least significant bit of the int is the highest bit number
+        last = 129 - (wanted & -wanted).bit_length()
+
+        codecs = self.spec.codecs
+        base = offset
+        for cont, offset, fixedLen, scan in self.spec.layouts.getLayout(bitmap, codecs):
+            if cont > last:
+                break
+            offset += base
+            if scan is None:
+                end = offset + fixedLen
+            else:  # Variable bit, the next offsets are relative to its end
+                end = base = scan(iso, offset)
+            if wanted & self._BITMAP_MASK[cont]:
+                values[cont] = codecs[cont].decode(bytes(iso[offset:end]))
+
+        return values
+
+    # Encode a complete ISO8583 string from values
+    def build(self, values):
+        """Method that encode a complete ISO8583 string from a dict of values, the reverse of parse.
+        The bitmap is computed from the bits given. This object is not changed, only its Spec, formats and header are used,
+        and in strict mode the values are validated like setBit does.
+        When the Spec has generated code (see Spec.generateCode) the bits are encoded by it.
+        Example:
+            iso = ISO8583()
+            package = iso.build({0: '0800', 7: '1017123456', 11: 1, 70: 301})
+        @param: values -> dict bit number: value, with the MTI at key 0 (the key 1 is ignored, so the result of parse can be given)
+        @return: bytes -> the same that getRawIso returns for an object with these values
+        @raise: InvalidMTI Exception, BitNonexistent Exception, ValueTooLarge Exception, InvalidValueType Exception (strict mode)
+        """
+        if 0 not in values:
+            raise InvalidMTI('Check MTI! Do you set it?')
+
+        bitmap = 0
+        for bit in values:
+            if bit > 1:
+                if bit > 128:
+                    raise BitNonexistent("Bit number %s dosen't exist!" % bit)
+                if self.STRICT is True:
+                    self.__checkBitTypeValidity(bit, "%s" % values[bit])
+                bitmap |= self._BITMAP_MASK[bit]
+        if bitmap & ((1 << 64) - 1):
+            bitmap |= self._BITMAP_SECONDARY
+
+        compiled = self.spec.compiled
+        if compiled is not None:
+            parts = compiled.buildBits(values, bitmap)
+        else:
+            codecs = self.spec.codecs
+            parts = [codecs[cont].encode(values[cont]) for cont in range(2, 129) if bitmap & self._BITMAP_MASK[cont]]
+
+        packed, bitmap_hex = self.__encodeBitmap(bitmap)
+        if self.BITMAP_format == 'A':
+            packed = bitmap_hex
+        elif self.BITMAP_format == 'E':
+            packed = bitmap_hex.decode().encode('cp1148')
+
+        package = b''.join([self.__encodeMTI(values[0]), packed] + parts)
+        if self.spec.ebcdic is True:
+            package = package.translate(ASCII_TO_EBCDIC)
+        return self.hdr + package
+
+    # Return the canonical bytes of the package
+    def __getCanonical(self):
+        """Method that return the package (MTI + bitmap + bits, without header) as it is serialized, without copying it
+        It's a internal method, so don't call!
+        @return: memoryview
+        @raise: InvalidMTI Exception
+        """
+        return memoryview(self.__serialize())[self._NETWORK_LEN_SIZE + len(self.hdr):]
+
+    # Return the fingerprint of the package
+    def getFingerprint(self):
+        """Method that return a 64 bits fingerprint of the package, computed over its canonical bytes
+        (MTI + bitmap + bits as serialized, the header is not part of it).
+        It's computed once and kept until the package changes, like getRawIso, and is the same in every process
+        and machine, so it can be stored to detect duplicated transmissions.
+        Example:
+            if iso.getFingerprint() in seen:
+                print ('Duplicated!')
+        @return: int (0 <= fingerprint < 2**64)
+        @raise: InvalidMTI Exception
+        """
+        if self.FINGERPRINT is None:
+            self.FINGERPRINT = int.from_bytes(hashlib.blake2b(self.__getCanonical(), digest_size=8).digest(), 'big')
+        return self.FINGERPRINT
+
     # Method that compare 2 isos
-    def __cmp__(self, obj2):
-        """Method that compare two objects in "==", "!=" and other things
+    def __eq__(self, obj2):
+        """Method that compare two objects with "==" and "!="
+        Two objects are equal when their canonical bytes (MTI + bitmap + bits, without header) are the same.
+        The fingerprints are compared first, so different packages are told apart without comparing all the bytes.
         Example:
             p1 = ISO8583()
             p1.setMTI('0800')
@@ -1601,20 +1436,39 @@ class Iso8583:
             p2.setIsoContent(iso)
 
             print ('Is equivalent?')
-            if p1 == p1:
+            if p1 == p2:
                 print ('Yes :)')
             else:
                 print ('Noooooooooo :(')
 
+        A package that can't be serialized yet (without MTI) is only equal to itself.
         @param: obj2 -> object that will be compared
-        @return: <0 if is not equal, 0 if is equal
+        @return: True if is equal, False if not
         """
-        ret = -1  # By default is different
-        if (self.getMTI() == obj2.getMTI()) and (self.getBitmap() == obj2.getBitmap()) and (
-                self.getValuesArray() == obj2.getValuesArray()):
-            ret = 0
-
-        return ret
+        if not isinstance(obj2, Iso8583):
+            return NotImplemented
+        if self is obj2:
+            return True
+        try:
+            if self.getFingerprint() != obj2.getFingerprint():
+                return False
+            return self.__getCanonical() == obj2.__getCanonical()
+        except InvalidMTI:
+            return NotImplemented
+
+    # Hash of the iso
+    def __hash__(self):
+        """Method that return the hash of the object, its fingerprint, so it can be a dict key or in a set
+        (response caches, for example).
+        The hash is a snapshot of the package when it is called: an object changed while it is a key is not found
+        any more, so only use packages that are not changed (parsed requests, built responses), or getFingerprint()
+        itself as the key. A package that can't be serialized yet (without MTI) hashes by identity, like its equality.
+        @return: int
+        """
+        try:
+            return self.getFingerprint()
+        except InvalidMTI:
+            return object.__hash__(self)
 
     # Method that return a array with bits and values inside the iso package
     def getBitsAndValues(self):
@@ -1641,16 +1495,86 @@ class Iso8583:
         @return: array of values.
         """
         ret = []
-        for cont in range(2, 129):
-            if self.BITMAP_VALUES[cont] != self._BIT_DEFAULT_VALUE:
-                _TMP = {}
-                _TMP['bit'] = "%d" % cont
-                _TMP['type'] = self.getBitType(cont)
-                _TMP['value_raw'] = self.BITMAP_VALUES[cont]
-                _TMP['value'] = self.getBit(cont)
-                ret.append(_TMP)
+        for cont, raw, value in self.iterBits():
+            ret.append({'bit': "%d" % cont, 'type': self.getBitType(cont), 'value_raw': raw.tobytes(), 'value': value})
         return ret
 
+    # Iterate over the bits and values inside the iso package
+    def iterBits(self, decode=True):
+        """Generator of the bits present in the package, in order, as (bit, raw, value) tuples where:
+                bit: is the bit number (int)
+                raw: is a memoryview over the bytes of the bit (length indicator included), not copied
+                value: is the decoded value (str), or None if decode is False
+            Nothing else is built per bit, so it's the way to log or forward all the bits of a package.
+            The raw views must not be kept after the object is changed or reused.
+        Example:
+            for bit, raw, value in iso.iterBits():
+                print('Bit %s = %s' % (bit, value))
+        @param: decode (True or False) default True -> if False, only the raw bytes are given
+        @return: generator of (bit, raw, value)
+        """
+        codecs = self.spec.codecs
+        # Bit 1 (continuation bit) has no value
+        bitmap = self.BITMAP & ~self._BITMAP_SECONDARY
+        while bitmap:
+            length = bitmap.bit_length()
+            bitmap ^= 1 << (length - 1)
+            cont = 129 - length
+            raw = self.__getRawBit(cont, copy=False)
+            view = memoryview(raw)
+            if decode is not True:
+                yield cont, view, None
+            elif type(raw) is bytes:
+                yield cont, view, codecs[cont].decode(raw)
+            else:
+                yield cont, view, codecs[cont].decode(view.tobytes())
+
+    # Method that return the value of a bit as int
+    def getAmount(self, bit):
+        """Return the value of a numeric bit (amounts, like bits 4, 5 and 6) as int, in minor units
+        Example: bit 4 = 000000001500 -> 1500
+        @param: bit -> the number of the bit
+        @return: int
+        @raise: BitNonexistent Exception, BitNotSet Exception, InvalidValueType Exception
+        """
+        value = self.getBit(bit)
+        # Amounts may have a C(redit)/D(ebit) sign before the digits
+        sign = 1
+        if value[:1] in ('C', 'D'):
+            if value[0] == 'D':
+                sign = -1
+            value = value[1:]
+        if not value.isdigit():
+            raise InvalidValueType('Error: value of bit %s is not an amount' % bit)
+        return sign * int(value)
+
+    # Method that return the value of a bit as datetime
+    def getDate(self, bit, format=None, year=None):
+        """Return the value of a date/time bit as datetime.datetime
+        The formats of the bits 7 (MMDDhhmmss), 12 (hhmmss), 13, 15, 16, 17 (MMDD) and 14 (YYMM) are known,
+        the others need a format. When the format has no year, the current year (or the one given) is used.
+        Example: bit 7 = 1017123456 -> datetime(<current year>, 10, 17, 12, 34, 56)
+        @param: bit -> the number of the bit
+        @param: format -> time.strptime like format of the value, example '%y%m%d'
+        @param: year -> year of the dates without year, default the current year
+        @return: datetime.datetime
+        @raise: BitNonexistent Exception, BitNotSet Exception, InvalidValueType Exception
+        """
+        value = self.getBit(bit)
+        if format is None:
+            format = self._DATE_FORMATS.get(bit)
+            if format is None:
+                raise InvalidValueType('Error: bit %s has no known date format' % bit)
+        if '%y' not in format and '%Y' not in format:
+            if year is None:
+                year = time.localtime().tm_year
+            format = '%Y' + format
+            value = '%04d%s' % (year, value)
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            raise InvalidValueType('Error: value of bit %s is not a date' % bit)
+
     # Method that return a array with bits and values inside the iso package
     def getBit(self, bit):
         """Return the value of the bit
@@ -1662,67 +1586,51 @@ class Iso8583:
             raise BitNonexistent("Bit number %s dosen't exist!" % bit)
 
         # Is that bit set?
-        isThere = False
-        arr = self.__getBitsFromBitmap()
+        if self.BITMAP & self._BITMAP_MASK[bit]:
+            return self.spec.codecs[bit].decode(self.__getRawBit(bit))
+        else:
+            raise BitNotSet("Bit number %s was not set!" % bit)
 
-        if self.DEBUG is True:
-            print('This is the array of bits inside the bitmap %s' % arr)
-
-        for v in arr:
-            if v == bit:
-                bitType = self.getBitType(bit)
-                value = self.BITMAP_VALUES[bit]
-                lenform = self.getBitLenForm(bit)
-                if bitType == 'LL':
-                    if lenform == 'A':
-                        offset = 2
-                        valueSize = int(value[0:0+offset])
-                    elif lenform == 'E':
-                        offset = 2
-                        valueSize = int(value[0:0+offset].decode('cp1148'))
-                    elif lenform == 'P':
-                        offset = 1
-                        valueSize = self.__LLPackToInt(value[0:0+offset])
-                    else: # B(CD)
-                        offset = 1
-                        valueSize = self.__LLBCDToInt(value[0:0+offset])
-                elif bitType == 'LLL':
-                    if lenform == 'A':
-                        offset = 3
-                        valueSize = int(value[0:0+offset])
-                    elif lenform == 'E':
-                        offset = 3
-                        valueSize = int(value[0:0+offset].decode('cp1148'))
-                    elif lenform == 'P':
-                        offset = 2
-                        valueSize = self.__LLLPackToInt(value[0:0+offset])
-                    else: # B(CD)
-                        offset = 2
-                        valueSize = self.__LLLBCDToInt(value[0:0+offset])
-                else: # Fixed length field
-                    offset = 0
-
-                isThere = True
-                break
+    # Method that return the subfields of a bit
+    def getSubfields(self, bit):
+        """Return the subfields of the bit, decoded on demand according to the Spec (see Spec.withSubfields)
+        The bytes of the bit are not copied: a TLV is only indexed up to the tag asked, a fixed position
+        subfield is only decoded when asked (only a 'tlvhex' bit in EBCDIC format is translated to ASCII first). Bit 55 (EMV data) is TLV written as hexadecimal text in the default Spec,
+        because it's a ASCII bit; binary EMV data needs withSubfields(55, 'tlv').
+        Example:
+            emv = iso.getSubfields(55)
+            amount = emv.getNumeric('9F02')
+        @param: bit -> the number of the bit
+        @return: TLV or FixedSubfields (see iso_subfields.py)
+        @raise: BitNonexistent Exception, BitNotSet Exception, InvalidSubfield Exception
+        """
 
-        if isThere:
-            data_form = self.getBitFormat(bit)
-            if data_form == "A":
-                return value[offset:].decode()
-            elif data_form == "E":
-                return value[offset:].decode('cp1148')
-            else: # Must be packed, so has possible padding to be stripped
-                unpacked_data = binascii.hexlify(value[offset:])
-                if bitType == 'LL' or bitType == 'LLL':
-                   return unpacked_data[0:valueSize].decode()
-                else: # Must be bitType 'N' or 'B'- possibly left-padded with a zero
-                   if self.getBitLimit(bit) % 2 == 0:
-                       return unpacked_data[0:].decode()
-                   else: # Skip the leading padding '0'
-                       return unpacked_data[1:].decode()
-        else:
+        if bit < 1 or bit > 128:
+            raise BitNonexistent("Bit number %s dosen't exist!" % bit)
+
+        definition = self.spec.getSubfields(bit)
+        if definition is None:
+            raise InvalidSubfield('Error bit %s has no subfields definition!' % bit)
+
+        if not self.BITMAP & self._BITMAP_MASK[bit]:
             raise BitNotSet("Bit number %s was not set!" % bit)
 
+        codec = self.spec.codecs[bit]
+        raw = self.__getRawBit(bit, copy=False)
+        data = memoryview(raw)[codec.prefixLen:]
+        if definition == SUBFIELDS_TLV_HEX:
+            format = self.spec.getDefinition(bit)[6]
+            if format == 'A' or self.spec.ebcdic is True:  # ASCII text, indexed where it is
+                return TLV(data, hexadecimal=True)
+            if format == 'P':  # The packed digits are already the bytes of the items
+                return TLV(data)
+            # EBCDIC text, translated to ASCII (a copy of the bit) and then indexed
+            return TLV(codec.decodeData(bytes(data)).encode('ascii', 'replace'), hexadecimal=True)
+
+        if definition == SUBFIELDS_TLV:
+            return TLV(data)
+        return FixedSubfields(data, definition, codec.decodeData)
+
     # Method that returns a timestamp in YYMMDDhhmmss format
     def getYYMMDDhhmmss(self):
         """Return the current date/time in YYMMDDhhmmss format
@@ -1757,6 +1665,7 @@ class Iso8583:
     def getNetworkISO(self, bigEndian=True):
         """Method that return ISO8583 ASCII package with the size in the beginning
         By default, it return the package with size represented with big-endian.
+        The size is a 2 bytes unsigned int, so packages up to 65535 bytes. To read them from a stream, see Iso8583Framer.
         Is the same that:
             import struct
             (...)
@@ -1765,33 +1674,32 @@ class Iso8583:
             (...)
             ascii = iso.getRawIso()
             # Example: big-endian
-            # To little-endian, replace '!h' with '<h'
-            netIso = struct.pack('!h',len(iso))
+            # To little-endian, replace '!H' with '<H'
+            netIso = struct.pack('!H',len(iso))
             netIso += ascii
             # Example: big-endian
             # To little-endian, replace 'iso.getNetworkISO()' with 'iso.getNetworkISO(False)'
             print ('This <%s> the same that <%s>' % (iso.getNetworkISO(),netIso))
 
+        The big-endian form is cached with getRawIso, the size is written in room reserved while serializing.
         @param: bigEndian (True|False) -> if you want that the size be represented in this way.
         @return: size + ASCII ISO8583 package ready to go to the network!
-        @raise: InvalidMTI Exception
+        @raise: InvalidMTI Exception, ValueTooLarge Exception (package larger than 65535 bytes)
         """
 
-        netIso = "".encode()
-        asciiIso = self.getRawIso()
+        netIso = self.__serialize()
+        size = len(netIso) - self._NETWORK_LEN_SIZE
+        if size > self._NETWORK_LEN_MAX:
+            raise ValueTooLarge('Error: package up to size! Limit size of the network form = %s' % self._NETWORK_LEN_MAX)
 
         if bigEndian:
-            netIso = struct.pack('!h', len(asciiIso))
             if self.DEBUG is True:
                 print('Pack Big-endian')
-        else:
-            netIso = struct.pack('<h', len(asciiIso))
-            if self.DEBUG is True:
-                print('Pack Little-endian')
+            return netIso
 
-        netIso += asciiIso
-
-        return netIso
+        if self.DEBUG is True:
+            print('Pack Little-endian')
+        return struct.pack('<H', size) + netIso[self._NETWORK_LEN_SIZE:]
 
     # Method that recieve a ISO8583 ASCII package in the network form and parse it.
     def setNetworkISO(self, iso, bigEndian=True):
@@ -1812,8 +1720,8 @@ class Iso8583:
             newIso.setNetworkISO(netIso)
             #Is the same that:
             #size = netIso[0:2]
-            ## To little-endian, replace '!h' with '<h'
-            #size = struct.unpack('!h',size )
+            ## To little-endian, replace '!H' with '<H'
+            #size = struct.unpack('!H',size )
             #newIso.setIsoContent(netIso[2:size])
             arr = newIso.getBitsAndValues()
             for v in arr:
@@ -1839,11 +1747,11 @@ class Iso8583:
 
         size = iso[0:2]
         if bigEndian:
-            size = struct.unpack('!h', size)
+            size = struct.unpack('!H', size)
             if self.DEBUG is True:
                 print('Unpack Big-endian')
         else:
-            size = struct.unpack('<h', size)
+            size = struct.unpack('<H', size)
             if self.DEBUG is True:
                 print('Unpack Little-endian')
 
@@ -1880,10 +1788,5 @@ class Iso8583:
         iso_content += self.getBitmap().decode()
 
         # Add each bit value
-        for cont in range(1, 129):
-            if self.BITMAP_VALUES[cont] != self._BIT_DEFAULT_VALUE:
-                value = self.getBit(cont)
-                iso_content += value
-
-        return iso_content
+        return iso_content + ''.join(value for cont, raw, value in self.iterBits())
 
@@ -0,0 +1,331 @@
+""" Batch decoding of many ISO8583 packages, in columns instead of one Iso8583 object per package.
+Used by offline jobs (reconciliation, replay, analytics) that decode millions of stored packages:
+    decodeBatch -> groups the packages by bitmap, computes the layout once per group and extracts its
+        fixed length bits for the whole group into NumPy arrays
+    parseMany -> streams any iterable of packages into chunks of per bit lists, with plain Python
+NumPy is optional, it's only needed by decodeBatch.
+"""
+from collections import namedtuple
+from iso8583.iso_errors import *
+from iso8583.iso8583 import Iso8583
+from iso8583.iso_codecs import EBCDIC_TO_ASCII
+
+try:
+    import numpy
+except ImportError:  # Optional dependency, decodeBatch raises ImportError without it
+    numpy = None
+
+BatchResult = namedtuple('BatchResult', ['mti', 'values', 'present', 'errors'])
+
+# Largest number of digits that always fits in a int64
+_INT64_DIGITS = 18
+
+
+################################################################################################
+# Kind of array used for a bit
+def _getColumnKind(spec, bit):
+    """Return how a bit is extracted: 'int' (fixed numeric, int64), 'bytes' (fixed, raw bytes),
+    'packed' (fixed packed, uint8 matrix) or 'object' (variable, decoded str)
+    It's a internal function, so don't call!
+    """
+    codec = spec.codecs[bit]
+    if codec.fixedLen is None:
+        return 'object'
+    smallStr, largeStr, bitType, LenForm, size, valueType, format = spec.getDefinition(bit)
+    if valueType == 'n' and size <= _INT64_DIGITS:
+        return 'int'
+    if format == 'P':  # Binary, a 'S' array would drop its trailing zero bytes
+        return 'packed'
+    return 'bytes'
+
+################################################################################################
+
+
+################################################################################################
+# Bitmap helpers
+
+#Get the size of the bitmap (1 or 2 bitmaps) that starts at offset
+def _getBitmapSize(package, offset, format):
+    if format == 'P':
+        return 16 if package[offset] & 0x80 else 8
+    # The first hexadecimal digit is 8 or more when there is a 2nd bitmap
+    digit = bytes(package[offset:offset + 1])
+    if format == 'E':
+        digit = digit.decode('cp1148')
+    return 32 if int(digit, 16) & 8 else 16
+
+#Get the str of a MTI
+def _decodeMTI(mti, format):
+    if format == 'A':
+        return bytes(mti).decode()
+    if format == 'E':
+        return bytes(mti).decode('cp1148')
+    return bytes(mti).hex()
+
+#Get the 128 bits int of a bitmap, bit N is (1 << (128 - N))
+def _readBitmap(bitmap_raw, format):
+    if format == 'P':
+        return int.from_bytes(bitmap_raw, 'big') << (128 - len(bitmap_raw) * 8)
+    if format == 'E':
+        bitmap_raw = bitmap_raw.decode('cp1148')
+    return int(bitmap_raw, 16) << (128 - len(bitmap_raw) * 4)
+
+################################################################################################
+
+
+################################################################################################
+# Convert a block of fixed numeric bits to int64
+def _digitsToInt(block, format, size):
+    """Convert a (packages x bytes) uint8 block with a numeric bit of each package to a int64 array,
+    and a bool array telling the packages whose bit has only digits (the others are 0 in the int64 array)
+    The format 'T' (translated text of a whole message EBCDIC package) has ASCII digits, like 'A'.
+    It's a internal function, so don't call!
+    """
+    if format == 'P':
+        # Two digits per byte, the odd sizes have a leading padding digit
+        digits = numpy.empty((block.shape[0], block.shape[1] * 2), dtype=numpy.int64)
+        digits[:, 0::2] = block >> 4
+        digits[:, 1::2] = block & 0x0F
+        digits = digits[:, digits.shape[1] - size:]
+    elif format == 'E':
+        digits = block.astype(numpy.int64) - 0xF0
+    else:
+        digits = block.astype(numpy.int64) - 0x30
+
+    valid = ((digits >= 0) & (digits <= 9)).all(axis=1)
+    if not valid.all():
+        digits[~valid] = 0
+
+    weights = 10 ** numpy.arange(digits.shape[1] - 1, -1, -1, dtype=numpy.int64)
+    return digits @ weights, valid
+
+################################################################################################
+
+
+################################################################################################
+# Decode many packages at once
+def decodeBatch(packages, fields, iso=None):
+    """Decode some bits of many ISO8583 packages into NumPy arrays, one position per package (in the same order).
+    The packages are grouped by bitmap, so the layout is computed once per group. The fixed length bits are
+    copied for the whole group with array indexing, only the length indicators of the variable bits are read
+    package by package.
+        numeric fixed bits (valueType 'n', up to 18 digits) -> int64 array, 0 if not present
+        other fixed bits -> fixed width bytes array ('S' dtype) with the bytes of the package, b'' if not present
+        other fixed packed bits -> uint8 array with one row of bytes per package, zeros if not present
+        variable bits -> object array with the decoded str, None if not present
+    A value that can't be decoded (a numeric bit with other characters, for example) doesn't stop the batch: the bit
+    is left as not present in that package and the package is listed in errors.
+    A package that can't be read at all (too small, or a bit beyond its end) raises InvalidIso8583 with its index.
+    Example:
+        from iso8583 import decodeBatch
+
+        batch = decodeBatch(packages, fields=(4, 11, 41))
+        total = batch.values[4][batch.present[4]].sum()
+        for index, bit, reason in batch.errors:
+            (...)
+    @param: packages -> sequence of complete ISO8583 str, the same that setIsoContent receives
+    @param: fields -> bit numbers to decode
+    @param: iso -> Iso8583 object whose Spec, MTI/BITMAP formats and header length are used, default Iso8583()
+    @return: BatchResult(mti, values, present, errors) -> mti: str array with the MTI of each package,
+        values: dict bit -> array, present: dict bit -> bool array telling the packages that have the bit,
+        errors: list of (package index, bit, reason) of the values that couldn't be decoded, in no particular order
+    @raise: ImportError, InvalidIso8583 Exception, BitNonexistent Exception
+    """
+    if numpy is None:
+        raise ImportError('decodeBatch needs numpy, install it with "pip install numpy"')
+
+    if iso is None:
+        iso = Iso8583()
+    spec = iso.getSpec()
+    hdrlen = iso.getHdrlen()
+
+    fields = sorted(set(fields))
+    for bit in fields:
+        if bit < 2 or bit > 128:
+            raise BitNonexistent("Bit number %s dosen't exist!" % bit)
+
+    if iso.MTI_format == 'A' or iso.MTI_format == 'E':
+        mti_len = 4
+    else:
+        mti_len = 2
+    if iso.BITMAP_format == 'A' or iso.BITMAP_format == 'E':
+        bitmap_min_size = 16
+    else:
+        bitmap_min_size = 8
+
+    if spec.ebcdic is True:
+        # Whole message EBCDIC Spec, the packages are translated before everything
+        packages = [bytes(package).translate(EBCDIC_TO_ASCII) for package in packages]
+
+    count = len(packages)
+    mti = numpy.empty(count, dtype='U4')
+    kinds = {}
+    values = {}
+    present = {}
+    errors = []
+    for bit in fields:
+        kinds[bit] = kind = _getColumnKind(spec, bit)
+        if kind == 'int':
+            values[bit] = numpy.zeros(count, dtype=numpy.int64)
+        elif kind == 'bytes':
+            values[bit] = numpy.zeros(count, dtype='S%d' % spec.codecs[bit].fixedLen)
+        elif kind == 'packed':
+            values[bit] = numpy.zeros((count, spec.codecs[bit].fixedLen), dtype=numpy.uint8)
+        else:
+            values[bit] = numpy.full(count, None, dtype=object)
+        present[bit] = numpy.zeros(count, dtype=bool)
+
+    # Group the packages by the bytes of their bitmap, they don't need to be decoded for that
+    groups = {}
+    for index, package in enumerate(packages):
+        if len(package) < (mti_len + bitmap_min_size + hdrlen):
+            raise InvalidIso8583('This is not a valid iso!! Package %d is too small' % index)
+        mti[index] = _decodeMTI(package[hdrlen:hdrlen + mti_len], iso.MTI_format)
+        start = hdrlen + mti_len
+        size = _getBitmapSize(package, start, iso.BITMAP_format)
+        groups.setdefault(bytes(package[start:start + size]), []).append(index)
+
+    wanted = 0
+    for bit in fields:
+        wanted |= Iso8583._BITMAP_MASK[bit]
+
+    for bitmap_raw, indexes in groups.items():
+        # Decode the bitmap and compute the layout once for the whole group
+        bitmap = _readBitmap(bitmap_raw, iso.BITMAP_format)
+        if not bitmap & wanted:
+            continue
+        layout = spec.layouts.getLayout(bitmap, spec.codecs)
+        start = hdrlen + mti_len + len(bitmap_raw)
+
+        # All the packages of the group side by side in a flat buffer
+        group = [bytes(packages[index]) for index in indexes]
+        lengths = numpy.fromiter((len(package) for package in group), dtype=numpy.int64, count=len(group))
+        rows = numpy.zeros(len(group), dtype=numpy.int64)
+        numpy.cumsum(lengths[:-1], out=rows[1:])
+        flat = numpy.frombuffer(b''.join(group), dtype=numpy.uint8)
+        positions = numpy.asarray(indexes, dtype=numpy.int64)
+
+        # Offset of the bits, relative to the end of the last variable bit (same for the whole group)
+        # and where that variable bit ends inside each package
+        base = numpy.full(len(group), start, dtype=numpy.int64)
+        last = max(bit for bit in fields if bitmap & Iso8583._BITMAP_MASK[bit])
+        for cont, offset, fixedLen, scan in layout:
+            if cont > last:
+                break
+            kind = kinds.get(cont)
+            if scan is None:
+                if kind is not None:
+                    width = fixedLen
+                    columns = base + offset
+                    beyond = numpy.flatnonzero(columns + width > lengths)
+                    if beyond.size:
+                        raise InvalidIso8583('This is not a valid iso!! Bit %d is beyond the end of package %d'
+                                             % (cont, indexes[beyond[0]]))
+                    block = flat[(rows + columns)[:, None] + numpy.arange(width, dtype=numpy.int64)]
+                    if kind == 'int':
+                        definition = spec.getDefinition(cont)
+                        format = definition[6]
+                        if spec.ebcdic is True:  # The bits of a whole message EBCDIC package are translated text
+                            format = 'T'
+                        numbers, valid = _digitsToInt(block, format, definition[4])
+                        values[cont][positions] = numbers
+                        present[cont][positions] = valid
+                        for row in numpy.flatnonzero(~valid):
+                            errors.append((indexes[row], cont, 'Error: numeric bit has a non numeric value'))
+                    elif kind == 'packed':
+                        values[cont][positions] = block
+                        present[cont][positions] = True
+                    else:
+                        values[cont][positions] = numpy.ascontiguousarray(block).view('S%d' % width).ravel()
+                        present[cont][positions] = True
+                continue
+
+            # Variable bit: its length indicator is read package by package
+            codec = spec.codecs[cont]
+            for row, package in enumerate(group):
+                begin = int(base[row]) + offset
+                try:
+                    end = scan(package, begin)
+                except (ValueError, ValueTooLarge, InvalidIso8583) as error:
+                    raise InvalidIso8583('This is not a valid iso!! Bit %d of package %d: %s' % (cont, indexes[row], error))
+                if end > len(package):
+                    raise InvalidIso8583('This is not a valid iso!! Bit %d is beyond the end of package %d'
+                                         % (cont, indexes[row]))
+                if kind is not None:
+                    try:
+                        values[cont][indexes[row]] = codec.decode(package[begin:end])
+                        present[cont][indexes[row]] = True
+                    except (ValueError, InvalidValueType) as error:
+                        errors.append((indexes[row], cont, str(error)))
+                base[row] = end
+
+    return BatchResult(mti, values, present, errors)
+
+################################################################################################
+
+
+################################################################################################
+# Parse many packages into columns
+def parseMany(packages, spec=None, fields=None, chunkSize=4096, hdrlen=0, mtiFormat='A', bitmapFormat='A'):
+    """Parse a stream of ISO8583 packages into columns, yielded in chunks of at most chunkSize packages.
+    Each chunk is a dict with one list per column, all of the same size and in the order of the packages:
+        'mti' -> MTI str of each package
+        'bitmap' -> bitmap of each package, as a 128 bits int (bit N is 1 << (128 - N))
+        bit number -> value (str) of the bit in each package, None if the package doesn't have it
+    Only the bits asked are decoded (see Iso8583.parse) and no Iso8583 object is created per package,
+    so the memory used depends on chunkSize and not on the number of packages.
+    Example:
+        from iso8583 import parseMany
+
+        for chunk in parseMany(open_packages(), fields=(3, 4, 41)):
+            for mti, amount in zip(chunk['mti'], chunk[4]):
+                (...)
+    @param: packages -> iterable of complete ISO8583 str, the same that setIsoContent receives
+    @param: spec -> Spec with the definition of the bits, default Iso8583.DEFAULT_SPEC
+    @param: fields -> bit numbers to decode, default all the bits
+    @param: chunkSize -> maximum number of packages per chunk
+    @param: hdrlen -> size of the header before the MTI
+    @param: mtiFormat -> MTI format ('A'SCII, 'B'CD or 'E'BCDIC), see Iso8583.setMTIformat
+    @param: bitmapFormat -> BITMAP format ('A'SCII, 'P'acked or 'E'BCDIC), see Iso8583.setBITMAPformat
+    @return: generator of dict
+    @raise: InvalidIso8583 Exception, BitNonexistent Exception, InvalidFormat Exception
+    """
+    if chunkSize < 1:
+        raise ValueError('chunkSize must be 1 or more')
+
+    parser = Iso8583(hdrlen=hdrlen, spec=spec)
+    parser.setMTIformat(mtiFormat)
+    parser.setBITMAPformat(bitmapFormat)
+
+    if fields is None:
+        fields = range(2, 129)
+    fields = sorted(set(fields))
+    parse = parser.parse
+
+    count = 0
+    for package in packages:
+        if count == 0:
+            chunk = {'mti': [], 'bitmap': []}
+            columns = []
+            for bit in fields:
+                chunk[bit] = []
+                columns.append((bit, chunk[bit].append))
+            mtis = chunk['mti'].append
+            bitmaps = chunk['bitmap'].append
+
+        values = parse(package, fields)
+        mtis(values[0])
+        bitmaps(values[1])
+        get = values.get
+        for bit, append in columns:
+            append(get(bit))
+
+        count += 1
+        if count == chunkSize:
+            yield chunk
+            count = 0
+
+    if count:
+        yield chunk
+
+################################################################################################
@@ -0,0 +1,446 @@
+""" Per-field codecs compiled from the ISO8583 bit definitions.
+Every _BITS_VALUE_TYPE entry is interpreted once here, so the hot paths of the
+Iso8583 class (setBit, getBit and the parser) only dispatch through a table.
+"""
+import binascii
+import re
+import ebcdic
+from iso8583.iso_errors import *
+
+# Number of digits of the length indicator of each variable bit type
+_LEN_DIGITS = {'LL': 2, 'LLL': 3, 'LLLLLL': 6}
+
+# Largest value each variable bit type can carry, whatever the bit limit
+_LEN_CAP = {'LL': 99, 'LLL': 999, 'LLLLLL': 999999}
+
+# Whitespace characters accepted by 'a' and 'an' values (the ASCII ones that str.isspace accepts)
+_SPACES = '\t\n\x0b\x0c\r\x1c-\x1f '
+
+# Values of each value type, when they are ASCII ('ans' and 'b' accept anything)
+_VALUE_TYPE_PATTERNS = {
+    'a': re.compile('[A-Za-z%s]*' % _SPACES),
+    'n': re.compile('[0-9]+'),
+    'an': re.compile('[A-Za-z0-9%s]*' % _SPACES),
+}
+
+# Whole message EBCDIC (see Spec): every byte of cp1148 is translated to the latin-1 byte of the same character,
+# except the euro sign (the only cp1148 character out of latin-1) that takes the place of the currency sign (not in cp1148),
+# and NL (0x15) that takes the place of NEL (not in cp1148), because LF (0x25) is the byte of '\n' in both directions
+EBCDIC_TO_ASCII = bytes(
+    0x85 if b == 0x15 else
+    0xa4 if bytes([b]).decode('cp1148') == '\u20ac' else
+    bytes([b]).decode('cp1148').encode('latin-1')[0]
+    for b in range(256))
+ASCII_TO_EBCDIC = bytes(
+    0x15 if b == 0x85 else
+    '\u20ac'.encode('cp1148')[0] if b == 0xa4 else
+    chr(b).encode('cp1148')[0]
+    for b in range(256))
+
+# The euro and currency signs swap places in the translated values
+_EURO_SWAP = str.maketrans('\u20ac\xa4', '\xa4\u20ac')
+# And NEL is decoded as '\n', like cp1148 decodes NL
+_EBCDIC_DECODE = str.maketrans('\u20ac\xa4\x85', '\xa4\u20ac\n')
+
+# Check of each character of a value type, when the value is not ASCII
+_VALUE_TYPE_CHARS = {
+    'a': lambda x: x.isspace() or x.isalpha(),
+    'an': lambda x: x.isspace() or x.isalnum(),
+}
+
+
+################################################################################################
+# Lookup tables of the packed (BCD) bytes
+
+# Byte -> its two nibbles read as decimal digits, 0x42 -> 42 (nibbles over 9 count as 10 to 15, like the arithmetic does)
+_BCD_TO_INT = tuple(b // 16 * 10 + b % 16 for b in range(256))
+# 0 to 99 -> its BCD byte, 42 -> b'\x42'
+_INT_TO_BCD = tuple(bytes(((n // 10) << 4 | n % 10,)) for n in range(100))
+# Byte -> the byte itself, to build packed lengths without int.to_bytes
+_BYTE = tuple(bytes((b,)) for b in range(256))
+
+################################################################################################
+
+
+################################################################################################
+# Length indicator helpers
+
+#Parse a Int to BCD length with "digits" digits
+def _intToBCD(len_int, digits):
+    len_int = int(len_int)
+    if digits <= 2:
+        return _INT_TO_BCD[len_int]
+    if digits <= 4:
+        return _INT_TO_BCD[len_int // 100] + _INT_TO_BCD[len_int % 100]
+    return _INT_TO_BCD[len_int // 10000] + _INT_TO_BCD[len_int // 100 % 100] + _INT_TO_BCD[len_int % 100]
+
+#Parse a BCD length to Int
+def _BCDToInt(len_bcd, offset, size):
+    value = 0
+    for c in range(offset, offset + size):
+        value = value * 100 + _BCD_TO_INT[len_bcd[c]]
+    return value
+
+#Parse a LLLBCD length to Int (the first nibble is padding)
+def _LLLBCDToInt(len_bcd, offset):
+    return len_bcd[offset] % 16 * 100 + _BCD_TO_INT[len_bcd[offset + 1]]
+
+#Parse a Int to Pack length
+def _intToPack(len_int, size):
+    len_int = int(len_int)
+    if size == 1:
+        return _BYTE[len_int]
+    return len_int.to_bytes(size, 'big')
+
+#Parse a Pack length to Int
+def _packToInt(len_pack, offset, size):
+    if size == 1:
+        return len_pack[offset]
+    return int.from_bytes(len_pack[offset:offset + size], 'big')
+
+#Parse a LLLPack length to Int (the first nibble is padding)
+def _LLLPackToInt(len_pack, offset):
+    return len_pack[offset] % 16 * 256 + len_pack[offset + 1]
+
+#Get packed equivalent size
+def _getPackedLen(origlen):
+    return (origlen + 1) // 2
+
+#Get unpacked equivalent size
+def _getUnpackedLen(origlen):
+    return _getPackedLen(origlen) * 2
+
+################################################################################################
+
+
+class FieldCodec:
+    """Encoder, decoder and scanner of one bit, with length indicator, padding and charset already resolved.
+        encode(value) -> bytes of the bit as it goes inside the package (length indicator included)
+        decode(raw) -> str value of the bit, from the bytes built by encode
+        scan(iso, offset) -> offset where the bit that starts at offset ends inside the package
+            (variable bits accept checkSize=False to not check the length indicator against the size, see check)
+        validate(value) -> True if the str value has only characters of the value type of the bit
+        check(raw) -> None if the bytes built by encode are valid, or the reason why they are not
+        decodeData(data) -> str of a part of the value (without length indicator), used by the subfields
+        prefixLen -> size in bytes of the length indicator (0 for fixed length bits)
+        fixedLen -> size in bytes of the bit inside the package, or None if it's a variable bit
+    """
+    __slots__ = ('bit', 'bitType', 'limit', 'prefixLen', 'fixedLen', 'encode', 'decode', 'scan', 'validate', 'check',
+                 'decodeData')
+
+    def __init__(self, bit, bitType, limit, prefixLen, fixedLen, encode, decode, scan, validate, check, decodeData):
+        self.bit = bit
+        self.bitType = bitType
+        self.limit = limit
+        self.prefixLen = prefixLen
+        self.fixedLen = fixedLen
+        self.encode = encode
+        self.decode = decode
+        self.scan = scan
+        self.validate = validate
+        self.check = check
+        self.decodeData = decodeData
+
+
+################################################################################################
+# Compile the length indicator of a LL, LLL or LLLLLL bit
+def _compileLenForm(bitType, LenForm):
+    """Return (prefixLen, encodeLen, decodeLen) for the length indicator of a variable bit.
+    It's a internal function, so don't call!
+    """
+    digits = _LEN_DIGITS[bitType]
+
+    if LenForm == 'A' or LenForm == 'T':
+        def encodeLen(n):
+            return ('%d' % n).zfill(digits).encode()
+
+        def decodeLen(iso, offset):
+            return int(bytes(iso[offset:offset + digits]))
+
+        return digits, encodeLen, decodeLen
+
+    if LenForm == 'E':
+        def encodeLen(n):
+            return ('%d' % n).zfill(digits).encode('cp1148')
+
+        def decodeLen(iso, offset):
+            return int(bytes(iso[offset:offset + digits]).decode('cp1148'))
+
+        return digits, encodeLen, decodeLen
+
+    size = _getPackedLen(digits)
+
+    if LenForm == 'P':
+        def encodeLen(n):
+            return _intToPack(n, size)
+
+        if bitType == 'LLL':
+            def decodeLen(iso, offset):
+                return iso[offset] % 16 * 256 + iso[offset + 1]
+        elif size == 1:
+            def decodeLen(iso, offset):
+                return iso[offset]
+        else:
+            def decodeLen(iso, offset):
+                return _packToInt(iso, offset, size)
+
+        return size, encodeLen, decodeLen
+
+    # 'B'(CD)
+    if size == 1:
+        encodeLen = _INT_TO_BCD.__getitem__
+    else:
+        def encodeLen(n):
+            return _intToBCD(n, digits)
+
+    if bitType == 'LLL':
+        def decodeLen(iso, offset):
+            return iso[offset] % 16 * 100 + _BCD_TO_INT[iso[offset + 1]]
+    elif size == 1:
+        def decodeLen(iso, offset):
+            return _BCD_TO_INT[iso[offset]]
+    else:
+        def decodeLen(iso, offset):
+            return _BCDToInt(iso, offset, size)
+
+    return size, encodeLen, decodeLen
+
+################################################################################################
+
+
+################################################################################################
+# Compile the data (without length indicator) conversion of a bit
+def _compileData(format):
+    """Return (encodeData, decodeData) that convert the value of a bit from/to the format 'A', 'E' or 'P'.
+    The packed decoder returns the hexadecimal str, the caller is responsible to strip the padding.
+    It's a internal function, so don't call!
+    """
+    if format == 'A':
+        return str.encode, bytes.decode
+
+    if format == 'T':
+        # Text of a whole message EBCDIC package, already translated by EBCDIC_TO_ASCII
+        # A value with the currency sign is refused like cp1148 does, because it becomes a euro sign
+        def encodeData(value):
+            return value.translate(_EURO_SWAP).encode('latin-1')
+
+        def decodeData(data):
+            value = bytes(data).decode('latin-1')
+            if '\xa4' in value or '\x85' in value:
+                return value.translate(_EBCDIC_DECODE)
+            return value
+
+        return encodeData, decodeData
+
+    if format == 'E':
+        def encodeData(value):
+            return value.encode('cp1148')
+
+        def decodeData(data):
+            return bytes(data).decode('cp1148')
+
+        return encodeData, decodeData
+
+    def encodeData(value):
+        # Needs to be even length, with padding on the right
+        if len(value) % 2 == 0:
+            return binascii.unhexlify(value)
+        return binascii.unhexlify(value + '0')
+
+    def decodeData(data):
+        return data.hex()
+
+    return encodeData, decodeData
+
+################################################################################################
+
+
+################################################################################################
+# Compile the validation of a value type
+def compileValidator(valueType):
+    """Return validate(value) -> True/False for a value type ('a', 'n', 'an', 'ans' or 'b').
+    ASCII values (all the values in practice) are checked with a single regex match, the others character by character.
+    @param: valueType -> same meaning of Iso8583.redefineBit parameter
+    @return: function
+    """
+    pattern = _VALUE_TYPE_PATTERNS.get(valueType)
+    if pattern is None:  # 'ans' and 'b'
+        def validate(value):
+            return True
+
+        return validate
+
+    fullmatch = pattern.fullmatch
+    if valueType == 'n':
+        def validate(value):
+            if value.isascii():
+                return fullmatch(value) is not None
+            return value.isdecimal()
+
+        return validate
+
+    isValidChar = _VALUE_TYPE_CHARS[valueType]
+
+    def validate(value):
+        if value.isascii():
+            return fullmatch(value) is not None
+        return all(isValidChar(x) for x in value)
+
+    return validate
+
+################################################################################################
+
+
+################################################################################################
+# Compile the check of the bytes of a bit
+def _compileCheck(valueType, decode, validate, decodeLen=None, maxLen=None):
+    """Return check(raw) -> None or the reason why the bytes of a bit are not valid.
+    It's a internal function, so don't call!
+    """
+    def check(raw):
+        try:
+            value = decode(raw)
+        except (UnicodeDecodeError, ValueError):
+            return 'value cannot be decoded'
+        if decodeLen is not None and decodeLen(raw, 0) > maxLen:
+            return 'value larger than the specification (%d > %d)' % (decodeLen(raw, 0), maxLen)
+        if not validate(value):
+            return "value '%s' is not of type %s" % (value, valueType)
+        return None
+
+    return check
+
+################################################################################################
+
+
+################################################################################################
+# Compile one bit
+def compileBit(bit, bitType, LenForm, size, valueType, format, ebcdic=False):
+    """Compile the definition of a bit into a FieldCodec.
+    @param: bit, bitType, LenForm, size, valueType, format -> same meaning of Iso8583.redefineBit parameters
+    @param: ebcdic -> True for a whole message EBCDIC Spec: the bit works over the package translated by EBCDIC_TO_ASCII,
+        where its text (ASCII or EBCDIC format and length indicator) gives the same bytes that cp1148 gives
+    @return: FieldCodec of the bit
+    @raise: InvalidFormat Exception
+    """
+    if ebcdic is True:
+        if format == 'P' or LenForm not in ('-', 'A', 'E'):
+            raise InvalidFormat("Error %d cannot be used in a whole message EBCDIC Spec because it's packed!" % bit)
+        format = 'T'
+        if LenForm != '-':
+            LenForm = 'T'
+
+    tooLarge = 'Error: value up to size! Bit[%s] of type %s limit size = %s' % (bit, bitType, size)
+    encodeData, decodeData = _compileData(format)
+    validate = compileValidator(valueType)
+
+    if bitType in _LEN_DIGITS:
+        prefixLen, encodeLen, decodeLen = _compileLenForm(bitType, LenForm)
+        maxLen = min(size, _LEN_CAP[bitType])
+        packed = format == 'P'
+
+        def encode(value):
+            value = "%s" % value
+            if len(value) > maxLen:
+                raise ValueTooLarge(tooLarge)
+            return encodeLen(len(value)) + encodeData(value)
+
+        if packed:
+            def decode(raw):
+                return decodeData(raw[prefixLen:])[0:decodeLen(raw, 0)]
+        else:
+            def decode(raw):
+                return decodeData(raw[prefixLen:])
+
+        def scan(iso, offset, checkSize=True):
+            valueSize = decodeLen(iso, offset)
+            if checkSize is True and valueSize > size:
+                if bitType == 'LL':
+                    raise InvalidIso8583("This is not a valid iso!! Bit %s is larger than the specification!" % bit)
+                raise ValueTooLarge("This bit is larger than the specification!")
+            if packed:
+                valueSize = _getPackedLen(valueSize)
+            return offset + prefixLen + valueSize
+
+        check = _compileCheck(valueType, decode, validate, decodeLen, maxLen)
+        return FieldCodec(bit, bitType, size, prefixLen, None, encode, decode, scan, validate, check, decodeData)
+
+    # Fixed length bits: N, A, AN, ANS and B
+    if format == 'P':
+        unpackedLen = _getUnpackedLen(size)
+        fixedLen = _getPackedLen(size)
+
+        def encode(value):
+            value = "%s" % value
+            if len(value) > size:
+                raise ValueTooLarge(tooLarge)
+            # make sure that it's left zero-filled to the correct length- a multiple of 2
+            return binascii.unhexlify(value.zfill(unpackedLen))
+
+        if size % 2 == 0:
+            decode = decodeData
+        else:
+            def decode(raw):
+                # Skip the leading padding '0'
+                return decodeData(raw)[1:]
+    else:
+        fixedLen = size
+
+        def encode(value):
+            value = "%s" % value
+            if len(value) > size:
+                raise ValueTooLarge(tooLarge)
+            return encodeData(value.zfill(size))
+
+        decode = decodeData
+
+    def scan(iso, offset):
+        return offset + fixedLen
+
+    check = _compileCheck(valueType, decode, validate)
+    return FieldCodec(bit, bitType, size, 0, fixedLen, encode, decode, scan, validate, check, decodeData)
+
+################################################################################################
+
+
+################################################################################################
+# Compile a bit that cannot be used
+def _compileUnusable(bit, bitType, size, error):
+    """Return a FieldCodec that raises error when the bit is set, read or parsed.
+    It's a internal function, so don't call!
+    """
+    def fail(*args):
+        raise error
+
+    def check(raw):
+        return str(error)
+
+    def validate(value):
+        return False
+
+    return FieldCodec(bit, bitType, size, 0, None, fail, fail, fail, validate, check, fail)
+
+################################################################################################
+
+
+################################################################################################
+# Compile a complete bit table
+def compileBits(bitsValueType, ebcdic=False):
+    """Compile a _BITS_VALUE_TYPE like table into a list of FieldCodec indexed by the bit number.
+    @param: bitsValueType -> dict with the definition of the bits 1 to 128
+    @param: ebcdic -> True for a whole message EBCDIC Spec, see compileBit. The packed bits of the table raise InvalidFormat
+        when they are used, instead of when the table is compiled
+    @return: list with 129 positions, position 0 is not used
+    @raise: InvalidFormat Exception
+    """
+    codecs = [None]
+    for bit in range(1, 129):
+        smallStr, largeStr, bitType, LenForm, size, valueType, format = bitsValueType[bit]
+        try:
+            codecs.append(compileBit(bit, bitType, LenForm, size, valueType, format, ebcdic))
+        except InvalidFormat as error:
+            if ebcdic is not True:
+                raise
+            # A packed bit of the table doesn't stop the whole message EBCDIC Spec, it only can't be used
+            codecs.append(_compileUnusable(bit, bitType, size, error))
+    return codecs
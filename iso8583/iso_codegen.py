@@ -0,0 +1,238 @@
+""" Code generation of specialized parse and build functions for a Spec.
+The codecs of a Spec still dispatch per bit at runtime. Here the whole Spec is turned into the Python
+source of two straight-line functions, one "if" per bit with its size, length indicator and format
+written as constants, so nothing is looked up while a package is parsed or built.
+The dialects are fixed at deploy time, so the compiled code is kept on disk, keyed by the hash of the
+generated source and of the Python version, and the next start only loads it.
+The files of the disk cache are executed: the cache directory must be trusted, writable only by the service.
+"""
+import os
+import sys
+import hashlib
+import marshal
+from iso8583.iso_errors import *
+from iso8583.iso_codecs import _BCD_TO_INT, _LEN_DIGITS, _LEN_CAP
+
+# Changes every time the generated code changes, so old files in the disk cache are not used
+_GENERATOR_VERSION = 2
+
+# Compiled code already loaded, by key
+_COMPILED = {}
+
+
+################################################################################################
+# Key of a Spec
+def getSpecKey(spec):
+    """Return the key of a Spec, the same for every Spec with the same bits and EBCDIC mode, in every process
+    @param: spec -> Spec
+    @return: str with 32 hexadecimal digits
+    """
+    definitions = spec.getDefinitions()
+    text = repr((_GENERATOR_VERSION, spec.ebcdic, [definitions[bit] for bit in range(1, 129)]))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+
+################################################################################################
+
+
+################################################################################################
+# Source of one bit in parseBits
+def _parseBitSource(bit, codec, definition):
+    """Return the lines of parseBits that read one bit, the bit is in the package
+    It's a internal function, so don't call!
+    """
+    smallStr, largeStr, bitType, LenForm, size, valueType, format = definition
+    lines = []
+    if codec.fixedLen is not None:
+        lines.append('end = offset + %d' % codec.fixedLen)
+        if format == 'A':
+            lines.append('values[%d] = iso[offset:end].decode()' % bit)
+        elif format == 'P' and size % 2 == 0:
+            lines.append('values[%d] = iso[offset:end].hex()' % bit)
+        elif format == 'P':
+            lines.append('values[%d] = iso[offset:end].hex()[1:]' % bit)
+        else:
+            lines.append('values[%d] = _decode%d(iso[offset:end])' % (bit, bit))
+        lines.append('offset = end')
+        return lines
+
+    prefixLen = codec.prefixLen
+    if LenForm == 'A':
+        readLen = 'int(iso[offset:offset + %d])' % prefixLen
+    elif LenForm == 'B' and bitType == 'LLL':
+        readLen = 'iso[offset] % 16 * 100 + _BCD_TO_INT[iso[offset + 1]]'
+    elif LenForm == 'B' and prefixLen == 1:
+        readLen = '_BCD_TO_INT[iso[offset]]'
+    elif LenForm == 'P' and bitType == 'LLL':
+        readLen = 'iso[offset] % 16 * 256 + iso[offset + 1]'
+    elif LenForm == 'P' and prefixLen == 1:
+        readLen = 'iso[offset]'
+    else:  # Other length indicators are read by the codec
+        readLen = None
+
+    if readLen is None or (format != 'A' and format != 'P'):
+        lines.append('end = _scan%d(iso, offset)' % bit)
+        lines.append('values[%d] = _decode%d(iso[offset:end])' % (bit, bit))
+        lines.append('offset = end')
+        return lines
+
+    lines.append('size = %s' % readLen)
+    lines.append('if size > %d:' % size)
+    if bitType == 'LL':
+        lines.append("    raise InvalidIso8583('This is not a valid iso!! Bit %d is larger than the specification!')" % bit)
+    else:
+        lines.append("    raise ValueTooLarge('This bit is larger than the specification!')")
+    if format == 'A':
+        lines.append('end = offset + %d + size' % prefixLen)
+        lines.append('values[%d] = iso[offset + %d:end].decode()' % (bit, prefixLen))
+    else:
+        lines.append('end = offset + %d + (size + 1) // 2' % prefixLen)
+        lines.append('values[%d] = iso[offset + %d:end].hex()[0:size]' % (bit, prefixLen))
+    lines.append('offset = end')
+    return lines
+
+################################################################################################
+
+
+################################################################################################
+# Source of one bit in buildBits
+def _buildBitSource(bit, codec, definition):
+    """Return the lines of buildBits that write one bit, the bit is in the values
+    It's a internal function, so don't call!
+    """
+    smallStr, largeStr, bitType, LenForm, size, valueType, format = definition
+    if format != 'A' or LenForm not in ('-', 'A'):  # Written by the codec
+        return ['parts.append(_encode%d(values[%d]))' % (bit, bit)]
+
+    lines = ["value = '%%s' %% values[%d]" % bit]
+    if codec.fixedLen is not None:
+        lines.append('if len(value) > %d:' % size)
+        lines.append('    raise ValueTooLarge(%r)' % ('Error: value up to size! Bit[%s] of type %s limit size = %s' % (bit, bitType, size)))
+        lines.append('parts.append(value.zfill(%d).encode())' % size)
+        return lines
+
+    lines.append('size = len(value)')
+    lines.append('if size > %d:' % min(size, _LEN_CAP[bitType]))
+    lines.append('    raise ValueTooLarge(%r)' % ('Error: value up to size! Bit[%s] of type %s limit size = %s' % (bit, bitType, size)))
+    lines.append("parts.append(b'%%0%dd' %% size + value.encode())" % _LEN_DIGITS[bitType])
+    return lines
+
+################################################################################################
+
+
+################################################################################################
+# Source of a Spec
+def generateSource(spec):
+    """Return the Python source of the parse and build functions of a Spec.
+    The source has two functions:
+        parseBits(iso, offset, bitmap, values) -> decode all the bits present in bitmap (bit 1 excluded),
+            from offset of the bytes iso, into values (dict bit -> str), and return the offset after the last bit
+        buildBits(values, bitmap) -> encode the bits present in bitmap (bit 1 excluded) from values (dict bit -> value)
+            and return the list of their bytes, in order
+    The bits with a text format ('A') and an ASCII, BCD or packed length indicator are written inline, the others call
+    their codec (bound once when the source is executed, from the _codecs given).
+    @param: spec -> Spec
+    @return: str
+    """
+    codecs = spec.codecs
+    head = ['# Generated by iso8583.iso_codegen from the Spec %s, do not edit' % getSpecKey(spec)]
+    parse = ['def parseBits(iso, offset, bitmap, values):']
+    build = ['def buildBits(values, bitmap):', '    parts = []']
+    # The bits are tested by groups of 8, as small ints, and the groups without bits are skipped at once
+    for first in range(1, 129, 8):
+        shift = 120 - (first - 1)
+        for lines in (parse, build):
+            lines.append('    group = bitmap >> %d & 0xff' % shift if shift else '    group = bitmap & 0xff')
+            lines.append('    if group:')
+        for bit in range(max(first, 2), first + 8):
+            codec = codecs[bit]
+            definition = spec.getDefinition(bit)
+            format = definition[6]
+            if spec.ebcdic is True:  # The bits of a whole message EBCDIC package are translated text
+                format = 'T'
+                definition = definition[:6] + (format,)
+            head.append('_scan%d = _codecs[%d].scan' % (bit, bit))
+            head.append('_decode%d = _codecs[%d].decode' % (bit, bit))
+            head.append('_encode%d = _codecs[%d].encode' % (bit, bit))
+
+            condition = '        if group & 0x%02x:  # Bit %d %s %s %s' % (1 << (first + 7 - bit), bit, definition[2], definition[4], format)
+            parse.append(condition)
+            parse.extend('            ' + line for line in _parseBitSource(bit, codec, definition))
+            build.append(condition)
+            build.extend('            ' + line for line in _buildBitSource(bit, codec, definition))
+
+    parse.append('    return offset')
+    build.append('    return parts')
+    return '\n'.join(head + [''] + parse + [''] + build) + '\n'
+
+################################################################################################
+
+
+class CompiledSpec:
+    """The parse and build functions generated for a Spec (see generateSource).
+    Get it with Spec.generateCode, that returns a Spec with it, so Iso8583.parse and Iso8583.build use it.
+    key is the key of the Spec (see getSpecKey), digest the hash of the source and of the Python version, that names the
+    file of the disk cache.
+    """
+    __slots__ = ('key', 'digest', 'parseBits', 'buildBits')
+
+    def __init__(self, key, digest, namespace):
+        self.key = key
+        self.digest = digest
+        self.parseBits = namespace['parseBits']
+        self.buildBits = namespace['buildBits']
+
+
+################################################################################################
+# Compile a Spec
+def compileSpec(spec, cacheDir=None):
+    """Return the CompiledSpec of a Spec, generating and compiling its source only once.
+    The code is kept in memory by key and, with a cacheDir, in a file of that directory named by the hash of the
+    source and of the Python version, so other processes and the next start just load it instead of compiling it.
+    The file keeps that hash too, and a file with another one is compiled again. A cacheDir that can't be written
+    is not an error, the code is then only kept in memory.
+    @param: spec -> Spec
+    @param: cacheDir -> directory of the disk cache, or None to keep the code only in memory. Its files are executed,
+        so it must be trusted, writable only by the service
+    @return: CompiledSpec
+    """
+    key = getSpecKey(spec)
+    compiled = _COMPILED.get(key)
+    if compiled is not None:
+        return compiled
+
+    source = generateSource(spec)
+    digest = hashlib.sha256(('%s\n%s' % (sys.version, source)).encode('utf-8')).hexdigest()[:32]
+    code = None
+    path = None
+    if cacheDir is not None:
+        path = os.path.join(cacheDir, 'iso8583_spec_%s.%s.bin' % (digest, sys.implementation.cache_tag))
+        try:
+            with open(path, 'rb') as cached:
+                cachedDigest, code = marshal.load(cached)
+            if cachedDigest != digest:
+                code = None
+        except (OSError, EOFError, ValueError, TypeError):  # Not cached yet, or written by another Python
+            code = None
+
+    if code is None:
+        code = compile(source, '<iso8583 spec %s>' % key, 'exec')
+        if path is not None:
+            # Written aside and renamed, so other processes never read half a file
+            temporary = '%s.%d.tmp' % (path, os.getpid())
+            try:
+                os.makedirs(cacheDir, exist_ok=True)
+                with open(temporary, 'wb') as cached:
+                    marshal.dump((digest, code), cached)
+                os.replace(temporary, path)
+            except OSError:  # Read-only or full directory, the code is only kept in memory
+                try:
+                    os.remove(temporary)
+                except OSError:
+                    pass
+
+    namespace = {'_codecs': spec.codecs, '_BCD_TO_INT': _BCD_TO_INT, 'ValueTooLarge': ValueTooLarge,
+                 'InvalidIso8583': InvalidIso8583}
+    exec(code, namespace)
+    compiled = CompiledSpec(key, digest, namespace)
+    _COMPILED[key] = compiled
+    return compiled
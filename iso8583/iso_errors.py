@@ -89,3 +89,23 @@ class BitNotSet(Exception):
 		self.str = value
 	def __str__(self):
 		return repr(self.str)			
+
+#Exception that indicate that the subfields of a bit are invalid.
+class InvalidSubfield(Exception):
+	"""Exception that indicate that the subfields (TLV or fixed position) of a bit cannot be decoded,
+		or that the subfields definition of the bit is invalid.
+	"""
+	def __init__(self, value):
+		self.str = value
+	def __str__(self):
+		return repr(self.str)
+
+#Exception that indicate that a dialect file is invalid.
+class InvalidDialect(Exception):
+	"""Exception that indicate that a dialect (JSON spec) file cannot be read or has an invalid structure.
+		The bit definitions inside it raise the same Exceptions of redefineBit.
+	"""
+	def __init__(self, value):
+		self.str = value
+	def __str__(self):
+		return repr(self.str)
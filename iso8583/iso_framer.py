@@ -0,0 +1,191 @@
+""" Incremental framer of ISO8583 packages received over a stream (TCP).
+The bytes are fed as they arrive, in chunks of any size, and the framer returns every complete
+frame found: a chunk can end in the middle of a frame or carry several of them.
+Links without length prefix are supported too (lenType None), then every chunk is one frame.
+"""
+import struct
+from iso8583.iso_errors import *
+
+# Length prefixes: 2 bytes unsigned binary (big or little-endian) or 4 ASCII decimal digits, or None without prefix
+_PREFIX_SIZE = {'BE': 2, 'LE': 2, 'A4': 4, None: 0}
+_PREFIX_MAX = {'BE': 0xFFFF, 'LE': 0xFFFF, 'A4': 9999}
+
+
+class Iso8583Framer:
+    """Split a stream of length-prefixed ISO8583 packages into frames.
+    Example:
+        framer = Iso8583Framer('BE', hdrlen=5)
+        while True:
+            data = conn.recv(4096)
+            (...)
+            for frame in framer.feed(data):
+                iso = Iso8583(frame, hdrlen=5)
+                (...)
+                conn.sendall(framer.pack(response.getRawIso()))
+
+    The received bytes are kept in a single preallocated bytearray, consumed frames are dropped from its
+    beginning only when room is needed, so chunks are never concatenated.
+    The bytes can also be received straight into it, without the bytes object of recv:
+        while True:
+            with framer.getWriteBuffer() as view:
+                size = conn.recv_into(view)
+            (...)
+            for frame in framer.commit(size):
+                (...)
+    The frames are returned without the length prefix, with the header (if any) in the beginning.
+    They are memoryviews over the buffer, not copies: they are valid until the framer is called again
+    (getWriteBuffer, feed or reset), so a frame kept longer (given to another thread, for example) must be
+    copied with bytes(frame).
+    Without length prefix (lenType None) nothing tells where a package ends, so every chunk received is
+    returned as one frame, and pack returns the frame as it is.
+    """
+
+    def __init__(self, lenType='BE', hdrlen=0, hdrInLength=True, bufferSize=4096):
+        """Create a framer with an empty buffer.
+        @param: lenType -> length prefix, 'BE' or 'LE' (2 bytes unsigned, big or little-endian), 'A4' (4 ASCII decimal digits)
+            or None (no length prefix, every chunk is a frame)
+        @param: hdrlen -> size of the header (TPDU for example) between the length prefix and the MTI
+        @param: hdrInLength (True or False) default True -> if the length prefix counts the header too
+        @param: bufferSize -> initial size of the buffer, and the room getWriteBuffer gives by default
+        @raise: InvalidFormat Exception
+        """
+        if lenType not in _PREFIX_SIZE:
+            raise InvalidFormat('Error: Invalid length prefix %s (BE, LE, A4 or None)!' % lenType)
+        self.lenType = lenType
+        self.hdrlen = hdrlen
+        self.hdrInLength = hdrInLength
+        self.prefixSize = _PREFIX_SIZE[lenType]
+        self.bufferSize = bufferSize
+        # Bytes received are between start and end, the rest of the buffer is free room
+        self.__buffer = bytearray(bufferSize)
+        self.__start = 0
+        self.__end = 0
+        # Frames returned by the last commit, released when the framer is called again
+        self.__frames = []
+
+    def __releaseFrames(self):
+        """Release the frames returned by the last commit, so their bytes can be overwritten
+        It's a internal method, so don't call!
+        """
+        for frame in self.__frames:
+            frame.release()
+        self.__frames = []
+
+    def __getLength(self, offset):
+        """Return the length written in the prefix that starts at offset
+        It's a internal method, so don't call!
+        @raise: InvalidIso8583 Exception
+        """
+        buffer = self.__buffer
+        if self.lenType == 'BE':
+            return buffer[offset] << 8 | buffer[offset + 1]
+        if self.lenType == 'LE':
+            return buffer[offset + 1] << 8 | buffer[offset]
+        digits = bytes(buffer[offset:offset + 4])
+        if not digits.isdigit():
+            raise InvalidIso8583('This is not a valid iso!! Invalid length prefix %s' % digits)
+        return int(digits)
+
+    def getWriteBuffer(self, size=None):
+        """Return the free room of the buffer, where the next bytes received are written (by socket.recv_into for example).
+        The pending bytes are moved to the beginning, or the buffer grows, only when there is less room than asked.
+        The view must be released (use it in a "with") before the framer is called again, and commit tells how much was written.
+        The frames returned by the last commit are not valid any more.
+        @param: size -> minimum room needed, default bufferSize
+        @return: memoryview
+        """
+        self.__releaseFrames()
+        if size is None:
+            size = self.bufferSize
+        buffer = self.__buffer
+        if len(buffer) - self.__end < size:
+            # Drop the consumed bytes, then grow if it's still not enough
+            pending = self.__end - self.__start
+            if self.__start:
+                buffer[:pending] = buffer[self.__start:self.__end]
+                self.__start = 0
+                self.__end = pending
+            if len(buffer) - pending < size:
+                try:
+                    buffer.extend(bytes(size - (len(buffer) - pending)))
+                except BufferError:  # A view of an old frame is still used, it keeps the old buffer
+                    grown = bytearray(pending + size)
+                    grown[:pending] = buffer[:pending]
+                    self.__buffer = buffer = grown
+        return memoryview(buffer)[self.__end:]
+
+    def commit(self, size):
+        """Tell that bytes were written in the view returned by getWriteBuffer and return the frames completed by them.
+        @param: size -> number of bytes written (can be 0)
+        @return: list with the complete frames (memoryview, valid until the framer is called again), in the order they were received
+        @raise: InvalidIso8583 Exception (invalid length prefix, the stream can't be resynchronized)
+        """
+        self.__releaseFrames()
+        self.__end += size
+
+        frames = []
+        start = self.__start
+        end = self.__end
+        extra = 0 if self.hdrInLength else self.hdrlen
+        # The view must be released before the buffer is resized, the frames are released by the next call
+        with memoryview(self.__buffer) as view:
+            if self.lenType is None:  # No length prefix, the chunk is the frame
+                if end > start:
+                    frames.append(view[start:end])
+                start = end
+            while self.lenType is not None and end - start >= self.prefixSize:
+                length = self.__getLength(start) + extra
+                begin = start + self.prefixSize
+                if end - begin < length:  # Partial frame, wait for more bytes
+                    break
+                frames.append(view[begin:begin + length])
+                start = begin + length
+        self.__frames = list(frames)
+
+        if start == end:  # Nothing pending, the next bytes go to the beginning
+            start = end = 0
+        self.__start = start
+        self.__end = end
+
+        return frames
+
+    def feed(self, data):
+        """Add received bytes and return the frames completed by them.
+        @param: data -> bytes received, of any size (can be empty)
+        @return: list with the complete frames (memoryview, valid until the framer is called again), in the order they were received
+        @raise: InvalidIso8583 Exception (invalid length prefix, the stream can't be resynchronized)
+        """
+        size = len(data)
+        with self.getWriteBuffer(size) as view:
+            view[:size] = data
+        return self.commit(size)
+
+    def pack(self, frame):
+        """Return a frame with the length prefix in the beginning, ready to be sent
+        @param: frame -> bytes with the header (if any) and the package
+        @return: bytes
+        @raise: ValueTooLarge Exception
+        """
+        if self.lenType is None:
+            return frame
+        size = len(frame) if self.hdrInLength else len(frame) - self.hdrlen
+        if size > _PREFIX_MAX[self.lenType]:
+            raise ValueTooLarge('Error: frame up to size! Limit size of a %s length prefix = %s' % (self.lenType, _PREFIX_MAX[self.lenType]))
+        if self.lenType == 'BE':
+            return struct.pack('!H', size) + frame
+        if self.lenType == 'LE':
+            return struct.pack('<H', size) + frame
+        return b'%04d' % size + frame
+
+    def getPending(self):
+        """Return the number of bytes received that are not part of a complete frame yet
+        @return: int
+        """
+        return self.__end - self.__start
+
+    def reset(self):
+        """Drop all the bytes received, to reuse the framer with another stream.
+        """
+        self.__releaseFrames()
+        self.__start = 0
+        self.__end = 0
@@ -0,0 +1,94 @@
+""" Layouts of the bits of a package, cached by bitmap.
+POS traffic repeats the same bitmaps over and over, so the ordered list of bits and the
+offsets of the fixed length bits are computed once per bitmap and reused by the parser.
+"""
+from collections import OrderedDict, namedtuple
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+
+################################################################################################
+# Compile the layout of a bitmap
+def compileLayout(bitmap, codecs):
+    """Compile the layout of the bits present in a bitmap.
+    The layout is a tuple with one (bit, offset, fixedLen, scan) entry per present bit (bit 1 excluded), in order:
+        offset -> where the bit starts, relative to the end of the last variable bit before it (or to the first bit)
+        fixedLen -> size in bytes of a fixed length bit, None for a variable bit
+        scan -> FieldCodec.scan of a variable bit, None for a fixed length bit
+    So only the length indicators of the variable bits need to be read to parse a package.
+    @param: bitmap -> 128 bits int, bit N is (1 << (128 - N))
+    @param: codecs -> list of FieldCodec indexed by bit number
+    @return: tuple with the layout
+    """
+    layout = []
+    offset = 0
+    # Bit 1 only indicates the second bitmap
+    bitmap &= ~(1 << 127)
+    while bitmap:
+        length = bitmap.bit_length()
+        bitmap ^= 1 << (length - 1)
+        codec = codecs[129 - length]
+        if codec.fixedLen is None:
+            layout.append((codec.bit, offset, None, codec.scan))
+            offset = 0
+        else:
+            layout.append((codec.bit, offset, codec.fixedLen, None))
+            offset += codec.fixedLen
+    return tuple(layout)
+
+################################################################################################
+
+
+class LayoutCache:
+    """LRU cache of layouts (see compileLayout) keyed by bitmap.
+    The cache belongs to one table of codecs and must be cleared when the table changes.
+    Hits and misses are counted so its effectiveness can be checked with cacheInfo().
+    """
+
+    def __init__(self, maxsize=256):
+        """Create an empty cache.
+        @param: maxsize -> maximum number of bitmaps kept, the least recently used is dropped first
+        """
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__layouts = OrderedDict()
+
+    def getLayout(self, bitmap, codecs):
+        """Return the layout of a bitmap, compiling and keeping it if it's not in the cache.
+        @param: bitmap -> 128 bits int, bit N is (1 << (128 - N))
+        @param: codecs -> list of FieldCodec indexed by bit number
+        @return: tuple with the layout
+        """
+        layouts = self.__layouts
+        layout = layouts.get(bitmap)
+        if layout is not None:
+            self.hits += 1
+            try:
+                layouts.move_to_end(bitmap)
+            except KeyError:  # Dropped meanwhile by another thread
+                pass
+            return layout
+
+        self.misses += 1
+        layout = compileLayout(bitmap, codecs)
+        layouts[bitmap] = layout
+        while len(layouts) > self.maxsize:
+            try:
+                layouts.popitem(last=False)
+            except KeyError:  # Emptied meanwhile by another thread
+                break
+        return layout
+
+    def clear(self):
+        """Drop all the layouts and reset the counters.
+        """
+        self.__layouts.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def cacheInfo(self):
+        """Return the statistics of the cache.
+        @return: CacheInfo(hits, misses, maxsize, currsize)
+        """
+        return CacheInfo(self.hits, self.misses, self.maxsize, len(self.__layouts))
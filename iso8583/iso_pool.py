@@ -0,0 +1,70 @@
+""" Pool of reusable Iso8583 objects.
+Servers create and drop a request and a response object for every transaction, the pool
+keeps them pre-allocated and recycles them with Iso8583.reset() to avoid that churn.
+"""
+from iso8583.iso8583 import Iso8583
+
+
+class Iso8583Pool:
+    """Pool of pre-allocated Iso8583 objects.
+    Example:
+        pool = Iso8583Pool(size=32, hdrlen=5)
+
+        iso = pool.acquire()
+        iso.setIsoContent(data)
+        (...)
+        pool.release(iso)
+
+    acquire and release can be called from several threads.
+    """
+
+    def __init__(self, size=64, **kwargs):
+        """Create the pool and pre-allocate its objects.
+        @param: size -> number of objects kept by the pool
+        @param: kwargs -> parameters given to the Iso8583 constructor (spec, hdrlen, lazy, ...)
+        """
+        self.size = size
+        self.__kwargs = kwargs
+        # Object never handed out, with the Spec, formats, header length and flags the objects get back on release
+        self.__template = Iso8583(**kwargs)
+        self.__free = [Iso8583(**kwargs) for _ in range(size)]
+
+    def acquire(self):
+        """Return a "brand new" Iso8583 object, from the pool if it has one free.
+        @return: Iso8583
+        """
+        try:
+            return self.__free.pop()
+        except IndexError:  # Pool is empty, so create a new one
+            return Iso8583(**self.__kwargs)
+
+    def release(self, iso):
+        """Reset an object and give it back to the pool. It must not be used after released!
+        The Spec, MTI/BITMAP formats, header length and flags (DEBUG, LAZY, STRICT, BITMAP_UPPERCASE) changed while
+        it was used (redefineBit, setSpec, ...) are set back to the ones of the pool. Objects beyond the size of the pool are dropped.
+        @param: iso -> Iso8583 object returned by acquire
+        """
+        if iso is None:
+            return
+        iso.reset()
+        template = self.__template
+        if iso.getSpec() is not template.getSpec():
+            iso.setSpec(template.getSpec())
+        if iso.MTI_format != template.MTI_format:
+            iso.setMTIformat(template.MTI_format)
+        if iso.BITMAP_format != template.BITMAP_format:
+            iso.setBITMAPformat(template.BITMAP_format)
+        if iso.getHdrlen() != template.getHdrlen():
+            iso.setHdrlen(template.getHdrlen())
+        iso.DEBUG = template.DEBUG
+        iso.LAZY = template.LAZY
+        iso.STRICT = template.STRICT
+        iso.BITMAP_UPPERCASE = template.BITMAP_UPPERCASE
+        if len(self.__free) < self.size:
+            self.__free.append(iso)
+
+    def getFree(self):
+        """Return the number of objects waiting in the pool
+        @return: int
+        """
+        return len(self.__free)
@@ -0,0 +1,311 @@
+""" Immutable specification (dialect) of the 128 bits of a ISO8583 package.
+A Spec is given to each Iso8583 object, so objects of different dialects can live in the
+same process. It's never changed after created: redefining bits returns a new Spec, and
+the compiled codecs and the layout cache attached to it can be shared by all threads.
+"""
+import os
+import json
+import marshal
+from iso8583.iso_errors import *
+from iso8583.iso_codecs import compileBit, compileBits
+from iso8583.iso_layout import LayoutCache
+from iso8583.iso_subfields import validateSubfields
+from iso8583.iso_codegen import compileSpec, getSpecKey
+
+# Names of the fields of a bit definition, in order, as they are written in a dialect file
+_DIALECT_FIELDS = ('smallStr', 'largeStr', 'bitType', 'LenForm', 'size', 'valueType', 'format')
+
+# Changes every time the snapshot content changes, so old snapshots are not used
+_SNAPSHOT_VERSION = 1
+
+
+################################################################################################
+# Validate a bit definition
+def validateBit(bit, smallStr, largeStr, bitType, LenForm, size, valueType, format):
+    """Check that a bit definition is valid, see Iso8583.redefineBit for the meaning of the parameters.
+    @raise: BitNonexistent Exception, InvalidBitType Exception, InvalidLenForm Exception, InvalidValueType Exception, InvalidFormat Exception
+    """
+    # validating bit position
+    if bit == 1 or bit < 0 or bit > 128:
+        raise BitNonexistent(
+            "Error %d cannot be changed because has a invalid number!" % bit)
+
+    if bitType not in ("B", "N", "A", "AN", "ANS", "LL", "LLL", "LLLLLL"):
+        raise InvalidBitType(
+            "Error bit %d cannot be changed because %s is not a valid bitType (B, N, A, AN, ANS, LL, LLL)!" % (
+                bit, bitType))
+
+    if LenForm != '-' and bitType not in ("LL", "LLL", "LLLLLL"):
+        raise InvalidLenForm("Error %d cannot be changed because has an invalid LenForm!" % bit)
+
+    if LenForm not in ('-', 'A', 'E', 'B', 'P'):
+        raise InvalidLenForm("Error %d cannot be changed because has an invalid %s LenForm!" % (bit, LenForm))
+
+    # need to validate if the type and size is compatible! example slimit = 100 and type = LL
+
+    if valueType not in ("a", "n", "ans", "b", "an"):
+        raise InvalidValueType(
+            "Error bit %d cannot be changed because %s is not a valid valueType (a, an, n ans, b)!" % (
+                bit, valueType))
+
+    if format not in ('A', 'E', 'P'):
+        raise InvalidFormat("Error %d cannot be changed because has an invalid %s format!" % (bit, format))
+
+    if format == 'P' and bitType not in ('B', 'N', 'LL', 'LLL', 'LLLLLL'):
+        raise InvalidFormat("Error %d cannot be changed because has an invalid %s format (cannot be packed)!" % (bit, format))
+
+################################################################################################
+
+
+################################################################################################
+# Read a dialect file
+def _readDialect(path, base):
+    """Read and validate a dialect file, over the bits of the base Spec
+    It's a internal function, so don't call!
+    @return: (bits, ebcdic, subfields) -> tuple with the definitions of the bits 0 to 128, bool and dict bit -> subfields
+    @raise: InvalidDialect Exception, and the Exceptions of validateBit and validateSubfields
+    """
+    try:
+        with open(path, encoding='utf-8') as source:
+            dialect = json.load(source)
+    except (OSError, ValueError) as error:
+        raise InvalidDialect('Error dialect %s cannot be read: %s' % (path, error))
+
+    if not isinstance(dialect, dict) or not isinstance(dialect.get('bits', []), list):
+        raise InvalidDialect('Error dialect %s must be an object with a "bits" list!' % path)
+
+    bits = [None] + [base.getDefinition(bit) for bit in range(1, 129)]
+    for entry in dialect.get('bits', []):
+        try:
+            bit = entry['bit']
+            definition = tuple(entry[field] for field in _DIALECT_FIELDS)
+        except (TypeError, KeyError):
+            raise InvalidDialect('Error dialect %s has a bit without %s!' % (path, ', '.join(('bit',) + _DIALECT_FIELDS)))
+        if not isinstance(bit, int) or not isinstance(definition[4], int):
+            raise InvalidDialect('Error dialect %s has a bit with an invalid number or size!' % path)
+        validateBit(bit, *definition)
+        bits[bit] = definition
+
+    subfields = {bit: base.getSubfields(bit) for bit in range(2, 129) if base.getSubfields(bit) is not None}
+    for bit, definition in (dialect.get('subfields') or {}).items():
+        if not bit.isdigit():
+            raise InvalidDialect('Error dialect %s has subfields of an invalid bit %s!' % (path, bit))
+        if definition is None:
+            subfields.pop(int(bit), None)
+        else:
+            subfields[int(bit)] = validateSubfields(int(bit), definition)
+
+    ebcdic = dialect.get('ebcdic', base.ebcdic)
+    if not isinstance(ebcdic, bool):
+        raise InvalidDialect('Error dialect %s has an invalid "ebcdic", it must be true or false!' % path)
+
+    return tuple(bits), ebcdic, subfields
+
+################################################################################################
+
+
+################################################################################################
+# Load a dialect file
+def loadSpec(path, base=None, snapshot=True, generateCode=False, cacheDir=None):
+    """Load a Spec from a dialect (JSON) file, so dialects are deployed as files instead of redefineBit calls.
+    The file lists the bits that are different of the base Spec, with the same fields of redefineBit, and optionally
+    the subfields of the bits (see Spec.withSubfields, null removes them) and the whole message EBCDIC mode:
+        {
+            "ebcdic": false,
+            "bits": [
+                {"bit": 42, "smallStr": "42", "largeStr": "Card acceptor identification code",
+                 "bitType": "LL", "LenForm": "A", "size": 15, "valueType": "ans", "format": "A"}
+            ],
+            "subfields": {"127": [["terminalType", 2], ["batch", 6]]}
+        }
+    The validated definitions are kept in a snapshot (marshal) next to the file, <path>.snapshot, used while the file
+    (and the base Spec) is not changed, so the other processes that load it don't read and validate it again.
+    Each call returns a new Spec, so a process can load and use several dialects.
+    Example:
+        acquirerB = loadSpec('/etc/iso8583/acquirerB.json', generateCode=True, cacheDir='/var/cache/iso8583')
+        iso = Iso8583(spec=acquirerB)
+    @param: path -> path of the dialect file
+    @param: base -> Spec with the bits not in the file, default Iso8583.DEFAULT_SPEC
+    @param: snapshot (True or False) default True -> use and write the snapshot
+    @param: generateCode (True or False) default False -> generate the parse and build code of the Spec (see Spec.generateCode)
+    @param: cacheDir -> directory where the generated code is kept between starts, or None to keep it only in memory.
+        Its files are executed, so it must be trusted (see Spec.generateCode)
+    @return: Spec
+    @raise: InvalidDialect Exception, and the Exceptions of redefineBit and Spec.withSubfields for invalid bits
+    """
+    if base is None:
+        from iso8583.iso8583 import Iso8583
+        base = Iso8583.DEFAULT_SPEC
+
+    try:
+        stat = os.stat(path)
+    except OSError as error:
+        raise InvalidDialect('Error dialect %s cannot be read: %s' % (path, error))
+    # The snapshot is valid for this content of the file (by modification time and size) and this base
+    key = (_SNAPSHOT_VERSION, stat.st_mtime_ns, stat.st_size, getSpecKey(base))
+
+    state = None
+    snapshotPath = path + '.snapshot'
+    if snapshot is True:
+        try:
+            with open(snapshotPath, 'rb') as cached:
+                state = marshal.load(cached)
+            if state[0] != key:
+                state = None
+        except (OSError, EOFError, ValueError, TypeError, IndexError):  # Not written yet, or by another version
+            state = None
+
+    if state is None:
+        state = (key,) + _readDialect(path, base)
+        if snapshot is True:
+            # Written aside and renamed, so other processes never read half a file
+            temporary = '%s.%d.tmp' % (snapshotPath, os.getpid())
+            try:
+                with open(temporary, 'wb') as cached:
+                    marshal.dump(state, cached)
+                os.replace(temporary, snapshotPath)
+            except OSError:  # Read-only directory, the dialect is just read every time
+                pass
+
+    key, bits, ebcdic, subfields = state
+    spec = Spec(bits, ebcdic=ebcdic, subfields=subfields)
+    if generateCode is True:
+        spec = spec.generateCode(cacheDir)
+    return spec
+
+################################################################################################
+
+
+class Spec:
+    """Frozen definition of the bits 1 to 128, with its compiled codecs and layout cache.
+    Example:
+        from iso8583 import Iso8583, Spec
+
+        acquirerB = Iso8583.DEFAULT_SPEC.redefineBit(42, '42', 'Card acceptor identification code', 'LL', 'A', 15, 'ans', 'A')
+        iso = Iso8583(spec=acquirerB)
+
+    A whole message EBCDIC Spec is meant for links where all the package is EBCDIC text (MTI, bitmap, length indicators
+    and bits): the received package is translated to ASCII with a single bytes.translate and parsed as ASCII, the built
+    package is translated back. The bytes are the same of the per bit cp1148 path (format 'E' everywhere), only faster.
+        hostLink = Iso8583.DEFAULT_SPEC.withEbcdic()
+        iso = Iso8583(spec=hostLink)
+
+    A Spec fixed at deploy time can have its parse and build code generated (see generateCode):
+        acquirerB = acquirerB.generateCode('/var/cache/iso8583')
+    """
+    __slots__ = ('__bits', '__subfields', 'codecs', 'layouts', 'ebcdic', 'compiled')
+
+    def __init__(self, bitsValueType, layoutCacheSize=256, _codecs=None, ebcdic=False, subfields=None, _compiled=None):
+        """Create a Spec from a _BITS_VALUE_TYPE like table.
+        The table is copied, so changing it later doesn't change the Spec.
+        @param: bitsValueType -> dict (or list) with [smallStr, largeStr, bitType, LenForm, size, valueType, format] of the bits 1 to 128
+        @param: layoutCacheSize -> maximum number of bitmaps kept in the layout cache
+        @param: ebcdic -> True for a whole message EBCDIC Spec, the formats 'A' and 'E' of the bits both mean EBCDIC
+        @param: subfields -> dict bit -> subfields definition of the bit (see withSubfields)
+        @raise: InvalidFormat Exception (whole message EBCDIC Spec with a packed bit or length indicator), InvalidSubfield Exception
+        """
+        bits = (None,) + tuple(tuple(bitsValueType[bit]) for bit in range(1, 129))
+        if _codecs is None:
+            _codecs = compileBits(bitsValueType, ebcdic)
+        object.__setattr__(self, 'ebcdic', ebcdic)
+        object.__setattr__(self, '_Spec__subfields', {
+            bit: validateSubfields(bit, definition) for bit, definition in (subfields or {}).items()})
+        object.__setattr__(self, '_Spec__bits', bits)
+        object.__setattr__(self, 'codecs', tuple(_codecs))
+        object.__setattr__(self, 'layouts', LayoutCache(layoutCacheSize))
+        # Generated parse and build code, only in the Spec returned by generateCode
+        object.__setattr__(self, 'compiled', _compiled)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Spec is immutable, use derive() or redefineBit() to get a new one")
+
+    def __delattr__(self, name):
+        raise AttributeError("Spec is immutable, use derive() or redefineBit() to get a new one")
+
+    def getDefinition(self, bit):
+        """Return the definition of a bit
+        @param: bit -> bit number
+        @return: tuple (smallStr, largeStr, bitType, LenForm, size, valueType, format)
+        """
+        return self.__bits[bit]
+
+    def getDefinitions(self):
+        """Return the definitions of all the bits
+        @return: dict bit -> (smallStr, largeStr, bitType, LenForm, size, valueType, format), usable to create another Spec
+        """
+        return {bit: self.__bits[bit] for bit in range(1, 129)}
+
+    def derive(self, bits):
+        """Return a new Spec with some bits redefined, this one is not changed.
+        Only the redefined bits are validated and compiled again.
+        @param: bits -> dict bit -> (smallStr, largeStr, bitType, LenForm, size, valueType, format)
+        @return: new Spec
+        @raise: same Exceptions of validateBit
+        """
+        table = list(self.__bits)
+        codecs = list(self.codecs)
+        for bit, definition in bits.items():
+            validateBit(bit, *definition)
+            smallStr, largeStr, bitType, LenForm, size, valueType, format = definition
+            table[bit] = tuple(definition)
+            codecs[bit] = compileBit(bit, bitType, LenForm, size, valueType, format, self.ebcdic)
+        return Spec(table, self.layouts.maxsize, codecs, self.ebcdic, self.__subfields)
+
+    def withEbcdic(self, ebcdic=True):
+        """Return a new Spec with the same bits, whole message EBCDIC (or not), this one is not changed.
+        The packed bits (format or length indicator) can't be translated, they raise InvalidFormat when used.
+        @param: ebcdic -> True for a whole message EBCDIC Spec
+        @return: new Spec
+        @raise: InvalidFormat Exception
+        """
+        return Spec(self.getDefinitions(), self.layouts.maxsize, ebcdic=ebcdic, subfields=self.__subfields)
+
+    def getSubfields(self, bit):
+        """Return the subfields definition of a bit
+        @param: bit -> bit number
+        @return: 'tlv', 'tlvhex', ((name, size), ...) or None if the bit has no subfields
+        """
+        return self.__subfields.get(bit)
+
+    def withSubfields(self, bit, definition):
+        """Return a new Spec with the subfields of a bit defined, this one is not changed.
+        The subfields are decoded on demand by Iso8583.getSubfields.
+        Example:
+            spec = Iso8583.DEFAULT_SPEC.withSubfields(127, (('terminalType', 2), ('batch', 6), ('reference', 12)))
+        @param: bit -> bit number
+        @param: definition -> 'tlv' (BER-TLV bytes), 'tlvhex' (BER-TLV in hexadecimal text),
+            ((name, size), ...) for fixed position subfields (sizes in bytes), or None to remove them
+        @return: new Spec
+        @raise: InvalidSubfield Exception
+        """
+        subfields = dict(self.__subfields)
+        if definition is None:
+            subfields.pop(bit, None)
+        else:
+            subfields[bit] = definition
+        return Spec(self.getDefinitions(), self.layouts.maxsize, self.codecs, self.ebcdic, subfields)
+
+    def redefineBit(self, bit, smallStr, largeStr, bitType, LenForm, size, valueType, format):
+        """Return a new Spec with one bit redefined, this one is not changed.
+        See Iso8583.redefineBit for the meaning of the parameters.
+        @return: new Spec
+        @raise: BitNonexistent Exception, InvalidValueType Exception
+        """
+        return self.derive({bit: (smallStr, largeStr, bitType, LenForm, size, valueType, format)})
+
+    def generateCode(self, cacheDir=None):
+        """Return a new Spec with the same bits and the specialized parse and build code generated (see iso_codegen),
+        so Iso8583.parse (of all the bits) and Iso8583.build use it instead of the codecs. This one is not changed.
+        The new Specs returned by derive, redefineBit, withEbcdic and withSubfields don't have it, so call it on the final Spec.
+        The code is only generated once per process for the same bits (see iso_codegen.compileSpec).
+        Example:
+            spec = Iso8583.DEFAULT_SPEC.redefineBit(42, '42', 'Card acceptor identification code', 'LL', 'A', 15, 'ans', 'A')
+            spec = spec.generateCode('/var/cache/iso8583')
+        @param: cacheDir -> directory where the compiled code is kept between starts, or None to generate it every start.
+            The files of the directory are executed, so it must be trusted and writable only by the service.
+        @return: new Spec
+        """
+        if self.compiled is not None:
+            return self
+        return Spec(self.getDefinitions(), self.layouts.maxsize, self.codecs, self.ebcdic, self.__subfields,
+                    compileSpec(self, cacheDir))
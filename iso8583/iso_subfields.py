@@ -0,0 +1,282 @@
+""" Lazy decoding of the subfields of a bit: TLV (EMV data in bit 55, private use bits) or fixed position.
+The subfields are read over the bytes of the bit without copying them, and a subfield is only
+copied and decoded when it's asked. A TLV is indexed as far as needed to find the tag asked.
+"""
+from iso8583.iso_errors import *
+
+# Subfield definitions (see Spec.withSubfields)
+# 'tlv' -> the value of the bit is BER-TLV, as bytes
+# 'tlvhex' -> the value of the bit is BER-TLV written in hexadecimal text
+# ((name, size), ...) -> fixed position subfields, in order, sizes in bytes
+SUBFIELDS_TLV = 'tlv'
+SUBFIELDS_TLV_HEX = 'tlvhex'
+
+# Value of the ASCII hexadecimal digits, for the TLV written in hexadecimal text
+_HEX_VALUES = {digit: int(chr(digit), 16) for digit in b'0123456789abcdefABCDEF'}
+
+
+################################################################################################
+# Validate a subfields definition
+def validateSubfields(bit, definition):
+    """Check that a subfields definition is valid
+    @param: bit -> bit number, used in the message
+    @param: definition -> 'tlv', 'tlvhex' or ((name, size), ...)
+    @return: the definition, as a tuple if fixed position
+    @raise: InvalidSubfield Exception
+    """
+    if definition == SUBFIELDS_TLV or definition == SUBFIELDS_TLV_HEX:
+        return definition
+
+    try:
+        layout = tuple((name, int(size)) for name, size in definition)
+    except (TypeError, ValueError):
+        raise InvalidSubfield('Error bit %s has an invalid subfields definition!' % bit)
+
+    names = set()
+    for name, size in layout:
+        if size < 1 or name in names:
+            raise InvalidSubfield('Error bit %s has an invalid subfield %s!' % (bit, name))
+        names.add(name)
+    return layout
+
+################################################################################################
+
+
+class TLV:
+    """BER-TLV data (EMV) decoded on demand.
+    Example:
+        tlv = iso.getSubfields(55)
+        if '9F02' in tlv:
+            amount = tlv.getNumeric('9F02')
+        cryptogram = tlv.getHex('9F26')
+
+    Tags are hexadecimal str ('9F02'). The data is kept as a memoryview and only the tag and length
+    of each item are read, up to the item asked. Padding bytes (00 or FF) between items are skipped.
+    A TLV written in hexadecimal text is indexed the same way over the text, and only the value of
+    the tag asked is converted to bytes.
+    """
+    __slots__ = ('__data', '__index', '__offset', '__hexadecimal')
+
+    def __init__(self, data, hexadecimal=False):
+        """Create the decoder, nothing is read yet.
+        @param: data -> bytes (or bytearray/memoryview) of the TLV items
+        @param: hexadecimal (True or False) default False -> True if the items are written in hexadecimal text (ASCII)
+        """
+        self.__data = memoryview(data)
+        self.__hexadecimal = hexadecimal
+        # tag -> (start, end) of the value in data, for the items already read
+        self.__index = {}
+        # Where the next item to be read starts
+        self.__offset = 0
+
+    def __byte(self, offset):
+        """Return the byte of the items at offset of data (2 digits of data in hexadecimal text)
+        It's a internal method, so don't call!
+        @raise: InvalidSubfield Exception
+        """
+        data = self.__data
+        if self.__hexadecimal is False:
+            return data[offset]
+        try:
+            return _HEX_VALUES[data[offset]] << 4 | _HEX_VALUES[data[offset + 1]]
+        except (KeyError, IndexError):
+            raise InvalidSubfield('Error TLV data is not hexadecimal!')
+
+    def __scan(self, tag=None):
+        """Read the items not read yet, stopping after tag (or at the end)
+        It's a internal method, so don't call!
+        @raise: InvalidSubfield Exception
+        """
+        data = self.__data
+        size = len(data)
+        # Positions in data of one byte of the items
+        width = 2 if self.__hexadecimal else 1
+        offset = self.__offset
+        index = self.__index
+        while offset < size:
+            first = self.__byte(offset)
+            if first == 0x00 or first == 0xFF:  # Padding
+                offset += width
+                continue
+
+            # Tag, more bytes follow when the 5 lower bits are all set, and then while the highest bit is set
+            start = offset
+            offset += width
+            if first & 0x1F == 0x1F:
+                while offset < size and self.__byte(offset) & 0x80:
+                    offset += width
+                offset += width
+            if self.__hexadecimal:
+                found = bytes(data[start:offset]).decode().upper()
+            else:
+                found = data[start:offset].hex().upper()
+
+            # Length, short form (up to 127) or long form (0x81 nn, 0x82 nn nn, ...)
+            if offset >= size:
+                raise InvalidSubfield('Error TLV item %s has no length!' % found)
+            length = self.__byte(offset)
+            offset += width
+            if length & 0x80:
+                digits = length & 0x7F
+                length = 0
+                for _ in range(digits):
+                    if offset >= size:
+                        raise InvalidSubfield('Error TLV item %s has no length!' % found)
+                    length = length << 8 | self.__byte(offset)
+                    offset += width
+
+            length *= width
+            if offset + length > size:
+                raise InvalidSubfield('Error TLV item %s is larger than the data!' % found)
+            index.setdefault(found, (offset, offset + length))
+            offset += length
+
+            if found == tag:
+                break
+        self.__offset = offset
+
+    def __find(self, tag):
+        """Return (start, end) of the value of a tag, or None if not present
+        It's a internal method, so don't call!
+        """
+        tag = tag.upper()
+        position = self.__index.get(tag)
+        if position is None and self.__offset < len(self.__data):
+            self.__scan(tag)
+            position = self.__index.get(tag)
+        return position
+
+    def __text(self, tag, position):
+        """Return the hexadecimal text of a value, checked
+        It's a internal method, so don't call!
+        @raise: InvalidSubfield Exception
+        """
+        text = bytes(self.__data[position[0]:position[1]])
+        if not all(digit in _HEX_VALUES for digit in text):
+            raise InvalidSubfield('Error TLV item %s is not hexadecimal!' % tag.upper())
+        return text.decode()
+
+    def __contains__(self, tag):
+        return self.__find(tag) is not None
+
+    def getRaw(self, tag):
+        """Return the value of a tag without copying it
+        A TLV written in hexadecimal text has to convert the value, so it returns new bytes.
+        @param: tag -> hexadecimal str of the tag, example '9F02'
+        @return: memoryview (bytes for a hexadecimal TLV) or None if the tag is not present
+        @raise: InvalidSubfield Exception
+        """
+        position = self.__find(tag)
+        if position is None:
+            return None
+        if self.__hexadecimal:
+            return bytes.fromhex(self.__text(tag, position))
+        return self.__data[position[0]:position[1]]
+
+    def get(self, tag):
+        """Return the value of a tag
+        @param: tag -> hexadecimal str of the tag, example '9F02'
+        @return: bytes or None if the tag is not present
+        @raise: InvalidSubfield Exception
+        """
+        value = self.getRaw(tag)
+        if value is None:
+            return None
+        return bytes(value)
+
+    def getHex(self, tag):
+        """Return the value of a tag in hexadecimal (uppercase)
+        @param: tag -> hexadecimal str of the tag, example '9F26'
+        @return: str or None if the tag is not present
+        @raise: InvalidSubfield Exception
+        """
+        position = self.__find(tag)
+        if position is None:
+            return None
+        if self.__hexadecimal:
+            return self.__text(tag, position).upper()
+        return self.__data[position[0]:position[1]].hex().upper()
+
+    def getNumeric(self, tag):
+        """Return the value of a numeric (BCD) tag, like the amounts 9F02 and 9F03
+        @param: tag -> hexadecimal str of the tag, example '9F02'
+        @return: int or None if the tag is not present
+        @raise: InvalidSubfield Exception
+        """
+        digits = self.getHex(tag)
+        if digits is None:
+            return None
+        if not digits.isdigit():
+            if digits:
+                raise InvalidSubfield('Error TLV item %s is not numeric!' % tag.upper())
+            return 0
+        return int(digits)
+
+    def getTags(self):
+        """Return all the tags, in the order they are in the data
+        @return: list of str
+        @raise: InvalidSubfield Exception
+        """
+        self.__scan()
+        return list(self.__index)
+
+
+class FixedSubfields:
+    """Subfields at fixed positions of a bit, defined by a ((name, size), ...) layout.
+    Example:
+        private = iso.getSubfields(127)
+        terminalType = private.get('terminalType')
+
+    The positions are computed once, a subfield is copied and decoded when asked.
+    A bit shorter than the layout simply doesn't have the last subfields.
+    """
+    __slots__ = ('__data', '__positions', '__decode')
+
+    def __init__(self, data, layout, decode):
+        """Create the decoder, nothing is copied or decoded yet.
+        @param: data -> bytes (or bytearray/memoryview) of the value of the bit
+        @param: layout -> ((name, size), ...) in order, sizes in bytes
+        @param: decode -> function that decode the bytes of a subfield to str, the same used for the whole bit
+        """
+        self.__data = memoryview(data)
+        self.__decode = decode
+        self.__positions = {}
+        offset = 0
+        for name, size in layout:
+            self.__positions[name] = (offset, offset + size)
+            offset += size
+
+    def __contains__(self, name):
+        position = self.__positions.get(name)
+        return position is not None and position[1] <= len(self.__data)
+
+    def getRaw(self, name):
+        """Return the bytes of a subfield without copying them
+        @param: name -> subfield name, as in the layout
+        @return: memoryview or None if the bit is too short to have it
+        @raise: InvalidSubfield Exception
+        """
+        position = self.__positions.get(name)
+        if position is None:
+            raise InvalidSubfield('Error subfield %s is not in the layout!' % name)
+        if position[1] > len(self.__data):
+            return None
+        return self.__data[position[0]:position[1]]
+
+    def get(self, name):
+        """Return the value of a subfield
+        @param: name -> subfield name, as in the layout
+        @return: str or None if the bit is too short to have it
+        @raise: InvalidSubfield Exception
+        """
+        value = self.getRaw(name)
+        if value is None:
+            return None
+        return self.__decode(value.tobytes())
+
+    def getNames(self):
+        """Return the names of the subfields present in the bit, in order
+        @return: list of str
+        """
+        size = len(self.__data)
+        return [name for name, position in self.__positions.items() if position[1] <= size]
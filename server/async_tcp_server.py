@@ -0,0 +1,280 @@
+import asyncio
+import functools
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import settings
+from iso8583 import Iso8583Framer
+from server.message_handler import ISO8583MessageHandler, get_correlation_key, get_routing_values
+from server.server_stats import ServerStats, CONNECTIONS, ACTIVE_CONNECTIONS, MESSAGES, ERRORS, REFUSED
+from server.worker_pool import WorkerPool
+
+# Frames received and not handled yet that stop the reading of a connection, until half of them are handled
+MAX_PENDING_FRAMES = 64
+
+
+class ISO8583Protocol(asyncio.BufferedProtocol):
+    """
+    Protocol of a connection of the AsyncTCPServer. The event loop receives the bytes straight
+    into the buffer of the Iso8583Framer of the connection (get_buffer and buffer_updated), so
+    no bytes object is created per read, and the frames found wait for the coroutine of the
+    connection in a queue.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.framer = Iso8583Framer(settings.LENGTH_PREFIX, bufferSize=settings.RECV_BUFFER_SIZE)
+        self.frames = asyncio.Queue()
+        self.transport = None
+        self.view = None
+        self.reading = True
+        # Cleared while the transport has too much to send, see drain
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.server.start_client(self)
+
+    def get_buffer(self, sizehint):
+        self.view = self.framer.getWriteBuffer()
+        return self.view
+
+    def buffer_updated(self, nbytes):
+        # The view must be released before the framer is called again
+        self.view.release()
+        self.view = None
+        try:
+            frames = self.framer.commit(nbytes)
+        except Exception as e:  # The stream can't be resynchronized, the coroutine closes the connection
+            self.frames.put_nowait(e)
+            self.transport.pause_reading()
+            return
+        for frame in frames:
+            # Copied, the frames are views over the buffer of the framer, valid until the next read
+            self.frames.put_nowait(bytes(frame))
+        # Stops reading while the messages are not handled as fast as they arrive
+        if self.reading and self.frames.qsize() >= MAX_PENDING_FRAMES:
+            self.reading = False
+            self.transport.pause_reading()
+
+    def eof_received(self):
+        self.frames.put_nowait(None)
+        # Keeps the connection open, the responses of the messages received are still sent
+        return True
+
+    def connection_lost(self, exc):
+        if self.view is not None:
+            self.view.release()
+            self.view = None
+        self.frames.put_nowait(None)
+        self.writable.set()
+
+    def pause_writing(self):
+        self.writable.clear()
+
+    def resume_writing(self):
+        self.writable.set()
+
+    async def read_frame(self):
+        """
+        Waits for the next frame received.
+
+        :return: The frame (bytes), or None at the end of the stream.
+        :raise: The exception of a stream that can't be split in frames.
+        """
+        frame = await self.frames.get()
+        if not self.reading and self.frames.qsize() <= MAX_PENDING_FRAMES // 2:
+            self.reading = True
+            self.transport.resume_reading()
+        if isinstance(frame, Exception):
+            raise frame
+        return frame
+
+    async def drain(self):
+        """
+        Waits for the responses to be sent when the client doesn't read them fast enough.
+        """
+        await self.writable.wait()
+
+
+class AsyncTCPServer:
+    """
+    TCP server that serves all the connections from a single asyncio event loop, instead of
+    one thread per connection. Idle connections only cost a few objects, so thousands of POS
+    and host connections can be kept open. The message handler contract is the same of
+    TCPServer: one ISO8583MessageHandler per connection, a message in and a response out.
+    """
+
+    def __init__(self, reuse_port=False, stats=None):
+        self.host = settings.HOST
+        self.port = settings.PORT
+        # Several processes can listen on the same port, the kernel spreads the connections (see server/prefork.py)
+        self.reuse_port = reuse_port
+        self.stats = stats if stats is not None else ServerStats()
+        if settings.PIPELINING and settings.LENGTH_PREFIX is None:
+            raise ValueError("PIPELINING needs a LENGTH_PREFIX, the messages of a connection must be framed")
+        self.server = None
+        # The handlers never run in the event loop: they run in a pool of threads of its own, or in the
+        # default executor of the event loop (None)
+        self.executor = None
+        if settings.HANDLER_WORKERS > 0:
+            self.executor = ThreadPoolExecutor(max_workers=settings.HANDLER_WORKERS)
+        # Or in the bounded pool of workers of the threaded server, with its saturation policy and queue counters
+        self.pool = None
+        if settings.WORKER_THREADS > 0:
+            self.pool = WorkerPool(settings.WORKER_THREADS, settings.WORKER_QUEUE_SIZE, settings.SATURATION_POLICY, self.stats)
+        # Coroutines of the open connections, the event loop only keeps a weak reference to them
+        self.clients = set()
+
+    # Method to start the server
+    def start_server(self):
+        try:
+            asyncio.run(self.serve())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+
+    # Coroutine that accepts the connections until the server is stopped
+    async def serve(self):
+        loop = asyncio.get_running_loop()
+        self.server = await loop.create_server(lambda: ISO8583Protocol(self), self.host, self.port,
+                                               backlog=settings.LISTEN_BACKLOG, reuse_port=self.reuse_port or None)
+        print(f"Server is running on {self.host}:{self.port} (asyncio)...")
+        async with self.server:
+            try:
+                await self.server.serve_forever()
+            except asyncio.CancelledError:
+                pass
+
+    # Method called by the protocol of a new connection, starts its coroutine
+    def start_client(self, protocol):
+        # Open connections are limited, the ones over the limit are closed as soon as accepted
+        if 0 < settings.MAX_CONNECTIONS <= self.stats.values[ACTIVE_CONNECTIONS]:
+            self.stats.add(REFUSED)
+            protocol.transport.close()
+            return
+        # Counted as soon as accepted, so the connections accepted together are all checked against the limit
+        self.stats.add(CONNECTIONS)
+        self.stats.add(ACTIVE_CONNECTIONS)
+        task = asyncio.get_running_loop().create_task(self.handle_client(protocol))
+        self.clients.add(task)
+        task.add_done_callback(self.clients.discard)
+
+    # Coroutine that handles a client connection
+    async def handle_client(self, protocol):
+        transport = protocol.transport
+        addr = transport.get_extra_info('peername')
+        print(f"Connection established with {addr}.")
+        # The stream is split in messages by the framer of the protocol (see settings.LENGTH_PREFIX), as they are received
+        framer = protocol.framer
+        handler = ISO8583MessageHandler()
+        try:
+            if settings.PIPELINING:
+                await self.handle_pipelined(protocol)
+                return
+
+            while True:
+                request_message = await protocol.read_frame()
+                if request_message is None:
+                    break
+
+                print(f"Received data: {request_message}")
+
+                # Send the message to the message handler and get the response, out of the event loop
+                response_message = await self.run_handler(handler, request_message)
+
+                # Send the response back to the client
+                transport.write(framer.pack(response_message))
+                self.stats.add(MESSAGES)
+
+                # Wait for the responses to be sent when the client doesn't read them fast enough
+                await protocol.drain()
+        except Exception as e:
+            print(f"Connection error: {e}")
+            self.stats.add(ERRORS)
+        finally:
+            transport.close()
+            self.stats.add(ACTIVE_CONNECTIONS, -1)
+            print(f"Connection with {addr} closed.")
+
+    # Coroutine that handles the messages of a connection concurrently, the responses are sent as soon as ready
+    async def handle_pipelined(self, protocol):
+        # The client matches the responses by STAN and RRN, up to MAX_IN_FLIGHT messages run at the same time
+        transport = protocol.transport
+        framer = protocol.framer
+        in_flight = {}
+        slots = asyncio.Semaphore(settings.MAX_IN_FLIGHT)
+
+        async def reply(request_message, values, key):
+            try:
+                # Each message has its own handler, they run at the same time (in the executor), routed by the values read
+                response_message = await self.run_handler(ISO8583MessageHandler(), request_message, values)
+                transport.write(framer.pack(response_message))
+                self.stats.add(MESSAGES)
+                await protocol.drain()
+            except Exception as e:
+                print(f"Message {key} error: {e}")
+            finally:
+                in_flight.pop(key, None)
+                slots.release()
+
+        try:
+            while True:
+                request_message = await protocol.read_frame()
+                if request_message is None:
+                    break
+
+                print(f"Received data: {request_message}")
+
+                values = get_routing_values(request_message)
+                key = get_correlation_key(values)
+                if key == (None, None):  # Can't be matched, so can't be a duplicate
+                    key = object()
+                elif key in in_flight:  # Answered at once, the message already running gets its own response
+                    print(f"Message {key} is already in flight, answered as duplicate.")
+                    transport.write(framer.pack(ISO8583MessageHandler().duplicate_handler(request_message)))
+                    self.stats.add(MESSAGES)
+                    continue
+
+                # Stops taking messages while MAX_IN_FLIGHT messages are running, the reading stops
+                # when MAX_PENDING_FRAMES are waiting
+                await slots.acquire()
+                in_flight[key] = asyncio.create_task(reply(request_message, values, key))
+        finally:
+            # The messages still running are answered before the connection is closed
+            if in_flight:
+                await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+    # Coroutine that runs the message handler out of the event loop and returns its response
+    async def run_handler(self, handler, request_message, values=None):
+        loop = asyncio.get_running_loop()
+        function = functools.partial(handler.message_handler, values=values)
+        if self.pool is None:
+            return await loop.run_in_executor(self.executor, function, request_message)
+
+        # The worker (or the thread that sheds the job) wakes up the coroutine through the event loop
+        done = loop.create_future()
+
+        def finished(job):
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(job))
+
+        try:
+            job = self.pool.submit(function, request_message, finished, block=False)
+        except queue.Full:
+            # POLICY_PAUSE: waits for room out of the event loop, the connection stops reading meanwhile
+            job = await loop.run_in_executor(None, self.pool.submit, function, request_message, finished)
+        if job is not None:
+            job = await done
+        if job is None or job.shed:  # Rejected or shed, the queue is full
+            return await loop.run_in_executor(self.executor, handler.network_busy_handler, request_message)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    # Method to stop the server (optional), can be called from another thread
+    def stop_server(self):
+        if self.server is not None:
+            self.server.get_loop().call_soon_threadsafe(self.server.close)
+        print("Server stopped.")
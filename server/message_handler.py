@@ -1,22 +1,51 @@
+from iso8583 import Iso8583
 from server.message_processor import ISO8583Message
 from server.mti_definition import transaction_routes
 
+# Only reads the routing and correlation fields of the messages before they are handled, it's never changed
+routing_iso = Iso8583()
+
+# Fields that match a response with its request on a pipelined link: STAN and RRN
+CORRELATION_FIELDS = (11, 37)
+
+# Fields a message is routed by, with its MTI: the processing code, and the correlation fields
+ROUTING_FIELDS = (3,) + CORRELATION_FIELDS
+
+
+def get_routing_values(request_message):
+    # The MTI (0) and routing fields of a message, without a full parse
+    return routing_iso.parse(request_message, fields=ROUTING_FIELDS)
+
+
+def get_correlation_key(values):
+    # The STAN and RRN of a message (None for the ones not present), from its routing values
+    return tuple(values.get(bit) for bit in CORRELATION_FIELDS)
+
 
 class ISO8583MessageHandler(ISO8583Message):
     def __init__(self):
         super().__init__()
 
-    def message_handler(self, request_message):
+    def message_handler(self, request_message, values=None):
+        # The messages go back to the pool even when the transaction logic raises
+        try:
+            return self.route_message(request_message, values)
+        finally:
+            self.release_messages()
+
+    def route_message(self, request_message, values=None):
+        # The route is picked from a projection of the MTI and processing code (the values of
+        # get_routing_values, when the server already has them), the message is only parsed by
+        # the transactions that read it (see get_iso_request_message)
+        if values is None:
+            values = get_routing_values(request_message)
         self.set_request_message(request_message)
+        mti = values[0]
+        transaction_key = (mti, values.get(3))
 
         # Log the incoming message (optional)
         print("Incoming ISO 8583 Message:")
-        print(self.get_iso_request_message().getIsoContent())
-
-        mti = self.get_iso_request_message().getMTI()
-        processing_code = self.get_iso_request_message().getBit(3)
-
-        transaction_key = (mti, processing_code)
+        print(bytes(request_message))
 
         if transaction_key in transaction_routes:
             transaction_type = transaction_routes[transaction_key]
@@ -106,6 +135,9 @@ class ISO8583MessageHandler(ISO8583Message):
                     # Handle unknown transaction types
                     self.handle_unknown_transaction(mti)
 
+        # The client matches the response with its request by these fields, the responses can come out of order
+        self.echo_request_fields(CORRELATION_FIELDS)
+
         # Pack the message and return it
         return self.get_iso_response_message().getRawIso()
 
@@ -121,3 +153,21 @@ class ISO8583MessageHandler(ISO8583Message):
         self.get_iso_response_message().setMTI(response_mti)  # Transaction response MTI
         self.get_iso_response_message().setBit(3, '000000')  # Processing code
         self.get_iso_response_message().setBit(39, '12')  # Invalid Transaction response code
+
+    def network_busy_handler(self, request_message):
+        # Answer without processing, when the server is saturated (see server/worker_pool.py)
+        try:
+            self.set_request_message(request_message)
+            self.prepare_response_message().setBit(39, '91')  # Issuer or switch inoperative (network busy) response code
+            return self.get_iso_response_message().getRawIso()
+        finally:
+            self.release_messages()
+
+    def duplicate_handler(self, request_message):
+        # Answer without processing, when a message with the same STAN and RRN is still running (pipelined links)
+        try:
+            self.set_request_message(request_message)
+            self.prepare_response_message().setBit(39, '94')  # Duplicate transmission response code
+            return self.get_iso_response_message().getRawIso()
+        finally:
+            self.release_messages()
@@ -1,4 +1,8 @@
-from iso8583 import Iso8583
+from iso8583 import Iso8583Pool
+from iso8583.iso_errors import BitNotSet
+
+# Request and response objects are recycled between transactions, the requests are only indexed when parsed
+iso_pool = Iso8583Pool(lazy=True)
 
 
 class ISO8583Message:
@@ -13,26 +17,43 @@ class ISO8583Message:
         Initializes the ISO8583Message class by defining placeholders for ISO 8583 request
         and response messages.
         """
+        self.request_message = None
         self.iso_request_message = None
         self.iso_response_message = None
 
     def set_request_message(self, request_message):
         """
-        Initializes the ISO 8583 request and response messages and sets the content
-        of the request message based on the incoming ISO 8583 message.
+        Initializes the ISO 8583 request and response messages and keeps the incoming
+        ISO 8583 message. The request message is only parsed when it is first used
+        (see get_iso_request_message), so the transactions that don't read it don't pay for it.
 
         :param request_message: The incoming ISO 8583 message to be processed.
         """
-        self.iso_request_message = Iso8583()
-        self.iso_response_message = Iso8583()
-        self.iso_request_message.setIsoContent(request_message)
+        self.release_messages()
+        self.request_message = request_message
+        self.iso_response_message = iso_pool.acquire()
+
+    def release_messages(self):
+        """
+        Gives the ISO 8583 request and response messages back to the pool. They must not
+        be used after released.
+        """
+        iso_pool.release(self.iso_request_message)
+        iso_pool.release(self.iso_response_message)
+        self.request_message = None
+        self.iso_request_message = None
+        self.iso_response_message = None
 
     def get_iso_request_message(self):
         """
-        Retrieves the ISO 8583 request message object.
+        Retrieves the ISO 8583 request message object, parsing the incoming message
+        the first time it is called.
 
-        :return: The ISO 8583 request message.
+        :return: The ISO 8583 request message, or None if there is no incoming message.
         """
+        if self.iso_request_message is None and self.request_message is not None:
+            self.iso_request_message = iso_pool.acquire()
+            self.iso_request_message.setIsoContent(self.request_message)
         return self.iso_request_message
 
     def get_iso_response_message(self):
@@ -43,6 +64,38 @@ class ISO8583Message:
         """
         return self.iso_response_message
 
+    def prepare_response_message(self, bits=None):
+        """
+        Prepares the ISO 8583 response message from the request: the response MTI is derived
+        from the request MTI and the echoed fields (3, 4, 7, 11, 12, 13, 37, 41, 42 and 49 by
+        default) are copied without being decoded and encoded again. The transaction logic
+        only needs to set the fields it changes, such as the response code (field 39).
+
+        :param bits: The fields to be echoed, or None for the default ones.
+        :return: The ISO 8583 response message.
+        """
+        self.iso_response_message.setResponseFromRequest(self.get_iso_request_message(), bits)
+        return self.iso_response_message
+
+    def echo_request_fields(self, bits):
+        """
+        Copies fields from the request to the response, the ones present in the request and
+        not set in the response yet. They are copied without being decoded and encoded again,
+        so they are the same bytes of the request.
+
+        :param bits: The fields to be echoed.
+        """
+        response = self.iso_response_message
+        missing = []
+        for bit in bits:
+            try:
+                response.getBit(bit)
+            except BitNotSet:
+                missing.append(bit)
+        if missing:
+            # The MTI set by the transaction is kept, the one derived from the request otherwise
+            response.setResponseFromRequest(self.get_iso_request_message(), missing, response.getMTI() or None)
+
     def process_sale(self):
         """
         Processes a 'Sale' transaction. This method should contain the logic
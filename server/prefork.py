@@ -0,0 +1,103 @@
+import multiprocessing
+import socket
+import time
+import settings
+from server.server_stats import ServerStats, STAT_NAMES, ACTIVE_CONNECTIONS, QUEUE_DEPTH
+from server.tcp_server import TCPServer
+from server.async_tcp_server import AsyncTCPServer
+
+
+def run_worker(index, values):
+    """
+    Runs one worker process: a server (of settings.SERVER_MODE) bound to HOST:PORT with
+    SO_REUSEPORT, so the kernel spreads the connections between the workers.
+
+    :param index: Number of the worker, used in the messages.
+    :param values: Shared memory array where the worker keeps its counters.
+    """
+    stats = ServerStats(values)
+    if settings.SERVER_MODE == 'asyncio':
+        server = AsyncTCPServer(reuse_port=True, stats=stats)
+    else:
+        server = TCPServer(reuse_port=True, stats=stats)
+    print(f"Worker {index} started.")
+    server.start_server()
+
+
+class PreforkSupervisor:
+    """
+    Starts settings.SERVER_WORKERS worker processes that share the server port (SO_REUSEPORT),
+    so the messages are handled by several cores instead of one. Workers that die are started
+    again, and the counters of all the workers are added up and printed every
+    settings.STATS_INTERVAL seconds.
+    """
+
+    def __init__(self, workers=None):
+        """
+        Prepares the supervisor, no process is started yet.
+
+        :param workers: Number of worker processes, default settings.SERVER_WORKERS.
+        """
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise OSError("SO_REUSEPORT is not supported by this platform, set SERVER_WORKERS = 0")
+        self.workers = workers or settings.SERVER_WORKERS
+        self.processes = [None] * self.workers
+        # One row of counters per worker, in shared memory, kept when a worker is started again
+        self.values = [multiprocessing.RawArray('q', len(STAT_NAMES)) for _ in range(self.workers)]
+        self.restarts = 0
+        self.running = False
+
+    # Method to start the workers and supervise them until stopped
+    def start_server(self):
+        print(f"Server is running on {settings.HOST}:{settings.PORT} with {self.workers} workers...")
+        self.running = True
+        for index in range(self.workers):
+            self.start_worker(index)
+
+        last_stats = time.monotonic()
+        try:
+            while self.running:
+                time.sleep(settings.RESTART_DELAY)
+                for index, process in enumerate(self.processes):
+                    if not process.is_alive():
+                        print(f"Worker {index} exited with code {process.exitcode}, starting it again.")
+                        self.restarts += 1
+                        # A dead worker can't close its connections and queue counts
+                        self.values[index][ACTIVE_CONNECTIONS] = 0
+                        self.values[index][QUEUE_DEPTH] = 0
+                        self.start_worker(index)
+
+                if time.monotonic() - last_stats >= settings.STATS_INTERVAL:
+                    last_stats = time.monotonic()
+                    print(f"Stats: {self.get_stats()}")
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop_server()
+
+    # Method that starts (or starts again) one worker
+    def start_worker(self, index):
+        process = multiprocessing.Process(target=run_worker, args=(index, self.values[index]), daemon=True)
+        process.start()
+        self.processes[index] = process
+
+    # Method that adds up the counters of all the workers
+    def get_stats(self):
+        stats = dict.fromkeys(STAT_NAMES, 0)
+        for values in self.values:
+            for name, value in zip(STAT_NAMES, values):
+                stats[name] += value
+        stats['workers'] = sum(1 for process in self.processes if process is not None and process.is_alive())
+        stats['restarts'] = self.restarts
+        return stats
+
+    # Method to stop the workers
+    def stop_server(self):
+        self.running = False
+        for process in self.processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            if process is not None:
+                process.join()
+        print("Server stopped.")
@@ -0,0 +1,49 @@
+import threading
+
+# Counters of a server, by position
+CONNECTIONS = 0         # Connections accepted
+ACTIVE_CONNECTIONS = 1  # Connections open now
+MESSAGES = 2            # Messages answered
+ERRORS = 3              # Connections closed by an error
+QUEUE_DEPTH = 4         # Messages waiting for a worker now
+REJECTED = 5            # Messages answered as network busy because the queue was full
+SHED = 6                # Messages dropped from a full queue (the oldest), answered as network busy
+REFUSED = 7             # Connections closed because MAX_CONNECTIONS were open
+
+STAT_NAMES = ('connections', 'active_connections', 'messages', 'errors', 'queue_depth', 'rejected', 'shed', 'refused')
+
+
+class ServerStats:
+    """
+    Counters of a server (see STAT_NAMES). The values can be a plain list or a shared memory
+    array (multiprocessing.RawArray), so the pre-fork supervisor reads the counters of its
+    workers without asking them.
+    """
+
+    def __init__(self, values=None):
+        """
+        Creates the counters, all zero.
+
+        :param values: Sequence of len(STAT_NAMES) ints where the counters are kept, or None for a new list.
+        """
+        self.values = values if values is not None else [0] * len(STAT_NAMES)
+        # The threaded server changes the counters from several threads
+        self.lock = threading.Lock()
+
+    def add(self, stat, count=1):
+        """
+        Adds to a counter.
+
+        :param stat: Position of the counter, e.g. MESSAGES.
+        :param count: Value added, negative to subtract.
+        """
+        with self.lock:
+            self.values[stat] += count
+
+    def get_stats(self):
+        """
+        Retrieves the counters.
+
+        :return: Dict name -> value.
+        """
+        return dict(zip(STAT_NAMES, self.values))
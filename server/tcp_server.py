@@ -1,14 +1,33 @@
+import functools
+import queue
 import socket
 import threading
 import settings
-from server.message_handler import message_handler
+from iso8583 import Iso8583Framer
+from server.message_handler import ISO8583MessageHandler, get_correlation_key, get_routing_values
+from server.server_stats import ServerStats, CONNECTIONS, ACTIVE_CONNECTIONS, MESSAGES, ERRORS, REFUSED
+from server.worker_pool import WorkerPool
 
 
 class TCPServer:
-    def __init__(self):
+    def __init__(self, reuse_port=False, stats=None):
         self.host = settings.HOST
         self.port = settings.PORT
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            # Several processes listen on the same port, the kernel spreads the connections (see server/prefork.py)
+            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.stats = stats if stats is not None else ServerStats()
+        if settings.PIPELINING and settings.LENGTH_PREFIX is None:
+            raise ValueError("PIPELINING needs a LENGTH_PREFIX, the messages of a connection must be framed")
+        # Open connections are limited, the ones over the limit are closed as soon as accepted
+        self.connection_slots = None
+        if settings.MAX_CONNECTIONS > 0:
+            self.connection_slots = threading.BoundedSemaphore(settings.MAX_CONNECTIONS)
+        # The messages are run by the connection threads, or by a bounded pool of workers
+        self.pool = None
+        if settings.WORKER_THREADS > 0:
+            self.pool = WorkerPool(settings.WORKER_THREADS, settings.WORKER_QUEUE_SIZE, settings.SATURATION_POLICY, self.stats)
 
     # Method to start the server
     def start_server(self):
@@ -19,6 +38,10 @@ class TCPServer:
         while True:
             # Accept incoming connections
             conn, addr = self.server_socket.accept()
+            if self.connection_slots is not None and not self.connection_slots.acquire(blocking=False):
+                self.stats.add(REFUSED)
+                conn.close()
+                continue
             # Handle each connection in a separate thread
             client_thread = threading.Thread(target=self.handle_client, args=(conn, addr))
             client_thread.start()
@@ -26,25 +49,150 @@ class TCPServer:
     # Method that handles client connections in a separate thread
     def handle_client(self, conn, addr):
         print(f"Connection established with {addr}.")
+        self.stats.add(CONNECTIONS)
+        self.stats.add(ACTIVE_CONNECTIONS)
+        # The stream is split in length-prefixed messages (see settings.LENGTH_PREFIX), a read can carry part of
+        # one or several of them. The bytes are received straight into its buffer, allocated once per connection,
+        # and the messages are views over it, valid until the next read
+        framer = Iso8583Framer(settings.LENGTH_PREFIX, bufferSize=settings.RECV_BUFFER_SIZE)
+        handler = ISO8583MessageHandler()
         try:
+            if settings.PIPELINING:
+                self.handle_pipelined(conn, framer)
+                return
+
             while True:
-                data = conn.recv(1024)
-                if not data:
+                with framer.getWriteBuffer() as view:
+                    size = conn.recv_into(view)
+                if not size:
                     break
 
-                print(f"Received data: {data.decode()}")
+                for request_message in framer.commit(size):
+                    print(f"Received data: {bytes(request_message)}")
 
-                # Send the data to the message_handler and get the response
-                response_message = message_handler(data.decode())
+                    # Send the message to the message handler and get the response
+                    if self.pool is None:
+                        response_message = handler.message_handler(request_message)
+                    else:
+                        job = self.pool.submit(handler.message_handler, request_message)
+                        response_message = job.wait() if job is not None else None
+                        if response_message is None:  # Rejected or shed, the queue is full
+                            response_message = handler.network_busy_handler(request_message)
 
-                # Send the response back to the client
-                conn.sendall(response_message.encode())
+                    # Send the response back to the client
+                    conn.sendall(framer.pack(response_message))
+                    self.stats.add(MESSAGES)
         except Exception as e:
             print(f"Connection error: {e}")
+            self.stats.add(ERRORS)
         finally:
             conn.close()
+            self.stats.add(ACTIVE_CONNECTIONS, -1)
+            if self.connection_slots is not None:
+                self.connection_slots.release()
             print(f"Connection with {addr} closed.")
 
+    # Method that handles the messages of a connection concurrently, the responses are sent as soon as ready
+    def handle_pipelined(self, conn, framer):
+        # The client matches the responses by STAN and RRN, up to MAX_IN_FLIGHT messages run at the same time
+        in_flight = set()
+        changed = threading.Condition()  # Guards in_flight, notified when a message is answered
+        # Only the writer thread of the connection sends, the other threads queue the responses
+        outbox = queue.SimpleQueue()
+        writer = threading.Thread(target=self.write_responses, args=(conn, framer, outbox), daemon=True)
+        writer.start()
+
+        def finish(key):
+            with changed:
+                in_flight.discard(key)
+                changed.notify_all()
+
+        def run(function, request_message, key):
+            # Without worker pool, each message runs in a thread of its own
+            try:
+                outbox.put(function(request_message))
+            except Exception as e:
+                print(f"Message {key} error: {e}")
+            finally:
+                finish(key)
+
+        def reply(job, key):
+            # Called by the worker that ran the message, or by the thread that shed it from the full queue
+            try:
+                if job.shed:
+                    outbox.put(ISO8583MessageHandler().network_busy_handler(job.argument))
+                else:
+                    outbox.put(job.wait())
+            except Exception as e:
+                print(f"Message {key} error: {e}")
+            finally:
+                finish(key)
+
+        try:
+            while True:
+                with framer.getWriteBuffer() as view:
+                    size = conn.recv_into(view)
+                if not size:
+                    break
+
+                for frame in framer.commit(size):
+                    # Copied, the message is handled after the next read
+                    request_message = bytes(frame)
+                    print(f"Received data: {request_message}")
+
+                    values = get_routing_values(request_message)
+                    key = get_correlation_key(values)
+                    if key == (None, None):  # Can't be matched, so can't be a duplicate
+                        key = object()
+                    with changed:
+                        duplicate = key in in_flight
+                        if not duplicate:
+                            # Stops reading while MAX_IN_FLIGHT messages are running
+                            while len(in_flight) >= settings.MAX_IN_FLIGHT:
+                                changed.wait()
+                            in_flight.add(key)
+                    if duplicate:  # Answered at once, the message already running gets its own response
+                        print(f"Message {key} is already in flight, answered as duplicate.")
+                        outbox.put(ISO8583MessageHandler().duplicate_handler(request_message))
+                        continue
+
+                    # Each message has its own handler, they run at the same time, routed by the values read
+                    function = functools.partial(ISO8583MessageHandler().message_handler, values=values)
+                    try:
+                        if self.pool is None:
+                            threading.Thread(target=run, args=(function, request_message, key), daemon=True).start()
+                        elif self.pool.submit(function, request_message, lambda job, key=key: reply(job, key)) is None:
+                            # Rejected, the queue is full
+                            finish(key)
+                            outbox.put(ISO8583MessageHandler().network_busy_handler(request_message))
+                    except BaseException:  # Not started, its slot is given back
+                        finish(key)
+                        raise
+        finally:
+            # The messages still running are answered before the connection is closed
+            with changed:
+                while in_flight:
+                    changed.wait()
+            outbox.put(None)
+            writer.join()
+
+    # Method that sends the responses queued for a connection, until None is queued
+    def write_responses(self, conn, framer, outbox):
+        failed = False
+        while True:
+            response_message = outbox.get()
+            if response_message is None:
+                break
+            if failed:  # The connection is broken, the responses are only dropped
+                continue
+            try:
+                conn.sendall(framer.pack(response_message))
+                self.stats.add(MESSAGES)
+            except Exception as e:
+                print(f"Connection error: {e}")
+                self.stats.add(ERRORS)
+                failed = True
+
     # Method to stop the server (optional)
     def stop_server(self):
         self.server_socket.close()
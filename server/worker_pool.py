@@ -0,0 +1,141 @@
+import queue
+import threading
+from collections import deque
+from server.server_stats import QUEUE_DEPTH, REJECTED, SHED
+
+# What submit does when the queue is full
+POLICY_PAUSE = 'pause'    # Waits for room, so the connection stops reading until the workers catch up
+POLICY_REJECT = 'reject'  # Doesn't queue the new message, the caller answers it as network busy
+POLICY_SHED = 'shed'      # Drops the oldest message waiting, its caller answers it as network busy
+
+SATURATION_POLICIES = (POLICY_PAUSE, POLICY_REJECT, POLICY_SHED)
+
+
+class Job:
+    """
+    A message waiting for (or being run by) a worker of the WorkerPool.
+    """
+
+    def __init__(self, function, argument, callback=None):
+        self.function = function
+        self.argument = argument
+        self.callback = callback
+        self.result = None
+        self.error = None
+        self.shed = False
+        self.done = threading.Event()
+
+    def finish(self):
+        """
+        Marks the job as run (or shed) and calls its callback, if any, with the job.
+        """
+        self.done.set()
+        if self.callback is not None:
+            try:
+                self.callback(self)
+            except Exception as e:
+                print(f"Job callback error: {e}")
+
+    def wait(self):
+        """
+        Waits until the job is run or shed.
+
+        :return: The result of the function, or None if the job was shed.
+        :raise: The exception raised by the function.
+        """
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WorkerPool:
+    """
+    A fixed number of threads that run the messages from a bounded queue, so a traffic spike
+    makes the queue full instead of creating threads until the box swaps. What happens when
+    the queue is full is the saturation policy (POLICY_PAUSE, POLICY_REJECT or POLICY_SHED).
+    The depth of the queue and the messages rejected or shed are kept in the ServerStats of
+    the server.
+    """
+
+    def __init__(self, workers, queue_size, policy, stats):
+        """
+        Starts the worker threads.
+
+        :param workers: Number of worker threads.
+        :param queue_size: Messages that can wait for a worker.
+        :param policy: Saturation policy, POLICY_PAUSE, POLICY_REJECT or POLICY_SHED.
+        :param stats: ServerStats where the queue counters are kept.
+        """
+        if policy not in SATURATION_POLICIES:
+            raise ValueError(f"Invalid saturation policy {policy}, use one of {SATURATION_POLICIES}")
+        self.queue_size = queue_size
+        self.policy = policy
+        self.stats = stats
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.threads = [threading.Thread(target=self.run_worker, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, function, argument, callback=None, block=True):
+        """
+        Queues a message to be run by a worker, as function(argument).
+
+        :param callback: Called with the Job when it's run or shed, instead of waiting for it
+            (from the worker thread, or from the thread that shed it).
+        :param block: False to not wait for room with POLICY_PAUSE (an event loop can't wait),
+            queue.Full is raised instead and submit can be called again where it can wait.
+        :return: The Job, wait() gives the result, or None if it was rejected (POLICY_REJECT).
+        :raise: queue.Full when the queue is full, with POLICY_PAUSE and block False.
+        """
+        job = Job(function, argument, callback)
+        oldest = None
+        with self.condition:
+            if len(self.queue) >= self.queue_size:
+                if self.policy == POLICY_PAUSE and not block:
+                    raise queue.Full
+                if self.policy == POLICY_PAUSE:
+                    while len(self.queue) >= self.queue_size:
+                        self.condition.wait()
+                elif self.policy == POLICY_REJECT:
+                    self.stats.add(REJECTED)
+                    return None
+                else:
+                    oldest = self.queue.popleft()
+                    oldest.shed = True
+                    self.stats.add(SHED)
+                    self.stats.add(QUEUE_DEPTH, -1)
+            self.queue.append(job)
+            self.stats.add(QUEUE_DEPTH)
+            self.condition.notify_all()
+        # Out of the lock, the callback of the job shed can take time
+        if oldest is not None:
+            oldest.finish()
+        return job
+
+    def run_worker(self):
+        """
+        Runs the queued jobs, forever. It's the target of the worker threads.
+        """
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                job = self.queue.popleft()
+                self.stats.add(QUEUE_DEPTH, -1)
+                # A submit paused by POLICY_PAUSE can go on
+                self.condition.notify_all()
+            try:
+                job.result = job.function(job.argument)
+            except Exception as e:
+                job.error = e
+            job.finish()
+
+    def get_queue_depth(self):
+        """
+        Retrieves the number of messages waiting for a worker.
+
+        :return: Int.
+        """
+        return len(self.queue)
@@ -1,3 +1,19 @@
 # Server settings
 HOST = '127.0.0.1'  # Localhost
 PORT = 5000         # Port number to be used
+LENGTH_PREFIX = None  # Length prefix of the messages: 'BE'/'LE' (2 bytes binary, big/little-endian), 'A4' (4 ASCII digits)
+# or None, every read is one message sent back without prefix (the links without framing)
+SERVER_MODE = 'thread'  # 'thread' (one thread per connection) or 'asyncio' (all the connections in one event loop)
+HANDLER_WORKERS = 0  # asyncio mode: threads that run the message handler, 0 uses the default executor of the event loop
+LISTEN_BACKLOG = 1024  # asyncio mode: connections waiting to be accepted
+SERVER_WORKERS = 0  # Worker processes sharing the port (SO_REUSEPORT), 0 runs the server in this process only
+RESTART_DELAY = 1  # Pre-fork mode: seconds between the checks of the workers, a dead one is started again
+STATS_INTERVAL = 60  # Pre-fork mode: seconds between the prints of the counters of all the workers
+MAX_CONNECTIONS = 0  # Open connections at the same time, the next ones are closed as soon as accepted (0 = no limit)
+WORKER_THREADS = 0  # Threads that run the messages from a bounded queue (both modes), 0 runs them in the connection threads (or HANDLER_WORKERS)
+WORKER_QUEUE_SIZE = 100  # Messages that can wait for a worker thread
+SATURATION_POLICY = 'pause'  # Queue full: 'pause' (stop reading), 'reject' or 'shed' (answer network busy, 39 = 91)
+PIPELINING = False  # Run the messages of a connection at the same time, answered as ready (needs a LENGTH_PREFIX)
+# A message with the STAN and RRN of one still running is answered as duplicate transmission (39 = 94)
+MAX_IN_FLIGHT = 32  # Pipelining: messages of a connection running at the same time, reading stops over it
+RECV_BUFFER_SIZE = 4096  # Bytes read at once, each connection receives them in a buffer of this size allocated once
@@ -0,0 +1,195 @@
+import asyncio
+import socket
+import threading
+import time
+import settings
+from iso8583 import Iso8583, Iso8583Framer
+from server.async_tcp_server import AsyncTCPServer, ISO8583Protocol
+from server.message_handler import ISO8583MessageHandler
+
+
+# Sale request with the STAN given and a long bit 48, so it doesn't fit in a small receive buffer
+def build_sale(stan):
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    iso.setBit(11, stan)
+    iso.setBit(48, 'X' * 300)
+    return iso.getRawIso()
+
+
+# Starts a asyncio server on a free port, with a small receive buffer, and returns the port
+def start_server(monkeypatch, workers=0, prefix='BE'):
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    def sale(self):
+        self.prepare_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    monkeypatch.setattr(settings, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(settings, 'PORT', port)
+    monkeypatch.setattr(settings, 'LENGTH_PREFIX', prefix)
+    monkeypatch.setattr(settings, 'PIPELINING', False)
+    monkeypatch.setattr(settings, 'HANDLER_WORKERS', workers)
+    monkeypatch.setattr(settings, 'RECV_BUFFER_SIZE', 64)
+    server = AsyncTCPServer()
+    threading.Thread(target=server.start_server, daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return port
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server not started')
+
+
+# The messages are received into the framer buffer, whatever the way they are split by the stream
+def test_buffered_protocol(monkeypatch):
+    received = []
+    get_buffer = ISO8583Protocol.get_buffer
+
+    def spy(self, sizehint):
+        view = get_buffer(self, sizehint)
+        received.append(len(view))
+        return view
+
+    monkeypatch.setattr(ISO8583Protocol, 'get_buffer', spy)
+    port = start_server(monkeypatch)
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    stream = b''.join(framer.pack(build_sale('%06d' % stan)) for stan in range(1, 6))
+
+    stans = []
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        # Part of a message, then the rest with several other messages
+        conn.sendall(stream[:7])
+        time.sleep(0.1)
+        conn.sendall(stream[7:])
+        while len(stans) < 5:
+            data = conn.recv(4096)
+            assert data, 'connection closed'
+            for frame in framer.feed(data):
+                response = Iso8583()
+                response.setIsoContent(frame)
+                assert response.getBit(39) == '00'
+                stans.append(response.getBit(11))
+    assert stans == ['%06d' % stan for stan in range(1, 6)]
+    assert received and min(received) >= 64
+
+
+# A stream with an invalid length prefix is closed
+def test_invalid_stream(monkeypatch):
+    port = start_server(monkeypatch, prefix='A4')
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(b'XXXX0200')
+        assert conn.recv(4096) == b''
+
+
+# Many connections are served at the same time by the event loop, with the handlers in the executor
+def test_many_connections(monkeypatch):
+    port = start_server(monkeypatch, workers=2)
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    connections = [socket.create_connection(('127.0.0.1', port), timeout=5) for _ in range(20)]
+    try:
+        for index, conn in enumerate(connections):
+            conn.sendall(framer.pack(build_sale('%06d' % index)) * 2)
+        for index, conn in enumerate(connections):
+            client = Iso8583Framer(settings.LENGTH_PREFIX)
+            frames = []
+            while len(frames) < 2:
+                data = conn.recv(4096)
+                assert data, 'connection closed'
+                frames.extend(bytes(frame) for frame in client.feed(data))
+            for frame in frames:
+                response = Iso8583()
+                response.setIsoContent(frame)
+                assert response.getBit(11) == '%06d' % index
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+# Without length prefix (the default) every read is a message and the response is sent as it is
+def test_no_length_prefix(monkeypatch):
+    port = start_server(monkeypatch, prefix=None)
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    iso.setBit(11, '000007')
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(iso.getRawIso())
+        response = Iso8583()
+        response.setIsoContent(conn.recv(4096))
+    assert response.getBit(11) == '000007'
+    assert response.getBit(39) == '00'
+
+
+# Without HANDLER_WORKERS the handlers run in the default executor, never in the event loop
+def test_handler_out_of_event_loop(monkeypatch):
+    loops = []
+
+    def sale(self):
+        try:
+            loops.append(asyncio.get_running_loop())
+        except RuntimeError:
+            loops.append(None)
+        self.prepare_response_message().setBit(39, '00')
+
+    port = start_server(monkeypatch)
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(framer.pack(build_sale('000001')))
+        frames = []
+        while not frames:
+            data = conn.recv(4096)
+            assert data, 'connection closed'
+            frames = framer.feed(data)
+    assert loops == [None]
+
+
+# With WORKER_THREADS the handlers run in the WorkerPool, a full queue is answered as network busy
+def test_worker_pool_reject(monkeypatch):
+    def sale(self):
+        time.sleep(0.3)
+        self.prepare_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(settings, 'WORKER_THREADS', 1)
+    monkeypatch.setattr(settings, 'WORKER_QUEUE_SIZE', 1)
+    monkeypatch.setattr(settings, 'SATURATION_POLICY', 'reject')
+    port = start_server(monkeypatch)
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    connections = [socket.create_connection(('127.0.0.1', port), timeout=5) for _ in range(3)]
+    codes = []
+    try:
+        for index, conn in enumerate(connections):
+            conn.sendall(framer.pack(build_sale('%06d' % index)))
+        for conn in connections:
+            client = Iso8583Framer(settings.LENGTH_PREFIX)
+            frames = []
+            while not frames:
+                data = conn.recv(4096)
+                assert data, 'connection closed'
+                frames = [bytes(frame) for frame in client.feed(data)]
+            response = Iso8583()
+            response.setIsoContent(frames[0])
+            codes.append(response.getBit(39))
+    finally:
+        for conn in connections:
+            conn.close()
+    assert sorted(codes) == ['00', '00', '91']
+
+
+# The connections are counted as soon as accepted, the ones over MAX_CONNECTIONS are closed
+def test_max_connections(monkeypatch):
+    monkeypatch.setattr(settings, 'MAX_CONNECTIONS', 1)
+    port = start_server(monkeypatch)
+    time.sleep(0.2)  # The probe connection of start_server is closed
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as first, \
+            socket.create_connection(('127.0.0.1', port), timeout=5) as second:
+        assert second.recv(4096) == b''
+        first.sendall(Iso8583Framer(settings.LENGTH_PREFIX).pack(build_sale('000001')))
+        assert first.recv(4096)
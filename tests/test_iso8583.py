@@ -0,0 +1,158 @@
+import struct
+import pytest
+from iso8583 import Iso8583
+from iso8583.iso_errors import ValueTooLarge
+
+
+def build_sale():
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    iso.setBit(4, '000000001000')
+    iso.setBit(11, '000001')
+    iso.setBit(41, 'TERM0001')
+    return iso
+
+
+# The network form is the raw package with its size, cached until the package changes
+def test_network_iso():
+    iso = build_sale()
+    raw = iso.getRawIso()
+    assert iso.getNetworkISO() == struct.pack('!H', len(raw)) + raw
+    assert iso.getNetworkISO(False) == struct.pack('<H', len(raw)) + raw
+    assert iso.getNetworkISO() is iso.getNetworkISO()
+
+    iso.setBit(41, 'TERM0002')
+    assert iso.getRawIso() != raw
+    assert iso.getNetworkISO()[2:] == iso.getRawIso()
+
+    parsed = Iso8583()
+    parsed.setNetworkISO(iso.getNetworkISO())
+    assert parsed.getBit(41) == 'TERM0002'
+
+
+# A package larger than the 2 bytes size can't go to the network, but getRawIso still works
+def test_network_iso_too_large():
+    iso = build_sale()
+    iso.setSpec(Iso8583.DEFAULT_SPEC.redefineBit(126, '126', 'Private', 'LLLLLL', 'A', 999999, 'ans', 'A'))
+    iso.setBit(126, 'X' * 70000)
+    assert len(iso.getRawIso()) > 0xFFFF
+    with pytest.raises(ValueTooLarge):
+        iso.getNetworkISO()
+    with pytest.raises(ValueTooLarge):
+        iso.getNetworkISO(False)
+
+
+# A lazy parse gives the same values of a full parse, and the object can still be changed and built
+def test_lazy_parse():
+    raw = build_sale().getRawIso()
+    full = Iso8583()
+    full.setIsoContent(raw)
+    lazy = Iso8583(lazy=True)
+    lazy.setIsoContent(raw)
+    assert lazy.getBitsAndValues() == full.getBitsAndValues()
+    assert lazy.getRawIso() == raw
+
+    lazy.setBit(41, 'TERM0002')
+    lazy.unsetBit(4)
+    full.setBit(41, 'TERM0002')
+    full.unsetBit(4)
+    assert lazy.getRawIso() == full.getRawIso()
+
+    # A new package drops the values of the previous one
+    other = Iso8583()
+    other.setMTI('0800')
+    other.setBit(70, '301')
+    lazy.setIsoContent(other.getRawIso())
+    assert [bit['bit'] for bit in lazy.getBitsAndValues()] == ['70']
+
+
+# The bitmap has the second bitmap only when a bit over 64 is set
+def test_bitmap():
+    iso = build_sale()
+    assert iso.getBitmap() == b'3020000000800000'
+    iso.setBit(70, '301')
+    assert iso.getBitmap() == b'b0200000008000000400000000000000'
+    iso.unsetBit(70)
+    assert iso.getBitmap() == b'3020000000800000'
+
+    upper = Iso8583(bitmap_uppercase=True)
+    upper.setMTI('0200')
+    upper.setBit(41, 'TERM0001')
+    upper.setBit(70, '301')
+    assert upper.getBitmap() == b'80000000008000000400000000000000'
+    upper.setBit(5, '1')
+    assert upper.getBitmap() == b'88000000008000000400000000000000'
+    upper.setBit(8, '1')
+    assert upper.getBitmap() == b'89000000008000000400000000000000'
+    upper.setBit(6, '1')
+    assert upper.getBitmap() == b'8D000000008000000400000000000000'
+
+    packed = build_sale()
+    packed.setBITMAPformat('P')
+    parsed = Iso8583()
+    parsed.setBITMAPformat('P')
+    parsed.setIsoContent(packed.getRawIso())
+    assert parsed.getBitmap() == b'3020000000800000'
+    assert [bit['bit'] for bit in parsed.getBitsAndValues()] == ['3', '4', '11', '41']
+
+
+# The response MTI and the echoed bits come from the request, also from a lazy parse and another Spec
+def test_response_from_request():
+    assert [Iso8583(iso=b'%s0000000000000000' % mti).getResponseMTI() for mti in (b'0100', b'0220', b'0800', b'0210')] == \
+        ['0110', '0230', '0810', '0210']
+
+    request = Iso8583(lazy=True)
+    request.setIsoContent(build_sale().getRawIso())
+    response = Iso8583()
+    response.setResponseFromRequest(request)
+    response.setBit(39, '00')
+    assert response.getMTI() == '0210'
+    assert [(bit['bit'], bit['value']) for bit in response.getBitsAndValues()] == \
+        [('3', '000000'), ('4', '000000001000'), ('11', '000001'), ('39', '00'), ('41', 'TERM0001')]
+
+    other = Iso8583(spec=Iso8583.DEFAULT_SPEC.redefineBit(41, '41', 'Terminal', 'LL', 'A', 8, 'ans', 'A'))
+    other.setResponseFromRequest(request, bits=(11, 41, 42), mti='0230')
+    assert other.getMTI() == '0230'
+    assert other.getBit(41) == 'TERM0001'
+    assert other.getRawIso().endswith(b'08TERM0001')
+
+
+# The bits are iterated in order, with their raw bytes and, optionally, their values
+def test_iter_bits():
+    iso = build_sale()
+    iso.setBit(70, '301')
+    assert [(bit, value) for bit, raw, value in iso.iterBits()] == \
+        [(3, '000000'), (4, '000000001000'), (11, '000001'), (41, 'TERM0001'), (70, '301')]
+    assert [(bit, bytes(raw), value) for bit, raw, value in iso.iterBits(decode=False)][-1] == (70, b'301', None)
+
+    lazy = Iso8583(lazy=True)
+    lazy.setIsoContent(iso.getRawIso())
+    assert list((bit, value) for bit, raw, value in lazy.iterBits()) == \
+        list((bit, value) for bit, raw, value in iso.iterBits())
+    assert lazy.getAmount(4) == 1000
+
+
+# Equal packages have the same fingerprint and hash, whatever their header
+def test_fingerprint_and_equality():
+    first = build_sale()
+    second = Iso8583(hdrlen=5)
+    second.setIsoContent(b'HDR01' + first.getRawIso())
+    assert first == second
+    assert hash(first) == hash(second) == first.getFingerprint()
+    assert 0 <= first.getFingerprint() < 1 << 64
+    assert len({first, second}) == 1
+
+    second.setBit(41, 'TERM0002')
+    assert first != second
+    assert first.getFingerprint() != second.getFingerprint()
+
+
+# Packages without MTI are compared and hashed by identity, without raising
+def test_equality_without_mti():
+    first = Iso8583()
+    second = Iso8583()
+    assert first == first
+    assert first != second
+    assert (first == 'text') is False
+    assert len({first, second}) == 2
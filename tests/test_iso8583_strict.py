@@ -0,0 +1,57 @@
+from iso8583 import Iso8583
+
+
+# Package with the bits 3, 4, 11, 41 and the variable bits given (bytes of each one, length indicator included)
+def build_package(variableBits):
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    iso.setBit(4, '000000001000')
+    iso.setBit(11, '123456')
+    iso.setBit(41, 'TERM0001')
+    for bit in variableBits:
+        iso.setBit(bit, 'X')
+    raw = iso.getRawIso()
+    for bit, data in variableBits.items():
+        raw = raw.replace(iso.spec.codecs[bit].encode('X'), data)
+    return raw
+
+
+# A valid package has no errors
+def test_strict_valid_package():
+    iso = Iso8583(strict=True)
+    assert iso.setIsoContent(build_package({})) == []
+    assert iso.getBit(41) == 'TERM0001'
+
+
+# Invalid values are all reported, with their bit and offset
+def test_strict_invalid_values():
+    raw = build_package({}).replace(b'123456', b'12345A')
+    errors = Iso8583(strict=True).setIsoContent(raw)
+    assert [(bit, offset) for bit, offset, reason in errors] == [(11, raw.index(b'12345A'))]
+    assert 'not of type n' in errors[0][2]
+
+
+# A LL bit larger than the specification is an error, not a message
+def test_strict_ll_too_large(capsys):
+    raw = build_package({32: b'12' + b'1' * 12})
+    errors = Iso8583(strict=True).setIsoContent(raw)
+    assert capsys.readouterr().out == ''
+    assert [(bit, reason) for bit, offset, reason in errors] == [(32, 'value larger than the specification (12 > 11)')]
+
+
+# A LLL bit larger than the specification is an error, not an exception
+def test_strict_lll_too_large():
+    spec = Iso8583.DEFAULT_SPEC.redefineBit(48, '48', 'Additional data private', 'LLL', 'A', 20, 'ans', 'A')
+    raw = build_package({48: b'021' + b'X' * 21})
+    errors = Iso8583(spec=spec, strict=True).setIsoContent(raw)
+    assert [(bit, reason) for bit, offset, reason in errors] == [(48, 'value larger than the specification (21 > 20)')]
+
+
+# A length indicator that can't be read stops the parse with the errors found up to it
+def test_strict_malformed_length():
+    raw = build_package({32: b'0x3'}).replace(b'123456', b'12345A')
+    errors = Iso8583(strict=True).setIsoContent(raw)
+    assert [(bit, reason) for bit, offset, reason in errors] == [(11, "value '12345A' is not of type n"),
+                                                                   (32, 'length indicator cannot be decoded')]
+    assert errors[1][1] == raw.index(b'0x3')
@@ -0,0 +1,91 @@
+import pytest
+from iso8583 import Iso8583, decodeBatch, parseMany
+from iso8583 import iso_batch
+from iso8583.iso_errors import InvalidIso8583
+
+# NumPy is optional, only decodeBatch needs it
+needsNumpy = pytest.mark.skipif(iso_batch.numpy is None, reason='numpy is not installed')
+
+
+# Packages with the amount given in bit 4 and a terminal in bit 41, some with bit 48
+def build_packages(spec=None, amounts=(1000, 250, 99)):
+    packages = []
+    for index, amount in enumerate(amounts):
+        iso = Iso8583(spec=spec)
+        iso.setMTI('0200')
+        iso.setBit(3, '000000')
+        iso.setBit(4, amount)
+        iso.setBit(41, 'TERM%04d' % index)
+        if index % 2:
+            iso.setBit(48, 'DATA%d' % index)
+        packages.append(iso.getRawIso())
+    return packages
+
+
+# Fixed bits go to arrays, variable bits to objects, in the order of the packages
+@needsNumpy
+def test_decode_batch():
+    batch = decodeBatch(build_packages(), fields=(4, 41, 48))
+    assert list(batch.mti) == ['0200'] * 3
+    assert list(batch.values[4]) == [1000, 250, 99]
+    assert list(batch.values[41]) == [b'TERM0000', b'TERM0001', b'TERM0002']
+    assert list(batch.values[48]) == [None, 'DATA1', None]
+    assert list(batch.present[48]) == [False, True, False]
+    assert batch.errors == []
+
+
+# A non numeric value is reported with its package, the other packages are decoded
+@needsNumpy
+def test_decode_batch_bad_value():
+    packages = build_packages()
+    packages[1] = packages[1].replace(b'000000000250', b'0000000002X0')
+    batch = decodeBatch(packages, fields=(4, 41))
+    assert list(batch.values[4]) == [1000, 0, 99]
+    assert list(batch.present[4]) == [True, False, True]
+    assert [(index, bit) for index, bit, reason in batch.errors] == [(1, 4)]
+    assert list(batch.values[41]) == [b'TERM0000', b'TERM0001', b'TERM0002']
+
+
+# A variable bit beyond the end of a package raises with the index of the package
+@needsNumpy
+def test_decode_batch_truncated():
+    packages = build_packages()
+    packages[1] = packages[1][:-3]
+    with pytest.raises(InvalidIso8583, match='package 1'):
+        decodeBatch(packages, fields=(48,))
+
+
+# The numeric bits of a whole message EBCDIC Spec are read after the translation
+@needsNumpy
+def test_decode_batch_whole_message_ebcdic():
+    spec = Iso8583.DEFAULT_SPEC
+    spec = spec.redefineBit(4, *spec.getDefinition(4)[:6], 'E').withEbcdic()
+    batch = decodeBatch(build_packages(spec), fields=(4, 41), iso=Iso8583(spec=spec))
+    assert list(batch.values[4]) == [1000, 250, 99]
+    assert list(batch.values[41]) == [b'TERM0000', b'TERM0001', b'TERM0002']
+
+
+# parseMany gives the same values, in chunks
+def test_parse_many():
+    chunks = list(parseMany(build_packages(), fields=(4, 48), chunkSize=2))
+    assert [len(chunk['mti']) for chunk in chunks] == [2, 1]
+    assert chunks[0][4] + chunks[1][4] == ['000000001000', '000000000250', '000000000099']
+    assert chunks[0][48] + chunks[1][48] == [None, 'DATA1', None]
+
+
+# parseMany reads the header, MTI and bitmap formats given, and all the bits by default
+def test_parse_many_formats():
+    packages = []
+    for stan in ('000001', '000002'):
+        iso = Iso8583(hdrlen=5)
+        iso.setHdr(b'HDR01')
+        iso.setMTIformat('B')
+        iso.setBITMAPformat('P')
+        iso.setMTI('0200')
+        iso.setBit(11, stan)
+        packages.append(iso.getRawIso())
+    chunk, = parseMany(iter(packages), hdrlen=5, mtiFormat='B', bitmapFormat='P')
+    assert chunk['mti'] == ['0200', '0200']
+    assert chunk['bitmap'] == [1 << (128 - 11)] * 2
+    assert chunk[11] == ['000001', '000002']
+    assert chunk[3] == [None, None]
@@ -0,0 +1,148 @@
+import pytest
+import ebcdic
+from iso8583 import Iso8583
+from iso8583.iso_codecs import EBCDIC_TO_ASCII, ASCII_TO_EBCDIC, compileBit
+from iso8583.iso_codecs import _BCD_TO_INT, _INT_TO_BCD, _intToBCD, _BCDToInt, _LLLBCDToInt
+from iso8583.iso_errors import InvalidFormat, InvalidIso8583, InvalidValueType, ValueTooLarge
+
+
+# Every byte goes to ASCII and back to the same EBCDIC byte
+def test_ebcdic_tables_round_trip():
+    assert len(set(EBCDIC_TO_ASCII)) == 256
+    assert len(set(ASCII_TO_EBCDIC)) == 256
+    for b in range(256):
+        assert ASCII_TO_EBCDIC[EBCDIC_TO_ASCII[b]] == b
+        assert EBCDIC_TO_ASCII[ASCII_TO_EBCDIC[b]] == b
+
+
+# The translated bytes are the cp1148 characters, but for the euro sign and NL
+def test_ebcdic_tables_match_cp1148():
+    for b in range(256):
+        char = bytes([b]).decode('cp1148')
+        if char == '€':
+            assert EBCDIC_TO_ASCII[b] == 0xa4
+        elif b == 0x15:
+            assert EBCDIC_TO_ASCII[b] == 0x85
+        else:
+            assert EBCDIC_TO_ASCII[b] == ord(char)
+
+
+# A whole message EBCDIC package gives the same bytes and values of the per bit cp1148 one
+def test_whole_message_ebcdic_matches_per_bit():
+    whole = Iso8583.DEFAULT_SPEC.withEbcdic()
+    perBit = Iso8583.DEFAULT_SPEC
+    for bit in (2, 3, 4, 41, 43, 48):
+        smallStr, largeStr, bitType, LenForm, size, valueType, format = perBit.getDefinition(bit)
+        if LenForm != '-':
+            LenForm = 'E'
+        perBit = perBit.redefineBit(bit, smallStr, largeStr, bitType, LenForm, size, valueType, 'E')
+    values = {2: '4111111111111111', 3: '000000', 4: '000000001000', 41: 'TERM0001',
+              43: 'SHOP€\nCITY'.ljust(40), 48: 'any text'}
+
+    a = Iso8583(spec=perBit)
+    a.setMTIformat('E')
+    a.setBITMAPformat('E')
+    b = Iso8583(spec=whole)
+    for iso in (a, b):
+        iso.setMTI('0200')
+        for bit, value in values.items():
+            iso.setBit(bit, value)
+    raw = a.getRawIso()
+    assert b.getRawIso() == raw
+
+    parsed = Iso8583(spec=whole)
+    parsed.setIsoContent(raw)
+    assert parsed.getMTI() == '0200'
+    for bit, value in values.items():
+        assert parsed.getBit(bit) == value
+
+
+# Bit 101 of the default table keeps its 1 byte BCD length indicator
+def test_default_bit_101_length_is_bcd():
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(101, 'FILE')
+    assert iso.getRawIso().endswith(b'\x04FILE')
+
+
+# The packed bits of the table only fail when used in a whole message EBCDIC Spec
+def test_whole_message_ebcdic_packed_bit():
+    iso = Iso8583(spec=Iso8583.DEFAULT_SPEC.withEbcdic())
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    with pytest.raises(InvalidFormat):
+        iso.setBit(101, 'FILE')
+    with pytest.raises(InvalidFormat):
+        Iso8583.DEFAULT_SPEC.withEbcdic().redefineBit(3, '3', 'Processing code', 'N', '-', 6, 'n', 'P')
+
+
+# Every length indicator and format gives back the value set, in the package and out of it
+@pytest.mark.parametrize('bitType, LenForm, size, valueType, format, value', [
+    ('N', '-', 6, 'n', 'A', '123456'),
+    ('N', '-', 6, 'n', 'E', '123456'),
+    ('N', '-', 6, 'n', 'P', '123456'),
+    ('N', '-', 5, 'n', 'P', '12345'),
+    ('ANS', '-', 10, 'ans', 'A', 'ANY TEXT 1'),
+    ('LL', 'A', 19, 'n', 'A', '4111111111111111'),
+    ('LL', 'E', 19, 'n', 'E', '4111111111111111'),
+    ('LL', 'B', 19, 'n', 'P', '411111111111111'),
+    ('LL', 'P', 19, 'n', 'P', '4111111111111111'),
+    ('LLL', 'A', 999, 'ans', 'A', 'private data'),
+    ('LLL', 'B', 999, 'ans', 'A', 'x' * 150),
+    ('LLL', 'P', 999, 'ans', 'E', 'x' * 300),
+    ('LLLLLL', 'A', 999999, 'ans', 'A', 'y' * 1200),
+])
+def test_codec_round_trip(bitType, LenForm, size, valueType, format, value):
+    spec = Iso8583.DEFAULT_SPEC.redefineBit(48, '48', 'Test', bitType, LenForm, size, valueType, format)
+    codec = spec.codecs[48]
+    raw = codec.encode(value)
+    assert codec.decode(raw) == value
+    assert codec.check(raw) is None
+    assert codec.scan(b'..' + raw + b'..', 2) == 2 + len(raw)
+
+    iso = Iso8583(spec=spec)
+    iso.setMTI('0200')
+    iso.setBit(48, value)
+    iso.setBit(41, 'TERM0001')
+    parsed = Iso8583(spec=spec)
+    parsed.setIsoContent(iso.getRawIso())
+    assert parsed.getBit(48) == value
+    assert parsed.getBit(41) == 'TERM0001'
+
+
+# Values larger than the bit or of another value type are refused
+def test_codec_limits():
+    iso = Iso8583(strict=True)
+    with pytest.raises(ValueTooLarge):
+        iso.setBit(3, '1234567')
+    with pytest.raises(InvalidValueType):
+        iso.setBit(3, '12345A')
+    iso.setBit(3, '42')
+    assert iso.getBit(3) == '000042'
+
+
+# A length indicator larger than the bit makes the package invalid, nothing is printed
+def test_scan_larger_than_size(capsys):
+    with pytest.raises(InvalidIso8583):
+        Iso8583.DEFAULT_SPEC.codecs[32].scan(b'12' + b'1' * 12, 0)
+    with pytest.raises(ValueTooLarge):
+        Iso8583.DEFAULT_SPEC.codecs[36].scan(b'105' + b'1' * 105, 0)
+    assert capsys.readouterr().out == ''
+
+
+# The BCD and packed lookup tables give the same of the arithmetic, for every length
+def test_bcd_tables():
+    for n in range(100):
+        assert _INT_TO_BCD[n] == bytes.fromhex('%02d' % n)
+        assert _BCD_TO_INT[_INT_TO_BCD[n][0]] == n
+    for n in range(1000):
+        assert _intToBCD(n, 3) == bytes.fromhex('%04d' % n)
+        assert _LLLBCDToInt(_intToBCD(n, 3), 0) == n
+    for n in (0, 1, 99999, 123456, 999999):
+        assert _BCDToInt(_intToBCD(n, 6), 0, 3) == n
+
+    for bitType, LenForm, limit in (('LL', 'B', 99), ('LLL', 'B', 999), ('LL', 'P', 99), ('LLL', 'P', 999)):
+        codec = compileBit(48, bitType, LenForm, limit, 'ans', 'A')
+        for n in range(limit + 1):
+            raw = codec.encode('x' * n)
+            assert codec.scan(raw, 0) == len(raw)
@@ -0,0 +1,100 @@
+import os
+import sys
+import marshal
+import pytest
+from iso8583 import Iso8583, Spec
+from iso8583.iso_errors import InvalidIso8583
+from iso8583 import iso_codegen
+
+# Values of the bits set in the packages, for every Spec
+VALUES = {2: '4111111111111111', 3: '000000', 4: '1000', 11: '42', 14: '2912', 22: '051', 32: '12345',
+          35: '4111111111111111D29121010000', 41: 'TERM0001', 48: 'private data', 55: '9F02060000000010',
+          63: 'X' * 20, 102: '0123456789', 126: 'abc', 128: 'MAC00001'}
+
+# Bits redefined with other length indicators and formats
+REDEFINED = [
+    (2, '2', 'PAN', 'LL', 'B', 19, 'n', 'P'),
+    (32, '32', 'Acquirer', 'LL', 'P', 11, 'n', 'A'),
+    (48, '48', 'Private', 'LLL', 'B', 999, 'ans', 'A'),
+    (63, '63', 'Private', 'LLL', 'E', 999, 'ans', 'E'),
+    (102, '102', 'Account', 'LL', 'A', 28, 'ans', 'E'),
+    (126, '126', 'Private', 'LLLLLL', 'A', 999999, 'ans', 'A'),
+]
+
+
+def build_specs():
+    redefined = Iso8583.DEFAULT_SPEC
+    for definition in REDEFINED:
+        redefined = redefined.redefineBit(*definition)
+    return [Iso8583.DEFAULT_SPEC, redefined, Iso8583.DEFAULT_SPEC.withEbcdic()]
+
+
+# The generated code parses and builds the same of the codecs
+@pytest.mark.parametrize('spec', build_specs())
+def test_generated_code_matches_codecs(spec, tmp_path):
+    iso = Iso8583(spec=spec)
+    iso.setMTI('0200')
+    for bit, value in VALUES.items():
+        iso.setBit(bit, value)
+    raw = iso.getRawIso()
+    values = iso.parse(raw)
+
+    plain = Spec(spec.getDefinitions(), ebcdic=spec.ebcdic)
+    generated = plain.generateCode(str(tmp_path))
+    assert generated.compiled is not None
+    assert plain.compiled is None
+    other = Iso8583(spec=generated)
+    assert other.parse(raw) == values
+    assert other.build(values) == raw
+
+
+# The compiled code is kept on disk and loaded by the next start
+def test_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    first = iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(tmp_path))
+    assert [name for name in os.listdir(tmp_path) if name.endswith('.bin')] == \
+        ['iso8583_spec_%s.%s.bin' % (first.digest, sys.implementation.cache_tag)]
+
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    monkeypatch.setattr(iso_codegen, 'compile', None, raising=False)  # Not compiled again
+    assert iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(tmp_path)).digest == first.digest
+
+
+# A cached file of another source or Python version is compiled again
+def test_disk_cache_other_digest(tmp_path, monkeypatch):
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    first = iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(tmp_path))
+    path = tmp_path / ('iso8583_spec_%s.%s.bin' % (first.digest, sys.implementation.cache_tag))
+    path.write_bytes(marshal.dumps(('other', compile('raise RuntimeError', '<other>', 'exec'))))
+
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    assert iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(tmp_path)).parseBits is not None
+    assert marshal.loads(path.read_bytes())[0] == first.digest
+
+
+# A LL bit larger than the specification is an invalid package, as in the codecs
+def test_generated_code_ll_too_large():
+    iso = Iso8583(spec=Iso8583.DEFAULT_SPEC.generateCode())
+    with pytest.raises(InvalidIso8583):
+        iso.parse(b'0200' + b'0000000100000000' + b'12' + b'1' * 12)
+
+
+# A cache directory that can't be written only keeps the code in memory
+def test_disk_cache_not_writable(tmp_path, monkeypatch):
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    blocked = tmp_path / 'file'
+    blocked.write_bytes(b'')
+    compiled = iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(blocked / 'cache'))
+    assert compiled.parseBits is not None
+    assert os.listdir(tmp_path) == ['file']
+
+
+# The temporary file of a write that fails is removed
+def test_disk_cache_write_error(tmp_path, monkeypatch):
+    def replace(source, destination):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    monkeypatch.setattr(os, 'replace', replace)
+    assert iso_codegen.compileSpec(Iso8583.DEFAULT_SPEC, str(tmp_path)).parseBits is not None
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,79 @@
+import pytest
+from iso8583 import Iso8583Framer
+from iso8583.iso_errors import InvalidFormat, InvalidIso8583, ValueTooLarge
+
+FRAMES = [b'0800' + b'x' * n for n in (10, 0, 300, 5000, 1)]
+
+
+# The frames come back whatever the size of the chunks, for every length prefix
+@pytest.mark.parametrize('lenType', ['BE', 'LE', 'A4'])
+@pytest.mark.parametrize('chunkSize', [1, 3, 64, 100000])
+def test_feed(lenType, chunkSize):
+    framer = Iso8583Framer(lenType, bufferSize=64)
+    stream = b''.join(framer.pack(frame) for frame in FRAMES)
+    frames = []
+    for start in range(0, len(stream), chunkSize):
+        frames.extend(bytes(frame) for frame in framer.feed(stream[start:start + chunkSize]))
+    assert frames == FRAMES
+    assert framer.getPending() == 0
+
+
+# Received straight into the buffer, like socket.recv_into does
+def test_write_buffer():
+    framer = Iso8583Framer('BE', bufferSize=16)
+    stream = b''.join(framer.pack(frame) for frame in FRAMES)
+    frames = []
+    offset = 0
+    while offset < len(stream):
+        with framer.getWriteBuffer() as view:
+            assert len(view) >= 16
+            size = min(len(view), 7)
+            view[:size] = stream[offset:offset + size]
+        offset += size
+        frames.extend(bytes(frame) for frame in framer.commit(size))
+    assert frames == FRAMES
+
+
+# The header is counted in the length or not
+def test_header():
+    framer = Iso8583Framer('BE', hdrlen=5, hdrInLength=False)
+    packed = framer.pack(b'HDR01' + b'0800')
+    assert packed[:2] == b'\x00\x04'
+    assert framer.feed(packed + packed[:3]) == [b'HDR010800']
+    assert framer.getPending() == 3
+    framer.reset()
+    assert framer.getPending() == 0
+
+
+# The frames are views over the buffer, valid until the framer is called again
+def test_frames_are_views():
+    framer = Iso8583Framer('BE', bufferSize=8)
+    first, second = framer.feed(framer.pack(b'0800abc') + framer.pack(b'0810'))
+    assert isinstance(first, memoryview)
+    assert (first, second) == (b'0800abc', b'0810')
+    kept = first[4:]
+    framer.feed(framer.pack(b'x' * 100))  # The buffer grows while a view of an old frame is kept
+    with pytest.raises(ValueError):
+        bytes(first)
+    assert bytes(kept) == b'abc'
+
+
+# Without length prefix every chunk is a frame, sent as it is
+def test_no_prefix():
+    framer = Iso8583Framer(None)
+    assert framer.feed(b'0800abc') == [b'0800abc']
+    assert framer.feed(b'') == []
+    assert framer.pack(b'0810') == b'0810'
+    assert framer.getPending() == 0
+
+
+# Invalid prefixes and sizes are refused
+def test_errors():
+    with pytest.raises(InvalidFormat):
+        Iso8583Framer('XX')
+    with pytest.raises(InvalidIso8583):
+        Iso8583Framer('A4').feed(b'00x40800')
+    with pytest.raises(ValueTooLarge):
+        Iso8583Framer('A4').pack(b'x' * 10000)
+    with pytest.raises(ValueTooLarge):
+        Iso8583Framer('BE').pack(b'x' * 0x10000)
@@ -0,0 +1,40 @@
+from iso8583 import Iso8583, Spec
+from iso8583.iso_layout import LayoutCache, compileLayout
+
+
+# Fixed bits get their offset, variable bits restart the offsets after them
+def test_compile_layout():
+    codecs = Iso8583.DEFAULT_SPEC.codecs
+    bitmap = 0
+    for bit in (3, 4, 32, 41, 70):
+        bitmap |= 1 << (128 - bit)
+    layout = compileLayout(bitmap | 1 << 127, codecs)
+    assert [(bit, offset, fixedLen) for bit, offset, fixedLen, scan in layout] == \
+        [(3, 0, 6), (4, 6, 12), (32, 18, None), (41, 0, 8), (70, 8, 3)]
+    assert layout[2][3] is codecs[32].scan
+
+
+# The layouts are reused by bitmap, the least recently used is dropped first
+def test_layout_cache():
+    spec = Spec(Iso8583.DEFAULT_SPEC.getDefinitions(), layoutCacheSize=2)
+    iso = Iso8583(spec=spec)
+    packages = []
+    for bits in ((3,), (3, 4), (3, 4, 11)):
+        sale = Iso8583()
+        sale.setMTI('0200')
+        for bit in bits:
+            sale.setBit(bit, '1')
+        packages.append(sale.getRawIso())
+
+    for raw in packages[:2] + packages[:2]:
+        iso.setIsoContent(raw)
+    assert iso.getLayoutCacheInfo() == (2, 2, 2, 2)
+    iso.setIsoContent(packages[2])
+    iso.setIsoContent(packages[1])
+    iso.setIsoContent(packages[0])
+    assert iso.getLayoutCacheInfo() == (3, 4, 2, 2)
+
+    cache = LayoutCache(4)
+    assert cache.getLayout(1 << 125, spec.codecs) is cache.getLayout(1 << 125, spec.codecs)
+    cache.clear()
+    assert cache.cacheInfo() == (0, 0, 4, 0)
@@ -0,0 +1,61 @@
+from iso8583 import Iso8583, Iso8583Pool
+
+
+# Released objects are reset and reused
+def test_pool_recycles():
+    pool = Iso8583Pool(size=2)
+    iso = pool.acquire()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    pool.release(iso)
+    assert pool.getFree() == 2
+
+    again = pool.acquire()
+    assert again is iso
+    assert again.getBitsAndValues() == []
+    again.setMTI('0800')
+    again.setBit(70, '301')
+    assert again.getRawIso() == Iso8583(iso=again.getRawIso()).getRawIso()
+
+
+# The Spec, formats and header length changed by a handler don't leak to the next user
+def test_pool_restores_spec():
+    spec = Iso8583.DEFAULT_SPEC.redefineBit(42, '42', 'Card acceptor', 'LL', 'A', 15, 'ans', 'A')
+    pool = Iso8583Pool(size=1, spec=spec, hdrlen=5)
+    iso = pool.acquire()
+    iso.redefineBit(41, '41', 'Terminal', 'LL', 'A', 8, 'ans', 'A')
+    iso.setMTIformat('B')
+    iso.setBITMAPformat('P')
+    iso.setHdrlen(0)
+    pool.release(iso)
+
+    again = pool.acquire()
+    assert again is iso
+    assert again.getSpec() is spec
+    assert again.getBitType(41) == Iso8583.DEFAULT_SPEC.getDefinition(41)[2]
+    assert (again.MTI_format, again.BITMAP_format, again.getHdrlen()) == ('A', 'A', 5)
+
+
+# The flags changed by a handler don't leak to the next user either
+def test_pool_restores_flags():
+    pool = Iso8583Pool(size=1, lazy=True)
+    iso = pool.acquire()
+    iso.DEBUG = True
+    iso.LAZY = False
+    iso.STRICT = True
+    iso.BITMAP_UPPERCASE = True
+    pool.release(iso)
+
+    again = pool.acquire()
+    assert again is iso
+    assert (again.DEBUG, again.LAZY, again.STRICT, again.BITMAP_UPPERCASE) == (False, True, False, False)
+
+
+# Objects beyond the size of the pool are dropped
+def test_pool_size():
+    pool = Iso8583Pool(size=1)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    pool.release(None)
+    assert pool.getFree() == 1
@@ -0,0 +1,76 @@
+import json
+import os
+import pytest
+from iso8583 import Iso8583, loadSpec
+from iso8583 import iso_codegen
+from iso8583.iso_errors import InvalidDialect, InvalidLenForm
+
+DIALECT = {
+    'bits': [{'bit': 42, 'smallStr': '42', 'largeStr': 'Card acceptor identification code',
+              'bitType': 'LL', 'LenForm': 'A', 'size': 15, 'valueType': 'ans', 'format': 'A'}],
+    'subfields': {'127': [['terminalType', 2], ['batch', 6]]},
+}
+
+
+def write_dialect(directory, dialect):
+    path = directory / 'acquirer.json'
+    path.write_text(json.dumps(dialect))
+    return str(path)
+
+
+# The bits of the file are redefined over the default Spec
+def test_load_spec(tmp_path):
+    spec = loadSpec(write_dialect(tmp_path, DIALECT))
+    assert spec.getDefinition(42) == ('42', 'Card acceptor identification code', 'LL', 'A', 15, 'ans', 'A')
+    assert spec.getDefinition(41) == Iso8583.DEFAULT_SPEC.getDefinition(41)
+    assert spec.getSubfields(127) == (('terminalType', 2), ('batch', 6))
+    # Loaded again from the snapshot
+    assert os.path.exists(os.path.join(tmp_path, 'acquirer.json.snapshot'))
+    assert loadSpec(os.path.join(tmp_path, 'acquirer.json')).getDefinitions() == spec.getDefinitions()
+
+
+# The generated code goes to the cache directory given, never next to the dialect
+def test_load_spec_generate_code(tmp_path, monkeypatch):
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    config = tmp_path / 'config'
+    cache = tmp_path / 'cache'
+    config.mkdir()
+    path = write_dialect(config, DIALECT)
+
+    assert loadSpec(path, snapshot=False, generateCode=True).compiled is not None
+    assert os.listdir(config) == ['acquirer.json']
+
+    monkeypatch.setattr(iso_codegen, '_COMPILED', {})
+    assert loadSpec(path, snapshot=False, generateCode=True, cacheDir=str(cache)).compiled is not None
+    assert os.listdir(config) == ['acquirer.json']
+    assert len(os.listdir(cache)) == 1
+
+
+# Invalid dialects are refused
+def test_load_spec_invalid(tmp_path):
+    with pytest.raises(InvalidDialect):
+        loadSpec(str(tmp_path / 'missing.json'))
+    with pytest.raises(InvalidDialect):
+        loadSpec(write_dialect(tmp_path, {'bits': [{'bit': 42}]}))
+    bad = dict(DIALECT, bits=[dict(DIALECT['bits'][0], LenForm='X')])
+    with pytest.raises(InvalidLenForm):
+        loadSpec(write_dialect(tmp_path, bad), snapshot=False)
+
+
+# A Spec is never changed, redefining a bit returns a new one and objects keep theirs
+def test_spec_immutable():
+    spec = Iso8583.DEFAULT_SPEC
+    definition = spec.getDefinition(42)
+    derived = spec.redefineBit(42, '42', 'Card acceptor', 'LL', 'A', 15, 'ans', 'A')
+    assert spec.getDefinition(42) == definition
+    assert derived.getDefinition(42) == ('42', 'Card acceptor', 'LL', 'A', 15, 'ans', 'A')
+    assert derived.codecs[41] is spec.codecs[41]
+    with pytest.raises(AttributeError):
+        spec.codecs = None
+
+    iso = Iso8583()
+    iso.redefineBit(42, '42', 'Card acceptor', 'LL', 'A', 15, 'ans', 'A')
+    assert iso.getSpec() is not Iso8583.DEFAULT_SPEC
+    assert Iso8583().getBitType(42) == definition[2]
+    with pytest.raises(InvalidLenForm):
+        spec.redefineBit(42, '42', 'Card acceptor', 'LL', 'X', 15, 'ans', 'A')
@@ -0,0 +1,63 @@
+import pytest
+from iso8583 import Iso8583
+from iso8583.iso_errors import InvalidSubfield
+
+EMV = bytes.fromhex('9F02060000000010009F260811223344556677885F2A020978')
+
+
+# Bit 55 of the default Spec is TLV written as hexadecimal text, so it stays printable
+def test_default_bit_55_is_tlv_hex():
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(55, EMV.hex().upper())
+
+    parsed = Iso8583()
+    parsed.setIsoContent(iso.getRawIso())
+    assert parsed.getBit(55) == EMV.hex().upper()
+    assert parsed.getIsoContent()
+    tlv = parsed.getSubfields(55)
+    assert tlv.getNumeric('9F02') == 1000
+    assert tlv.getHex('9F26') == '1122334455667788'
+    assert '9F27' not in tlv
+
+
+# Binary EMV data needs the 'tlv' subfields
+def test_binary_tlv():
+    spec = Iso8583.DEFAULT_SPEC.redefineBit(55, '55', 'ICC data', 'LLL', 'A', 999, 'b', 'A').withSubfields(55, 'tlv')
+    iso = Iso8583(spec=spec)
+    iso.setMTI('0200')
+    iso.setBit(55, 'X')
+    parsed = Iso8583(spec=spec)
+    parsed.setIsoContent(iso.getRawIso().replace(b'001X', b'%03d' % len(EMV) + EMV))
+    assert parsed.getSubfields(55).getNumeric('9F02') == 1000
+
+
+# Fixed position subfields are decoded by name
+def test_fixed_subfields():
+    spec = Iso8583.DEFAULT_SPEC.withSubfields(127, (('terminalType', 2), ('batch', 6)))
+    iso = Iso8583(spec=spec)
+    iso.setMTI('0200')
+    iso.setBit(127, '01000042')
+    parsed = Iso8583(spec=spec)
+    parsed.setIsoContent(iso.getRawIso())
+    subfields = parsed.getSubfields(127)
+    assert subfields.get('terminalType') == '01'
+    assert subfields.get('batch') == '000042'
+    with pytest.raises(InvalidSubfield):
+        parsed.getSubfields(48)
+
+
+# A TLV in hexadecimal text is indexed over the text, only the value asked is converted
+def test_tlv_hex_text():
+    from iso8583.iso_subfields import TLV
+    text = bytearray(EMV.hex().upper().encode() + b'ZZ')
+    tlv = TLV(text, hexadecimal=True)
+    assert tlv.getHex('9F26') == '1122334455667788'
+    assert tlv.get('9F02') == bytes.fromhex('000000001000')
+    assert tlv.getNumeric('9f02') == 1000
+    with pytest.raises(InvalidSubfield):
+        tlv.getTags()
+
+    text[4:6] = b'G0'
+    with pytest.raises(InvalidSubfield):
+        TLV(text, hexadecimal=True).getHex('9F26')
@@ -0,0 +1,73 @@
+import pytest
+from iso8583 import Iso8583
+from server import message_processor
+from server.message_handler import ISO8583MessageHandler
+
+
+# Sale request with a STAN and RRN
+def build_sale():
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    iso.setBit(4, '000000001000')
+    iso.setBit(11, '000001')
+    iso.setBit(37, 'REF000000001')
+    return iso.getRawIso()
+
+
+# A projection parse only decodes the bits asked, with the MTI and bitmap
+def test_parse_projection():
+    raw = build_sale()
+    values = Iso8583().parse(raw, fields=(3, 11, 41))
+    assert values[0] == '0200'
+    assert values[3] == '000000'
+    assert values[11] == '000001'
+    assert 4 not in values and 41 not in values
+    assert Iso8583().parse(raw)[37] == 'REF000000001'
+
+
+# The message is routed from a projection, the request is only parsed by the transaction that reads it
+def test_message_handler_routes_by_projection(monkeypatch):
+    def sale(self):
+        assert self.iso_request_message is None
+        self.prepare_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    response = Iso8583()
+    response.setIsoContent(ISO8583MessageHandler().message_handler(build_sale()))
+    assert response.getMTI() == '0210'
+    assert response.getBit(39) == '00'
+    assert response.getBit(11) == '000001'
+    assert response.getBit(37) == 'REF000000001'
+
+
+# The request and response go back to the pool when the transaction logic raises
+def test_message_handler_releases_on_error(monkeypatch):
+    def sale(self):
+        raise RuntimeError('database down')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    free = message_processor.iso_pool.getFree()
+    handler = ISO8583MessageHandler()
+    with pytest.raises(RuntimeError):
+        handler.message_handler(build_sale())
+    assert handler.get_iso_request_message() is None
+    assert message_processor.iso_pool.getFree() == free
+
+
+# The correlation fields are echoed as the bytes of the request, with the MTI set by the transaction
+def test_echo_raw_correlation_fields(monkeypatch):
+    def sale(self):
+        self.get_iso_response_message().setMTI('0210')
+        self.get_iso_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    request = Iso8583()
+    request.setIsoContent(build_sale())
+    response = Iso8583()
+    response.setIsoContent(ISO8583MessageHandler().message_handler(build_sale()))
+    assert response.getMTI() == '0210'
+    raw = {bit: bytes(value) for bit, value, decoded in response.iterBits(decode=False)}
+    expected = {bit: bytes(value) for bit, value, decoded in request.iterBits(decode=False)}
+    assert (raw[11], raw[37]) == (expected[11], expected[37])
+    assert 3 not in raw and 4 not in raw
@@ -0,0 +1,102 @@
+import socket
+import threading
+import time
+import pytest
+import settings
+from iso8583 import Iso8583, Iso8583Framer
+from iso8583.iso_errors import BitNotSet
+from server.async_tcp_server import AsyncTCPServer
+from server.message_handler import ISO8583MessageHandler
+from server.tcp_server import TCPServer
+
+
+# Sale request, with STAN and RRN if stan is given
+def build_sale(stan=None):
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    if stan is not None:
+        iso.setBit(11, stan)
+        iso.setBit(37, 'REF' + stan)
+    return iso.getRawIso()
+
+
+# Starts a pipelined server of the mode given on a free port, and returns the port and the server
+def start_server(monkeypatch, mode, workers=4):
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    def sale(self):
+        time.sleep(0.2)
+        self.prepare_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    monkeypatch.setattr(settings, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(settings, 'PORT', port)
+    monkeypatch.setattr(settings, 'LENGTH_PREFIX', 'BE')
+    monkeypatch.setattr(settings, 'PIPELINING', True)
+    monkeypatch.setattr(settings, 'WORKER_THREADS', workers)
+    monkeypatch.setattr(settings, 'HANDLER_WORKERS', 4)
+    server = AsyncTCPServer() if mode == 'asyncio' else TCPServer()
+    threading.Thread(target=server.start_server, daemon=True).start()
+    for _ in range(50):
+        try:
+            socket.create_connection(('127.0.0.1', port)).close()
+            return port, server
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError('server not started')
+
+
+# Response code of each response, by STAN (None for the ones without STAN)
+def exchange(port, requests):
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    responses = []
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(b''.join(framer.pack(request) for request in requests))
+        while len(responses) < len(requests):
+            data = conn.recv(4096)
+            assert data, 'connection closed'
+            for frame in framer.feed(data):
+                response = Iso8583()
+                response.setIsoContent(frame)
+                try:
+                    stan = response.getBit(11)
+                except BitNotSet:
+                    stan = None
+                responses.append((stan, response.getBit(39)))
+    return sorted(responses, key=repr)
+
+
+# A duplicate in flight is answered as duplicate, the messages without STAN and RRN are all answered
+@pytest.mark.parametrize('mode, workers', [('thread', 4), ('thread', 0), ('asyncio', 4), ('asyncio', 0)])
+def test_pipelined_duplicates(monkeypatch, mode, workers):
+    port, server = start_server(monkeypatch, mode, workers)
+    sale = build_sale('000001')
+    responses = exchange(port, [sale, sale, build_sale('000002'), build_sale(), build_sale()])
+    assert responses == sorted([('000001', '00'), ('000001', '94'), ('000002', '00'), (None, '00'), (None, '00')],
+                               key=repr)
+
+
+# A message that can't be submitted gives its slot back, the connection is closed instead of hanging
+def test_submit_error(monkeypatch):
+    def submit(*args, **kwargs):
+        raise RuntimeError('no workers')
+
+    port, server = start_server(monkeypatch, 'thread')
+    monkeypatch.setattr(server.pool, 'submit', submit)
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(framer.pack(build_sale('000001')))
+        assert conn.recv(4096) == b''
+
+
+# Pipelining can't split the messages without length prefix
+@pytest.mark.parametrize('server_class', [TCPServer, AsyncTCPServer])
+def test_pipelining_needs_prefix(monkeypatch, server_class):
+    monkeypatch.setattr(settings, 'PIPELINING', True)
+    monkeypatch.setattr(settings, 'LENGTH_PREFIX', None)
+    with pytest.raises(ValueError):
+        server_class()
@@ -0,0 +1,85 @@
+import os
+import signal
+import socket
+import threading
+import time
+import pytest
+import settings
+from iso8583 import Iso8583, Iso8583Framer
+from server.message_handler import ISO8583MessageHandler
+from server.prefork import PreforkSupervisor
+from server.server_stats import ServerStats, MESSAGES, ACTIVE_CONNECTIONS
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, 'SO_REUSEPORT'), reason='SO_REUSEPORT is not supported')
+
+
+# The counters of the workers are added up
+def test_get_stats():
+    supervisor = PreforkSupervisor(2)
+    ServerStats(supervisor.values[0]).add(MESSAGES, 3)
+    ServerStats(supervisor.values[1]).add(MESSAGES, 4)
+    ServerStats(supervisor.values[1]).add(ACTIVE_CONNECTIONS)
+    stats = supervisor.get_stats()
+    assert (stats['messages'], stats['active_connections'], stats['workers'], stats['restarts']) == (7, 1, 0, 0)
+
+
+# Sends a sale and waits for its response
+def exchange(port):
+    framer = Iso8583Framer(settings.LENGTH_PREFIX)
+    iso = Iso8583()
+    iso.setMTI('0200')
+    iso.setBit(3, '000000')
+    with socket.create_connection(('127.0.0.1', port), timeout=5) as conn:
+        conn.sendall(framer.pack(iso.getRawIso()))
+        frames = []
+        while not frames:
+            data = conn.recv(4096)
+            assert data, 'connection closed'
+            frames = framer.feed(data)
+    response = Iso8583()
+    response.setIsoContent(frames[0])
+    return response.getBit(39)
+
+
+# The workers share the port, and a worker that dies is started again
+def test_workers(monkeypatch):
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+
+    def sale(self):
+        self.prepare_response_message().setBit(39, '00')
+
+    monkeypatch.setattr(ISO8583MessageHandler, 'process_sale', sale)
+    monkeypatch.setattr(settings, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(settings, 'PORT', port)
+    monkeypatch.setattr(settings, 'LENGTH_PREFIX', 'BE')
+    monkeypatch.setattr(settings, 'SERVER_MODE', 'asyncio')
+    monkeypatch.setattr(settings, 'RESTART_DELAY', 0.1)
+    supervisor = PreforkSupervisor(2)
+    threading.Thread(target=supervisor.start_server, daemon=True).start()
+    try:
+        for _ in range(50):
+            try:
+                assert exchange(port) == '00'
+                break
+            except OSError:
+                time.sleep(0.1)
+        for _ in range(10):
+            assert exchange(port) == '00'
+
+        time.sleep(0.2)  # The counters of the last message are added after its response is sent
+        os.kill(supervisor.processes[0].pid, signal.SIGKILL)
+        for _ in range(50):
+            time.sleep(0.1)
+            if supervisor.restarts == 1 and supervisor.get_stats()['workers'] == 2:
+                break
+        assert supervisor.restarts == 1
+        for _ in range(10):
+            assert exchange(port) == '00'
+        time.sleep(0.2)
+        assert supervisor.get_stats()['messages'] >= 21
+    finally:
+        supervisor.running = False
+        supervisor.stop_server()
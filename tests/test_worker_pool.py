@@ -0,0 +1,95 @@
+import queue
+import socket
+import threading
+import time
+import pytest
+import settings
+from server.server_stats import ServerStats, QUEUE_DEPTH, REJECTED, SHED, REFUSED
+from server.tcp_server import TCPServer
+from server.worker_pool import WorkerPool, POLICY_PAUSE, POLICY_REJECT, POLICY_SHED
+
+
+# A pool with one worker busy until the event returned is set
+def start_busy_pool(policy, queue_size=1):
+    stats = ServerStats()
+    pool = WorkerPool(1, queue_size, policy, stats)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block(argument):
+        started.set()
+        release.wait()
+        return argument
+
+    busy = pool.submit(block, 'busy')
+    started.wait(5)
+    return pool, stats, release, busy
+
+
+# The messages are run by the workers and their results waited for
+def test_submit():
+    pool = WorkerPool(2, 10, POLICY_PAUSE, ServerStats())
+    assert [pool.submit(str.upper, 'abc').wait() for _ in range(5)] == ['ABC'] * 5
+    with pytest.raises(ZeroDivisionError):
+        pool.submit(lambda x: 1 / x, 0).wait()
+    with pytest.raises(ValueError):
+        WorkerPool(1, 1, 'drop', ServerStats())
+
+
+# A full queue refuses the new message
+def test_reject():
+    pool, stats, release, busy = start_busy_pool(POLICY_REJECT)
+    queued = pool.submit(str, 'queued')
+    assert pool.submit(str, 'rejected') is None
+    assert stats.values[REJECTED] == 1
+    release.set()
+    assert (busy.wait(), queued.wait()) == ('busy', 'queued')
+
+
+# A full queue drops its oldest message, its callback is told
+def test_shed():
+    pool, stats, release, busy = start_busy_pool(POLICY_SHED)
+    shed = []
+    oldest = pool.submit(str, 'oldest', callback=lambda job: shed.append(job.shed))
+    newest = pool.submit(str, 'newest')
+    assert shed == [True]
+    assert oldest.wait() is None
+    assert stats.values[SHED] == 1
+    release.set()
+    assert newest.wait() == 'newest'
+
+
+# A full queue makes the caller wait for room
+def test_pause():
+    pool, stats, release, busy = start_busy_pool(POLICY_PAUSE)
+    pool.submit(str, 'queued')
+    done = threading.Event()
+    threading.Thread(target=lambda: (pool.submit(str, 'paused'), done.set()), daemon=True).start()
+    assert not done.wait(0.2)
+    assert stats.values[QUEUE_DEPTH] == 1
+    with pytest.raises(queue.Full):  # An event loop can't wait
+        pool.submit(str, 'not waiting', block=False)
+    release.set()
+    assert done.wait(5)
+
+
+# Connections over MAX_CONNECTIONS are closed as soon as accepted
+def test_max_connections(monkeypatch):
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    monkeypatch.setattr(settings, 'HOST', '127.0.0.1')
+    monkeypatch.setattr(settings, 'PORT', port)
+    monkeypatch.setattr(settings, 'MAX_CONNECTIONS', 1)
+    server = TCPServer()
+    threading.Thread(target=server.start_server, daemon=True).start()
+    for _ in range(50):
+        try:
+            first = socket.create_connection(('127.0.0.1', port), timeout=5)
+            break
+        except OSError:
+            time.sleep(0.05)
+    with first, socket.create_connection(('127.0.0.1', port), timeout=5) as second:
+        assert second.recv(4096) == b''
+        assert server.stats.values[REFUSED] == 1